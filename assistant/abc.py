@@ -1,6 +1,7 @@
 from abc import ABC, ABCMeta, abstractmethod
 from multiprocessing.pool import Pool
-from typing import Callable, Dict, List, Optional, Union
+from pathlib import Path
+from typing import Awaitable, Callable, Counter, Dict, List, Optional, Union
 
 import discord
 from discord.ext.commands.cog import CogMeta
@@ -8,7 +9,12 @@ from openai.types.chat.chat_completion_message import ChatCompletionMessage
 from redbot.core import commands
 from redbot.core.bot import Red
 
-from .common.models import DB, GuildSettings
+from .common.cache import AnswerCache, EmbeddingCache
+from .common.models import DB, Conversation, GuildSettings
+from .common.router import ToolRouter
+from .common.scheduler import RequestScheduler
+from .common.storage import SaveMetrics, ShardedStorage
+from .common.timing import StageMetrics
 
 
 class CompositeMetaClass(CogMeta, ABCMeta):
@@ -21,8 +27,18 @@ class MixinMeta(ABC):
     def __init__(self, *_args):
         self.bot: Red
         self.db: DB
+        self.storage: ShardedStorage
+        self.save_metrics: SaveMetrics
+        self.listener_stats: Counter[str]
+        self.answer_cache: AnswerCache
+        self.embedding_cache: EmbeddingCache
+        self.embedding_cache_path: Path
+        self.stage_metrics: StageMetrics
+        self.scheduler: RequestScheduler
+        self.tool_router: ToolRouter
         self.mp_pool: Pool
         self.registry: Dict[str, Dict[str, dict]]
+        self.vector_store_path: Path
 
     @abstractmethod
     async def openai_status(self) -> str:
@@ -38,6 +54,7 @@ class MixinMeta(ABC):
         response_token_override: int = None,
         model_override: Optional[str] = None,
         temperature_override: Optional[float] = None,
+        on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
     ) -> Union[ChatCompletionMessage, str]:
         raise NotImplementedError
 
@@ -45,6 +62,15 @@ class MixinMeta(ABC):
     async def request_embedding(self, text: str, conf: GuildSettings) -> List[float]:
         raise NotImplementedError
 
+    @abstractmethod
+    async def request_embeddings(
+        self,
+        texts: List[str],
+        conf: GuildSettings,
+        progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ) -> List[List[float]]:
+        raise NotImplementedError
+
     @abstractmethod
     async def can_call_llm(self, conf: GuildSettings, ctx: Optional[commands.Context] = None) -> bool:
         raise NotImplementedError
@@ -65,6 +91,15 @@ class MixinMeta(ABC):
     async def count_payload_tokens(self, messages: List[dict], model: str = "gpt-5.1") -> int:
         raise NotImplementedError
 
+    @abstractmethod
+    async def count_conversation_tokens(
+        self,
+        conversation: Conversation,
+        model: str = "gpt-5.1",
+        messages: Optional[List[dict]] = None,
+    ) -> int:
+        raise NotImplementedError
+
     @abstractmethod
     async def count_function_tokens(self, functions: List[dict], model: str = "gpt-5.1") -> int:
         raise NotImplementedError
@@ -88,6 +123,7 @@ class MixinMeta(ABC):
         function_list: List[dict],
         conf: GuildSettings,
         user: Optional[discord.Member],
+        conversation: Optional[Conversation] = None,
     ) -> bool:
         raise NotImplementedError
 
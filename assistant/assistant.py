@@ -1,7 +1,7 @@
 import asyncio
 import logging
 from multiprocessing.pool import Pool
-from time import perf_counter
+from time import monotonic, perf_counter
 from typing import Callable, Dict, List, Literal, Optional, Union
 
 import discord
@@ -9,10 +9,14 @@ from discord.ext import tasks
 from pydantic import ValidationError
 from redbot.core import Config, commands
 from redbot.core.bot import Red
+from redbot.core.data_manager import cog_data_path
 
 from .abc import CompositeMetaClass
 from .commands import AssistantCommands
+from .common import tokenizer
 from .common.api import API
+from .common.cache import AnswerCache, EmbeddingCache
+from .common.calls import client_registry
 from .common.chat import ChatHandler
 from .common.constants import (
     CREATE_MEMORY,
@@ -25,7 +29,18 @@ from .common.constants import (
     SEARCH_MEMORIES,
 )
 from .common.functions import AssistantFunctions
-from .common.models import DB, Embedding, EmbeddingEntryExists, NoAPIKey
+from .common.models import (
+    DB,
+    Embedding,
+    EmbeddingEntryExists,
+    NoAPIKey,
+    delete_vector_store,
+    set_vector_store_path,
+)
+from .common.router import ToolRouter
+from .common.scheduler import RequestScheduler
+from .common.storage import SaveMetrics, ShardedStorage
+from .common.timing import StageMetrics
 from .common.utils import json_schema_invalid
 from .listener import AssistantListener
 
@@ -72,7 +87,8 @@ class Assistant(
         super().__init__(*args, **kwargs)
         self.bot: Red = bot
         self.config = Config.get_conf(self, 117117117, force_registration=True)
-        self.config.register_global(db={})
+        self.config.register_global(db={}, sharded=False)
+        self.storage = ShardedStorage(self.config)
         self.db: DB = DB()
         self.mp_pool = Pool()
         self.ready_event = asyncio.Event()
@@ -81,17 +97,49 @@ class Assistant(
         # {cog_name: {function_name: {"permission_level": "user", "schema": function_json_schema}}}
         self.registry: Dict[str, Dict[str, dict]] = {}
 
-        self.saving = False
+        # Debounced config saves
+        self.save_task: Optional[asyncio.Task] = None
+        self.save_pending = False
+        self.save_pending_since = 0.0  # Monotonic time of the first unsaved request
+        self.save_requested_at = 0.0  # Monotonic time of the latest save request
+        self.save_metrics = SaveMetrics()
+        self.answer_cache = AnswerCache()
+        self.embedding_cache = EmbeddingCache()
+        self.stage_metrics = StageMetrics()
+        self.scheduler = RequestScheduler()
+        self.tool_router = ToolRouter()
         self.first_run = True
 
+    @property
+    def vector_store_path(self):
+        return cog_data_path(self) / "vectors"
+
+    @property
+    def embedding_cache_path(self):
+        return cog_data_path(self) / "embedding_cache.npz"
+
     async def cog_load(self) -> None:
         self.init_task = asyncio.create_task(self.init_cog())
 
     async def cog_unload(self):
         self.save_loop.cancel()
+        if self.save_task and not self.save_task.done():
+            # Either waiting on the debounce window or interrupted mid-write, flush now
+            self.save_task.cancel()
+            self.save_pending = True
+        if self.save_pending:
+            # Flush anything still waiting on the debounce window
+            await self._write_conf()
+        if self.db.persist_embedding_cache and self.embedding_cache:
+            try:
+                await asyncio.to_thread(self.embedding_cache.save, self.embedding_cache_path)
+            except Exception as e:
+                log.error("Failed to save embedding cache", exc_info=e)
+        self.client_eviction_loop.cancel()
         if self.endpoint_health_loop.is_running():
             self.endpoint_health_loop.cancel()
         self.mp_pool.close()
+        await client_registry.close()
         self.bot.dispatch("assistant_cog_remove")
 
     async def init_cog(self):
@@ -99,7 +147,7 @@ class Assistant(
         init_failed = False
         try:
             start = perf_counter()
-            data = await self.config.db()
+            data = await self.storage.load()
             try:
                 self.db = await asyncio.to_thread(DB.model_validate, data)
             except ValidationError:
@@ -107,9 +155,37 @@ class Assistant(
                 if "conversations" in data:
                     del data["conversations"]
                 self.db = await asyncio.to_thread(DB.model_validate, data)
+            await asyncio.to_thread(self.storage.loaded, self.db)
 
             log.info(f"Config loaded in {round((perf_counter() - start) * 1000, 2)}ms")
+            if self.db.persistent_vector_store:
+                await asyncio.to_thread(set_vector_store_path, self.vector_store_path)
             await asyncio.to_thread(self._cleanup_db)
+            client_registry.configure(
+                max_connections=self.db.http_max_connections,
+                max_keepalive_connections=self.db.http_max_keepalive,
+                idle_timeout=self.db.http_idle_timeout,
+            )
+            self.scheduler.configure(
+                max_concurrent=self.db.max_concurrent_requests,
+                max_queued=self.db.max_queued_requests,
+                rpm=self.db.rate_limit_rpm,
+                tpm=self.db.rate_limit_tpm,
+                weights=self.db.scheduler_weights,
+            )
+            self.embedding_cache.resize(self.db.embedding_cache_size)
+            if self.db.persist_embedding_cache:
+                try:
+                    loaded = await asyncio.to_thread(self.embedding_cache.load, self.embedding_cache_path)
+                    log.debug(f"Loaded {loaded} cached query embeddings")
+                except Exception as e:
+                    log.error("Failed to load embedding cache", exc_info=e)
+
+            for name, func in self.db.functions.items():
+                try:
+                    await tokenizer.prime_schema(func.jsonschema)
+                except Exception as e:
+                    log.warning(f"Failed to count tokens for custom function {name}", exc_info=e)
 
             # Register internal functions
             await self.register_function(self.qualified_name, GENERATE_IMAGE)
@@ -138,28 +214,56 @@ class Assistant(
 
         await asyncio.sleep(30)
         self.save_loop.start()
+        self.client_eviction_loop.start()
         if self.db.endpoint_override and self.db.endpoint_health_check:
             self.endpoint_health_loop.change_interval(seconds=self.db.endpoint_health_interval)
             self.endpoint_health_loop.start()
 
     async def save_conf(self):
-        if self.saving:
-            return
+        """Mark the config as dirty and schedule a save
+
+        Bursts of calls are coalesced into a single write once no new save has been requested
+        for `save_delay` seconds, or `save_max_delay` seconds after the first pending request.
+        A request made while a write is in progress always gets its own trailing save.
+        """
+        now = monotonic()
+        if not self.save_pending:
+            self.save_pending_since = now
+        self.save_pending = True
+        self.save_requested_at = now
+        self.save_metrics.requests += 1
+        if self.save_task is None or self.save_task.done():
+            self.save_task = asyncio.create_task(self._save_worker())
+
+    async def _save_worker(self):
+        while self.save_pending:
+            while True:
+                quiet_until = self.save_requested_at + self.db.save_delay
+                deadline = self.save_pending_since + self.db.save_max_delay
+                wait = min(quiet_until, deadline) - monotonic()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            await self._write_conf()
+
+    async def _write_conf(self):
+        self.save_pending = False
         try:
-            self.saving = True
             start = perf_counter()
             if not self.db.persistent_conversations:
                 self.db.conversations.clear()
-            dump = await asyncio.to_thread(self.db.model_dump)
-            await self.config.db.set(dump)
-            txt = f"Config saved in {round((perf_counter() - start) * 1000, 2)}ms"
+            stats = await self.storage.save(self.db)
+            elapsed = perf_counter() - start
+            self.save_metrics.record(elapsed, stats)
+            txt = f"Config saved in {round(elapsed * 1000, 2)}ms ({stats.shards} shards, {round(stats.size / 1024, 1)}KB)"
             if self.first_run:
                 log.info(txt)
                 self.first_run = False
+            else:
+                log.debug(txt)
         except Exception as e:
+            self.save_metrics.failures += 1
             log.error("Failed to save config", exc_info=e)
-        finally:
-            self.saving = False
         if not self.db.persistent_conversations and self.save_loop.is_running():
             self.save_loop.cancel()
 
@@ -185,6 +289,7 @@ class Assistant(
             if not guild:
                 log.debug("Cleaning up guild")
                 del self.db.configs[guild_id]
+                delete_vector_store(guild_id)
                 cleaned = True
                 continue
             conf = self.db.get_conf(guild_id)
@@ -213,6 +318,7 @@ class Assistant(
                 if not discord_obj:
                     log.debug("Cleaning up invalid blacklisted ID")
                     conf.blacklist.remove(obj_id)
+                    conf.invalidate_listener_filter()
                     cleaned = True
 
             # Ensure embedding entry names arent too long
@@ -223,7 +329,7 @@ class Assistant(
                     cleaned = True
                 new_embeddings[entry_name[:100]] = embedding
             conf.embeddings = new_embeddings
-            conf.sync_embeddings(guild_id)
+            # Vector store collections are loaded lazily on the first query for each guild
 
         health = "BAD (Cleaned)" if cleaned else "GOOD"
         log.info(f"Config health: {health}")
@@ -234,6 +340,11 @@ class Assistant(
             return
         await self.save_conf()
 
+    @tasks.loop(minutes=5)
+    async def client_eviction_loop(self):
+        """Close pooled LLM clients that have gone unused"""
+        await client_registry.evict_idle()
+
     @tasks.loop(seconds=60)
     async def endpoint_health_loop(self):
         """Monitor endpoint health and update bot presence"""
@@ -429,6 +540,8 @@ class Assistant(
 
         log.info(f"The {cog_name} cog registered a function object: {function_name}")
         self.registry[cog_name][function_name] = {"permission_level": permission_level, "schema": schema}
+        # Count the schema's tokens now so chat turns only sum cached costs
+        await tokenizer.prime_schema(schema)
         return True
 
     async def unregister_function(self, cog_name: str, function_name: str) -> None:
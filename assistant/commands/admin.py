@@ -6,6 +6,7 @@ import traceback
 import typing as t
 from datetime import datetime, timezone
 from io import BytesIO
+from time import monotonic
 from typing import List, Tuple, Union
 from zipfile import ZIP_DEFLATED, ZipFile
 
@@ -31,8 +32,10 @@ from redbot.core.utils.chat_formatting import (
 
 from ..abc import MixinMeta
 from ..common.constants import MODELS, PRICES
-from ..common.calls import list_ollama_models
-from ..common.models import DB, Embedding
+from ..common import retrieval
+from ..common.calls import client_registry, list_ollama_models
+from ..common.models import DB, Embedding, set_vector_store_path
+from ..common.ratelimit import rate_limits
 from ..common.utils import get_attachments
 from ..views import CodeMenu, EmbeddingMenu, SetAPI
 
@@ -198,6 +201,7 @@ class Admin(MixinMeta):
             valid = [i for i in conf.listen_channels if ctx.guild.get_channel(i)]
             if len(valid) != len(conf.listen_channels):
                 conf.listen_channels = valid
+                conf.invalidate_listener_filter()
                 await self.save_conf()
             embed.add_field(
                 name=_("Auto-Reply Channels"),
@@ -236,6 +240,9 @@ class Admin(MixinMeta):
             + _("`Top N Embeddings:  `{}\n").format(conf.top_n)
             + _("`Min Relatedness:   `{}\n").format(conf.min_relatedness)
             + _("`Embedding Method:  `{}\n").format(conf.embed_method)
+            + _("`Retrieval Engine:  `{} ({}, {})\n").format(
+                conf.retrieval_engine, conf.get_retrieval_engine().name, conf.retrieval_quantization
+            )
             + _("`Encodings:         `{}").format(encoded_by)
         )
 
@@ -426,6 +433,7 @@ class Admin(MixinMeta):
         embed = discord.Embed(color=ctx.author.color)
 
         overall_input = 0
+        overall_cached = 0
         overall_output = 0
         overall_tokens = 0
 
@@ -442,6 +450,7 @@ class Admin(MixinMeta):
 
             overall_tokens += usage.total_tokens
             overall_input += usage.input_tokens
+            overall_cached += usage.cached_tokens
             overall_output += usage.output_tokens
             total_cost += model_cost
             total_input_cost += input_cost
@@ -476,6 +485,8 @@ class Admin(MixinMeta):
                 humanize_number(usage.total_tokens),
                 round(model_cost, 2),
             )
+            if usage.cached_tokens:
+                field += _("\n`Cached: `{} input tokens").format(humanize_number(usage.cached_tokens))
             embed.add_field(name=model_name, value=field, inline=False)
 
         desc = _(
@@ -493,6 +504,10 @@ class Admin(MixinMeta):
             round(total_cost, 2),
             humanize_number(conf.functions_called),
         )
+        if overall_cached:
+            desc += _("`Cached:     `{} of input ({}%)\n").format(
+                humanize_number(overall_cached), round(overall_cached / max(overall_input, 1) * 100, 1)
+            )
         embed.description = desc
         return await ctx.send(embed=embed)
 
@@ -846,6 +861,7 @@ class Admin(MixinMeta):
         else:
             conf.listen_channels.append(ctx.channel.id)
             await ctx.send(_("I will now auto-respond to messages in this channel!"))
+        conf.invalidate_listener_filter()
         await self.save_conf()
 
     @assistant.command(name="sysoverride")
@@ -925,6 +941,7 @@ class Admin(MixinMeta):
                 return await ctx.send(_("Channel not found!"))
             conf.auto_answer_ignored_channels.append(channel_id)
             await ctx.send(_("Auto-answer will now ignore {}").format(mention))
+        conf.invalidate_listener_filter()
         await self.save_conf()
 
     @assistant.command(name="autoanswermodel")
@@ -1074,6 +1091,7 @@ class Admin(MixinMeta):
                 return await ctx.send(_("Channel not found!"))
             conf.trigger_ignore_channels.append(channel_id)
             await ctx.send(_("Trigger phrases will now ignore {}").format(mention))
+        conf.invalidate_listener_filter()
         await self.save_conf()
 
     @assistant.command(name="triggerlist")
@@ -1177,6 +1195,160 @@ class Admin(MixinMeta):
             await ctx.send(_("Mentions are now **Enabled**"))
         await self.save_conf()
 
+    @assistant.command(name="streaming", aliases=["stream"])
+    async def toggle_streaming(self, ctx: commands.Context):
+        """
+        Toggle streaming replies
+
+        When enabled, the reply message is posted as soon as the model starts writing and is edited as more text comes in.
+        Long replies are re-sent in full once they are complete.
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if conf.stream_responses:
+            conf.stream_responses = False
+            await ctx.send(_("Streaming replies are now **Disabled**"))
+        else:
+            conf.stream_responses = True
+            await ctx.send(_("Streaming replies are now **Enabled**"))
+        await self.save_conf()
+
+    @assistant.command(name="cachefriendly", aliases=["promptcaching"])
+    async def toggle_cache_friendly_prompts(self, ctx: commands.Context):
+        """
+        Toggle cache-friendly prompt assembly
+
+        When enabled, the system prompt, initial prompt and tool list are kept identical between turns so the provider can serve them from its prompt cache.
+        Placeholders that change every turn (like `{timestamp}`, `{balance}` or `{username}`) are shown as `[timestamp]` in the prompts, and their current values are sent right before the user's message along with any related embeddings.
+
+        The `embedmethod` setting is ignored while this is enabled.
+        Use `[p]assistant usage` to see how many input tokens were cached.
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if conf.cache_friendly_prompts:
+            conf.cache_friendly_prompts = False
+            await ctx.send(_("Cache-friendly prompts are now **Disabled**"))
+        else:
+            conf.cache_friendly_prompts = True
+            await ctx.send(_("Cache-friendly prompts are now **Enabled**"))
+        await self.save_conf()
+
+    @assistant.command(name="answercache")
+    async def toggle_answer_cache(self, ctx: commands.Context):
+        """
+        Toggle the semantic answer cache
+
+        When enabled, answers to fresh questions (no prior conversation) are remembered.
+        If someone asks a question that is similar enough to one answered before, the saved answer is sent instead of calling the model again.
+
+        Cached answers are dropped automatically when embeddings, prompts or the model change.
+        Answers that required function calls are never cached.
+        Use `[p]assistant answercacheset` to tune the similarity threshold, expiry and size.
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if conf.answer_cache:
+            conf.answer_cache = False
+            self.answer_cache.clear(ctx.guild.id)
+            await ctx.send(_("Answer cache is now **Disabled**"))
+        else:
+            conf.answer_cache = True
+            await ctx.send(_("Answer cache is now **Enabled**"))
+        await self.save_conf()
+
+    @assistant.command(name="answercacheset")
+    async def set_answer_cache(
+        self,
+        ctx: commands.Context,
+        threshold: float = None,
+        ttl: int = None,
+        max_entries: int = None,
+    ):
+        """
+        View or configure the semantic answer cache
+
+        **Arguments:**
+        - `threshold`: Min similarity (0-1) between questions to reuse an answer (default: 0.95)
+        - `ttl`: Seconds before a cached answer expires (default: 86400)
+        - `max_entries`: Max cached answers for this server (default: 200)
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if threshold is None and ttl is None and max_entries is None:
+            txt = _(
+                "`Enabled:     `{}\n`Threshold:   `{}\n`TTL:         `{}s\n`Max Entries: `{}\n`Cached:      `{}\n`Hits/Misses: `{}/{}"
+            ).format(
+                conf.answer_cache,
+                conf.answer_cache_threshold,
+                conf.answer_cache_ttl,
+                conf.answer_cache_size,
+                self.answer_cache.size(ctx.guild.id),
+                self.answer_cache.hits,
+                self.answer_cache.misses,
+            )
+            return await ctx.send(txt)
+
+        if threshold is not None:
+            if not 0 < threshold <= 1:
+                return await ctx.send(_("Threshold must be between 0 and 1"))
+            conf.answer_cache_threshold = threshold
+        if ttl is not None:
+            if ttl < 1:
+                return await ctx.send(_("TTL must be at least 1 second"))
+            conf.answer_cache_ttl = ttl
+        if max_entries is not None:
+            if max_entries < 1:
+                return await ctx.send(_("Max entries must be at least 1"))
+            conf.answer_cache_size = max_entries
+        await ctx.send(_("Answer cache settings have been updated!"))
+        await self.save_conf()
+
+    @assistant.command(name="toolrouter")
+    async def toggle_tool_router(self, ctx: commands.Context):
+        """
+        Toggle the tool router
+
+        When enabled and there are more functions available than the router's top-k, only the functions most relevant to the user's message are sent to the model, along with the core tools.
+        Each function's description is embedded once with the server's embed model and compared against the message embedding.
+
+        This saves tokens on every message when many functions are registered, at the cost of an embedding call for messages that wouldn't otherwise be embedded.
+        Use `[p]assistant toolrouterset` to change how many functions are kept and view the tokens saved.
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if conf.tool_router:
+            conf.tool_router = False
+            await ctx.send(_("Tool router is now **Disabled**"))
+        else:
+            conf.tool_router = True
+            await ctx.send(_("Tool router is now **Enabled**"))
+        await self.save_conf()
+
+    @assistant.command(name="toolrouterset")
+    async def set_tool_router(self, ctx: commands.Context, top_k: int = None):
+        """
+        View the tool router's savings or set how many functions it keeps
+
+        **Arguments:**
+        - `top_k`: Number of most relevant functions sent on top of the core tools (default: 8)
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if top_k is None:
+            stats = self.tool_router.stats.get(ctx.guild.id)
+            txt = _(
+                "`Enabled:         `{}\n`Top K:           `{}\n`Routed Turns:    `{}\n`Functions Cut:   `{}\n`Tokens Saved:    `{}\n`Avg Saved/Turn:  `{}\n`Last Turn Saved: `{}"
+            ).format(
+                conf.tool_router,
+                conf.tool_router_top_k,
+                humanize_number(stats.turns if stats else 0),
+                humanize_number(stats.dropped if stats else 0),
+                humanize_number(stats.tokens_saved if stats else 0),
+                humanize_number(round(stats.avg_saved) if stats else 0),
+                humanize_number(stats.last_saved if stats else 0),
+            )
+            return await ctx.send(txt)
+        if top_k < 1:
+            return await ctx.send(_("Top K must be at least 1"))
+        conf.tool_router_top_k = top_k
+        await ctx.send(_("Tool router will now send the top {} functions").format(top_k))
+        await self.save_conf()
+
     @assistant.command(name="collab")
     async def toggle_collab(self, ctx: commands.Context):
         """
@@ -1432,7 +1604,7 @@ class Admin(MixinMeta):
 
         if conf.api_key and "deepseek" not in model and not self.db.endpoint_override:
             try:
-                client = openai.AsyncOpenAI(api_key=conf.api_key)
+                client = client_registry.get_openai(conf.api_key)
                 await client.models.retrieve(model)
             except openai.NotFoundError as e:
                 txt = _("Error: {}").format(e.response.json()["error"]["message"])
@@ -1637,6 +1809,96 @@ class Admin(MixinMeta):
             await ctx.send(_("Embedding method has been set to **Dynamic**"))
         await self.save_conf()
 
+    @assistant.command(name="retrievalengine")
+    async def set_retrieval_engine(self, ctx: commands.Context, engine: str = None):
+        """
+        View or set the engine used to find related embeddings
+
+        **Auto** uses NumPy for servers with fewer than 50k embeddings (500k with a quantized index) and Chroma for larger ones.
+        **NumPy** compares the query against every embedding at once, it is fastest for small to medium collections and has no index to keep in sync.
+        **Chroma** uses an approximate nearest neighbor index, it scales better for very large collections.
+
+        **Arguments:**
+        - `engine`: auto, numpy or chroma
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if engine is None:
+            txt = _("Retrieval engine is set to **{}**, currently using **{}**").format(
+                conf.retrieval_engine, conf.get_retrieval_engine().name
+            )
+            return await ctx.send(txt)
+        engine = engine.lower()
+        if engine not in ("auto", "numpy", "chroma"):
+            return await ctx.send(_("Engine must be one of auto, numpy or chroma"))
+        conf.retrieval_engine = engine
+        async with ctx.typing():
+            await asyncio.to_thread(conf.sync_embeddings, ctx.guild.id)
+        await ctx.send(
+            _("Retrieval engine has been set to **{}**, currently using **{}**").format(
+                engine, conf.get_retrieval_engine().name
+            )
+        )
+        await self.save_conf()
+
+    @assistant.command(name="retrievalquant")
+    async def set_retrieval_quantization(self, ctx: commands.Context, mode: str = None, oversample: int = None):
+        """
+        View or set how the NumPy retrieval engine stores its index
+
+        **None** keeps a full float32 copy of every embedding.
+        **Int8** keeps a byte per dimension (4x smaller), **Binary** keeps a bit per dimension (32x smaller).
+
+        Quantized indexes find candidates with the compact codes, then rescore them against the original embeddings, so similarity scores and the min relatedness cutoff stay exact.
+        A higher oversample rescores more candidates, trading speed for recall. Binary usually needs a higher oversample than int8.
+        Use `[p]assistant quantbench` to compare recall and latency.
+
+        **Arguments:**
+        - `mode`: none, int8 or binary
+        - `oversample`: Candidates rescored per result (default: 10)
+        """
+        conf = self.db.get_conf(ctx.guild)
+        if mode is None and oversample is None:
+            index = retrieval.ENGINES["numpy"].cached_index(ctx.guild.id)
+            txt = _("`Quantization: `{}\n`Oversample:   `{}\n`Index Size:   `{}").format(
+                conf.retrieval_quantization,
+                conf.retrieval_oversample,
+                _("{} embeddings, {} MiB").format(humanize_number(len(index)), round(index.nbytes / 1024 / 1024, 2))
+                if index is not None
+                else _("Not built yet"),
+            )
+            return await ctx.send(txt)
+        if mode is not None:
+            mode = mode.lower()
+            if mode not in retrieval.QUANTIZATION_MODES:
+                return await ctx.send(_("Mode must be one of none, int8 or binary"))
+            conf.retrieval_quantization = mode
+        if oversample is not None:
+            if oversample < 1:
+                return await ctx.send(_("Oversample must be at least 1"))
+            conf.retrieval_oversample = oversample
+        # The engine may change with the quantization, and the index is rebuilt on the next query
+        await asyncio.to_thread(conf.sync_embeddings, ctx.guild.id)
+        await ctx.send(
+            _("Retrieval index is now **{}** with an oversample of **{}**").format(
+                conf.retrieval_quantization, conf.retrieval_oversample
+            )
+        )
+        await self.save_conf()
+
+    def _import_progress(self, message: discord.Message, message_text: str):
+        """Build a progress callback that edits the import status message at most every few seconds"""
+        last_edit = 0.0
+
+        async def progress(completed: int, total: int):
+            nonlocal last_edit
+            if completed < total and monotonic() - last_edit < 3:
+                return
+            last_edit = monotonic()
+            with contextlib.suppress(discord.HTTPException):
+                await message.edit(content=_("{}\n`Embedded: `**{}/{}**").format(message_text, completed, total))
+
+        return progress
+
     @assistant.command(name="importcsv")
     async def import_embeddings_csv(self, ctx: commands.Context, overwrite: bool):
         """Import embeddings to use with the assistant
@@ -1688,35 +1950,31 @@ class Admin(MixinMeta):
 
         df = await asyncio.to_thread(pd.concat, frames)
 
-        entries = len(df.index)
-        split_by = 10
-        if entries > 300:
-            split_by = round(entries / 25)
-        imported = 0
-        for index, row in enumerate(df.values):
+        pending: List[Tuple[str, str]] = []
+        for row in df.values:
             if pd.isna(row[0]) or pd.isna(row[1]):
                 continue
             name = str(row[0])
-            proc = _("processing")
             if name in conf.embeddings:
-                proc = _("overwriting")
                 if row[1] == conf.embeddings[name].text or not overwrite:
                     continue
-            text = str(row[1])[:4000]
-            if index and (index + 1) % split_by == 0:
-                with contextlib.suppress(discord.DiscordServerError):
-                    await message.edit(
-                        content=_("{}\n`Currently {}: `**{}** ({}/{})").format(
-                            message_text, proc, name, index + 1, len(df)
-                        )
-                    )
-            query_embedding = await self.request_embedding(text, conf)
+            pending.append((name, str(row[1])[:4000]))
+
+        vectors = await self.request_embeddings(
+            [i[1] for i in pending],
+            conf,
+            progress=self._import_progress(message, message_text),
+        )
+        imported = 0
+        failed = []
+        for (name, text), query_embedding in zip(pending, vectors):
             if len(query_embedding) == 0:
-                await ctx.send(_("Failed to process embedding: `{}`").format(name))
+                failed.append(name)
                 continue
-
             conf.embeddings[name] = Embedding(text=text, embedding=query_embedding, model=embed_model)
             imported += 1
+        if failed:
+            await ctx.send(_("Failed to process embeddings: {}").format(humanize_list([f"`{i}`" for i in failed])))
         await asyncio.to_thread(conf.sync_embeddings, ctx.guild.id)
         await message.edit(content=_("{}\n**COMPLETE**").format(message_text))
         await ctx.send(_("Successfully imported {} embeddings!").format(humanize_number(imported)))
@@ -1817,42 +2075,40 @@ class Admin(MixinMeta):
             message_text = _("Processing the following files in the background\n{}").format(box(humanize_list(files)))
             message = await ctx.send(message_text)
             df = await asyncio.to_thread(pd.concat, frames)
-            entries = len(df.index)
-            split_by = 10
-            if entries > 300:
-                split_by = round(entries / 25)
-            imported = 0
-            for index, row in df.iterrows():
+            pending = []
+            for _index, row in df.iterrows():
                 name = row["name"]
                 text = row["text"]
-                proc = _("processing")
                 if name in conf.embeddings:
-                    proc = _("overwriting")
                     if not overwrite or conf.embeddings[name].text == text:
                         continue
                 created_tz = pd.to_datetime(row["created"]).tz_localize(tz)
+                pending.append((name, text, row["ai_created"], created_tz))
 
-                if index and (index + 1) % split_by == 0:
-                    with contextlib.suppress(discord.DiscordServerError):
-                        await message.edit(
-                            content=_("{}\n`Currently {}: `**{}** ({}/{})").format(
-                                message_text, proc, name, index + 1, len(df)
-                            )
-                        )
-
-                query_embedding = await self.request_embedding(text, conf)
+            vectors = await self.request_embeddings(
+                [i[1] for i in pending],
+                conf,
+                progress=self._import_progress(message, message_text),
+            )
+            imported = 0
+            failed = []
+            for (name, text, ai_created, created_tz), query_embedding in zip(pending, vectors):
                 if len(query_embedding) == 0:
-                    await ctx.send(_("Failed to process embedding: `{}`").format(name))
+                    failed.append(name)
                     continue
 
                 conf.embeddings[name] = Embedding(
                     text=text,
                     embedding=query_embedding,
-                    ai_created=row["ai_created"],
+                    ai_created=ai_created,
                     created=created_tz,
                     model=embed_model,
                 )
                 imported += 1
+            if failed:
+                await ctx.send(
+                    _("Failed to process embeddings: {}").format(humanize_list([f"`{i}`" for i in failed]))
+                )
 
             if imported:
                 await asyncio.to_thread(conf.sync_embeddings, ctx.guild.id)
@@ -1963,7 +2219,8 @@ class Admin(MixinMeta):
             return await ctx.send(_("There are no embeddings to export!"))
 
         async with ctx.typing():
-            dump = {name: em.model_dump() for name, em in conf.embeddings.items()}
+            # Export plain float lists so the file stays portable outside the cog
+            dump = {name: {**em.model_dump(), "embedding": em.embedding.tolist()} for name, em in conf.embeddings.items()}
             json_buffer = BytesIO(orjson.dumps(dump))
             file = discord.File(json_buffer, filename="embeddings_export.json")
 
@@ -2135,6 +2392,7 @@ class Admin(MixinMeta):
         else:
             conf.blacklist.append(channel_role_member.id)
             await ctx.send(_("{} has been added to the blacklist").format(channel_role_member.name))
+        conf.invalidate_listener_filter()
         await self.save_conf()
 
     @assistant.command(name="tutor", aliases=["tutors"])
@@ -2161,6 +2419,7 @@ class Admin(MixinMeta):
         else:
             conf.tutors.append(role_or_member.id)
             await ctx.send(_("{} has been added to the tutor list").format(role_or_member.name))
+        conf.invalidate_listener_filter()
         await self.save_conf()
 
     @assistant.group(name="override")
@@ -2189,7 +2448,7 @@ class Admin(MixinMeta):
 
         if conf.api_key and "deepseek" not in model and not self.db.endpoint_override:
             try:
-                client = openai.AsyncOpenAI(api_key=conf.api_key)
+                client = client_registry.get_openai(conf.api_key)
                 await client.models.retrieve(model)
             except openai.NotFoundError as e:
                 txt = _("Error: {}").format(e.response.json()["error"]["message"])
@@ -2323,11 +2582,11 @@ class Admin(MixinMeta):
     async def _validate_embedding_endpoint(self, model: str) -> Tuple[bool, str, int]:
         try:
             if self.db.endpoint_override:
-                client = ollama.AsyncClient(host=self.db.endpoint_override)
+                client = client_registry.get_ollama(self.db.endpoint_override)
                 response = await client.embed(model=model, input="test")
                 embedding = response.embeddings[0] if response.embeddings else []
             else:
-                client = openai.AsyncOpenAI(api_key="unprotected", base_url=self.db.endpoint_override)
+                client = client_registry.get_openai("unprotected", self.db.endpoint_override)
                 response = await client.embeddings.create(input="test", model=model)
                 embedding = response.data[0].embedding if response.data else []
         except openai.AuthenticationError as e:
@@ -2360,7 +2619,7 @@ class Admin(MixinMeta):
             log.debug("Failed Ollama detection for %s: %s", url, e)
 
         try:
-            client = openai.AsyncOpenAI(api_key="unprotected", base_url=url)
+            client = client_registry.get_openai("unprotected", url)
             response = await client.models.list()
             names = [m.id for m in getattr(response, "data", [])]
             return True, "", False, names
@@ -2508,6 +2767,385 @@ class Admin(MixinMeta):
 
         await self.save_conf()
 
+    @assistant.command(name="httppool")
+    @commands.is_owner()
+    async def set_http_pool(
+        self,
+        ctx: commands.Context,
+        max_connections: int = None,
+        max_keepalive: int = None,
+        idle_timeout: int = None,
+    ):
+        """
+        View or set the connection pool limits for LLM API clients
+
+        API clients are shared between requests so connections are kept alive and reused.
+
+        **Arguments:**
+        - `max_connections`: Max concurrent connections per client (default: 100)
+        - `max_keepalive`: Max idle connections kept open per client (default: 20)
+        - `idle_timeout`: Seconds before an unused client is closed (default: 900, min: 60)
+
+        **Note:** Existing clients are retired and replaced by clients using the new limits.
+        """
+        if max_connections is None and max_keepalive is None and idle_timeout is None:
+            txt = _(
+                "`Max Connections: `{}\n`Max Keepalive:   `{}\n`Idle Timeout:    `{}s\n`Active Clients:  `{}"
+            ).format(
+                self.db.http_max_connections,
+                self.db.http_max_keepalive,
+                self.db.http_idle_timeout,
+                len(client_registry),
+            )
+            return await ctx.send(txt)
+
+        if max_connections is not None:
+            if max_connections < 1:
+                return await ctx.send(_("Max connections must be at least 1"))
+            self.db.http_max_connections = max_connections
+        if max_keepalive is not None:
+            if max_keepalive < 0:
+                return await ctx.send(_("Max keepalive cannot be negative"))
+            self.db.http_max_keepalive = max_keepalive
+        if idle_timeout is not None:
+            if idle_timeout < 60:
+                return await ctx.send(_("Idle timeout must be at least 60 seconds"))
+            self.db.http_idle_timeout = idle_timeout
+
+        client_registry.configure(
+            max_connections=self.db.http_max_connections,
+            max_keepalive_connections=self.db.http_max_keepalive,
+            idle_timeout=self.db.http_idle_timeout,
+        )
+        await ctx.send(_("Connection pool limits have been updated!"))
+        await self.save_conf()
+
+    @assistant.command(name="savedelay")
+    @commands.is_owner()
+    async def set_save_delay(self, ctx: commands.Context, delay: float = None, max_delay: float = None):
+        """
+        View save stats or set how long config saves are debounced
+
+        Changes made in quick succession are coalesced into a single config write.
+
+        **Arguments:**
+        - `delay`: Seconds without new changes before saving (default: 5)
+        - `max_delay`: Max seconds a change can wait before it is saved (default: 60)
+        """
+        if delay is None and max_delay is None:
+            metrics = self.save_metrics
+            txt = _(
+                "`Save Delay:     `{}s\n"
+                "`Max Save Delay: `{}s\n"
+                "`Save Requests:  `{}\n"
+                "`Saves:          `{} ({} coalesced, {} failed)\n"
+                "`Avg Save Time:  `{}ms (max {}ms)\n"
+                "`Last Save:      `{}ms, {} shards, {}KB"
+            ).format(
+                self.db.save_delay,
+                self.db.save_max_delay,
+                metrics.requests,
+                metrics.saves,
+                metrics.coalesced,
+                metrics.failures,
+                round(metrics.avg_time * 1000, 2),
+                round(metrics.max_time * 1000, 2),
+                round(metrics.last_time * 1000, 2),
+                metrics.last_shards,
+                round(metrics.last_size / 1024, 1),
+            )
+            return await ctx.send(txt)
+
+        if delay is not None:
+            if delay < 0:
+                return await ctx.send(_("Save delay cannot be negative"))
+            self.db.save_delay = delay
+        if max_delay is not None:
+            if max_delay < self.db.save_delay:
+                return await ctx.send(_("Max save delay cannot be lower than the save delay"))
+            self.db.save_max_delay = max_delay
+        await ctx.send(_("Save delay has been updated!"))
+        await self.save_conf()
+
+    @assistant.command(name="embedcache")
+    @commands.is_owner()
+    async def set_embedding_cache(self, ctx: commands.Context, max_entries: int = None, persist: bool = None):
+        """
+        View or configure the query embedding cache
+
+        Text embedded for chat, auto-answer and memory searches is cached so the same text is never embedded twice.
+
+        **Arguments:**
+        - `max_entries`: Max embeddings to keep in memory, 0 to disable (default: 2048)
+        - `persist`: Whether to save the cache to disk when the cog unloads (default: False)
+        """
+        if max_entries is None and persist is None:
+            cache = self.embedding_cache
+            txt = _("`Entries:     `{}/{}\n`Persistent:  `{}\n`Hits/Misses: `{}/{}").format(
+                len(cache),
+                self.db.embedding_cache_size,
+                self.db.persist_embedding_cache,
+                cache.hits,
+                cache.misses,
+            )
+            return await ctx.send(txt)
+
+        if max_entries is not None:
+            if max_entries < 0:
+                return await ctx.send(_("Max entries cannot be negative"))
+            self.db.embedding_cache_size = max_entries
+            self.embedding_cache.resize(max_entries)
+        if persist is not None:
+            self.db.persist_embedding_cache = persist
+            if not persist and self.embedding_cache_path.exists():
+                self.embedding_cache_path.unlink()
+        await ctx.send(_("Embedding cache settings have been updated!"))
+        await self.save_conf()
+
+    @assistant.command(name="listenerstats")
+    @commands.is_owner()
+    async def view_listener_stats(self, ctx: commands.Context, reset: bool = False):
+        """
+        View where auto-reply messages are being filtered out
+
+        Shows how many messages were dropped at each stage of the auto-reply listener since the cog was loaded.
+
+        **Arguments:**
+        - `reset`: Reset the counters after viewing them
+        """
+        stats = self.listener_stats
+        if not stats:
+            return await ctx.send(_("No messages have been processed yet!"))
+        width = max(len(stage) for stage in stats)
+        lines = [f"{stage.ljust(width)} {humanize_number(count)}" for stage, count in stats.most_common()]
+        await ctx.send(box("\n".join(lines), lang="py"))
+        if reset:
+            stats.clear()
+
+    @assistant.command(name="scheduler")
+    @commands.is_owner()
+    async def set_scheduler(
+        self,
+        ctx: commands.Context,
+        max_concurrent: int = None,
+        max_queued: int = None,
+        rpm: int = None,
+        tpm: int = None,
+    ):
+        """
+        View queue stats or configure the request scheduler
+
+        LLM and embedding requests from every guild share a limited number of slots.
+        Waiting requests are served fairly between guilds, and between users within a guild.
+
+        **Arguments:**
+        - `max_concurrent`: Max requests in flight at once across all guilds (default: 8)
+        - `max_queued`: Max requests a single guild can have waiting, 0 for no limit (default: 50)
+        - `rpm`: Requests per minute allowed per API key, 0 for no limit (default: 0)
+        - `tpm`: Tokens per minute allowed per API key, 0 for no limit (default: 0)
+        """
+        scheduler = self.scheduler
+        if all(i is None for i in (max_concurrent, max_queued, rpm, tpm)):
+            txt = _(
+                "`Max Concurrent: `{}\n"
+                "`Max Queued:     `{}\n"
+                "`RPM/TPM Limit:  `{}/{}\n"
+                "`In Flight:      `{}\n"
+                "`Queued:         `{}\n"
+                "`Rate Limited:   `{} ({}s total wait)"
+            ).format(
+                scheduler.max_concurrent,
+                scheduler.max_queued,
+                scheduler.rpm,
+                scheduler.tpm,
+                scheduler.in_flight,
+                scheduler.queued,
+                scheduler.rate_limited,
+                round(scheduler.rate_limit_wait, 1),
+            )
+            stats = sorted(scheduler.queue_stats().items(), key=lambda x: x[1].admitted, reverse=True)
+            if stats:
+                lines = [f"{'guild':<20} {'queued':>6} {'peak':>5} {'served':>7} {'rejected':>8} {'avg wait':>9}"]
+                for guild_id, queue in stats[:15]:
+                    guild = self.bot.get_guild(guild_id)
+                    name = guild.name[:20] if guild else str(guild_id)
+                    lines.append(
+                        f"{name:<20} {queue.waiting:>6} {queue.peak:>5} {queue.admitted:>7} "
+                        f"{queue.rejected:>8} {queue.avg_wait:>8.2f}s"
+                    )
+                txt += "\n" + box("\n".join(lines), lang="py")
+            return await ctx.send(txt)
+
+        if max_concurrent is not None:
+            if max_concurrent < 1:
+                return await ctx.send(_("Max concurrent requests must be at least 1"))
+            self.db.max_concurrent_requests = max_concurrent
+        if max_queued is not None:
+            if max_queued < 0:
+                return await ctx.send(_("Max queued requests cannot be negative"))
+            self.db.max_queued_requests = max_queued
+        if rpm is not None:
+            if rpm < 0:
+                return await ctx.send(_("Requests per minute cannot be negative"))
+            self.db.rate_limit_rpm = rpm
+        if tpm is not None:
+            if tpm < 0:
+                return await ctx.send(_("Tokens per minute cannot be negative"))
+            self.db.rate_limit_tpm = tpm
+        scheduler.configure(
+            max_concurrent=self.db.max_concurrent_requests,
+            max_queued=self.db.max_queued_requests,
+            rpm=self.db.rate_limit_rpm,
+            tpm=self.db.rate_limit_tpm,
+            weights=self.db.scheduler_weights,
+        )
+        await ctx.send(_("Scheduler settings have been updated!"))
+        await self.save_conf()
+
+    @assistant.command(name="ratelimits")
+    @commands.is_owner()
+    async def view_rate_limits(self, ctx: commands.Context):
+        """
+        View the rate limit budget providers last reported for each API key
+
+        Keys are shown as a short hash. When a key is rate limited every request using it backs off until the provider's reset time.
+        """
+        budgets = rate_limits.budgets()
+        if not budgets:
+            return await ctx.send(_("No rate limit headers have been received yet!"))
+        now = monotonic()
+
+        def _fmt(remaining: t.Optional[int], limit: t.Optional[int]) -> str:
+            if remaining is None:
+                return "?"
+            return f"{humanize_number(remaining)}/{humanize_number(limit) if limit else '?'}"
+
+        lines = [f"{'key':<16} {'requests':>15} {'tokens':>21} {'429s':>5} {'blocked':>8}"]
+        for key, budget in budgets.items():
+            budget.refresh(now)
+            lines.append(
+                f"{key:<16} {_fmt(budget.remaining_requests, budget.limit_requests):>15} "
+                f"{_fmt(budget.remaining_tokens, budget.limit_tokens):>21} {budget.rate_limited:>5} "
+                f"{max(budget.blocked_until - now, 0):>7.1f}s"
+            )
+        await ctx.send(box("\n".join(lines), lang="py"))
+
+    @assistant.command(name="schedulerweight")
+    @commands.is_owner()
+    async def set_scheduler_weight(self, ctx: commands.Context, guild_id: int, weight: float):
+        """
+        Set a guild's share of the request slots relative to other guilds
+
+        A guild with a weight of 2 gets twice the throughput of a guild with the default weight of 1 when both are busy.
+
+        **Arguments:**
+        - `guild_id`: ID of the guild
+        - `weight`: Relative share, set to 1 to reset
+        """
+        if weight <= 0:
+            return await ctx.send(_("Weight must be greater than 0"))
+        if weight == 1:
+            self.db.scheduler_weights.pop(guild_id, None)
+        else:
+            self.db.scheduler_weights[guild_id] = weight
+        self.scheduler.weights = dict(self.db.scheduler_weights)
+        await ctx.send(_("Scheduler weight for {} set to {}").format(f"`{guild_id}`", weight))
+        await self.save_conf()
+
+    @assistant.command(name="stagetimings")
+    @commands.is_owner()
+    async def view_stage_timings(self, ctx: commands.Context, reset: bool = False):
+        """
+        View how long each stage of preparing a chat request takes
+
+        The embedding, bank and function stages run concurrently, so `total` (everything before the LLM is called) should track the slowest of them rather than their sum.
+
+        **Arguments:**
+        - `reset`: Reset the timings after viewing them
+        """
+        metrics = self.stage_metrics
+        if not metrics:
+            return await ctx.send(_("No chat requests have been timed yet!"))
+        width = max(len(stage) for stage in metrics.stages)
+        lines = [f"{'stage'.ljust(width)} {'count':>6} {'avg':>8} {'max':>7} {'last':>7}"]
+        for stage, stats in metrics.stages.items():
+            lines.append(
+                f"{stage.ljust(width)} {stats.count:>6} "
+                f"{stats.avg * 1000:>6.0f}ms {stats.max * 1000:>5.0f}ms {stats.last * 1000:>5.0f}ms"
+            )
+        await ctx.send(box("\n".join(lines), lang="py"))
+        if reset:
+            metrics.clear()
+
+    @assistant.command(name="retrievalbench")
+    @commands.is_owner()
+    async def benchmark_retrieval(
+        self,
+        ctx: commands.Context,
+        entries: int = 10000,
+        dimensions: int = 1536,
+        queries: int = 50,
+    ):
+        """
+        Benchmark the NumPy and Chroma retrieval engines on random embeddings
+
+        Recall is how many of the exact top results Chroma's approximate index found.
+
+        **Arguments:**
+        - `entries`: Number of embeddings to search (default: 10000)
+        - `dimensions`: Embedding dimensions (default: 1536)
+        - `queries`: Number of queries to time (default: 50)
+        """
+        if not 1 <= entries <= 500_000 or not 1 <= dimensions <= 4096 or not 1 <= queries <= 1000:
+            return await ctx.send(_("Entries must be 1-500000, dimensions 1-4096 and queries 1-1000"))
+        async with ctx.typing():
+            results = await asyncio.to_thread(retrieval.benchmark, entries, dimensions, queries)
+        lines = [f"{'engine':<8} {'build':>9} {'avg':>8} {'p50':>8} {'p95':>8} {'recall':>7}"]
+        for engine, stats in results.items():
+            lines.append(
+                f"{engine:<8} {stats['build_ms']:>7.0f}ms {stats['avg_ms']:>6.2f}ms "
+                f"{stats['p50_ms']:>6.2f}ms {stats['p95_ms']:>6.2f}ms {stats['recall']:>7.1%}"
+            )
+        await ctx.send(
+            _("{} embeddings, {} dimensions, {} queries").format(entries, dimensions, queries)
+            + box("\n".join(lines), lang="py")
+        )
+
+    @assistant.command(name="quantbench")
+    @commands.is_owner()
+    async def benchmark_quantization(
+        self,
+        ctx: commands.Context,
+        entries: int = 100000,
+        dimensions: int = 1536,
+        queries: int = 50,
+    ):
+        """
+        Benchmark recall vs latency of the quantized retrieval indexes on random embeddings
+
+        Each quantization mode is timed at several oversample levels, recall is measured against exact float32 search.
+        Random vectors are a worst case, real embeddings usually quantize with higher recall.
+
+        **Arguments:**
+        - `entries`: Number of embeddings to search (default: 100000)
+        - `dimensions`: Embedding dimensions (default: 1536)
+        - `queries`: Number of queries to time (default: 50)
+        """
+        if not 1 <= entries <= 500_000 or not 1 <= dimensions <= 4096 or not 1 <= queries <= 1000:
+            return await ctx.send(_("Entries must be 1-500000, dimensions 1-4096 and queries 1-1000"))
+        async with ctx.typing():
+            results = await asyncio.to_thread(retrieval.benchmark_quantization, entries, dimensions, queries)
+        lines = [f"{'mode':<8} {'over':>4} {'size':>9} {'avg':>8} {'p95':>8} {'recall':>7}"]
+        for row in results:
+            lines.append(
+                f"{row['mode']:<8} {row['oversample']:>4} {row['index_mib']:>6.1f}MiB "
+                f"{row['avg_ms']:>6.2f}ms {row['p95_ms']:>6.2f}ms {row['recall']:>7.1%}"
+            )
+        await ctx.send(
+            _("{} embeddings, {} dimensions, {} queries").format(entries, dimensions, queries)
+            + box("\n".join(lines), lang="py")
+        )
+
     @assistant.group(name="ollama")
     @commands.is_owner()
     async def ollama_group(self, ctx: commands.Context):
@@ -2572,9 +3210,11 @@ class Admin(MixinMeta):
         if not self.db.endpoint_is_ollama:
             await ctx.send(_("⚠️ Endpoint has not been detected as Ollama; attempting to pull anyway."))
         status_msg = await ctx.send(_("Pulling `{}` from Ollama... this may take a while.").format(model))
-        client = ollama.AsyncClient(host=self.db.endpoint_override)
+        client = client_registry.get_ollama(self.db.endpoint_override)
         try:
-            await client.pull(model)
+            # Pulls can take longer than the idle timeout, keep the client from being closed mid-download
+            with client_registry.in_use(client):
+                await client.pull(model)
             await status_msg.edit(content=_("✅ Pulled `{}` successfully.").format(model))
         except Exception as e:  # noqa: BLE001
             log.error("Failed to pull Ollama model %s", model, exc_info=e)
@@ -2601,9 +3241,10 @@ class Admin(MixinMeta):
             )
         if not self.db.endpoint_is_ollama:
             await ctx.send(_("⚠️ Endpoint has not been detected as Ollama; attempting to delete anyway."))
-        client = ollama.AsyncClient(host=self.db.endpoint_override)
+        client = client_registry.get_ollama(self.db.endpoint_override)
         try:
-            await client.delete(model)
+            with client_registry.in_use(client):
+                await client.delete(model)
         except Exception as e:  # noqa: BLE001
             log.error("Failed to delete Ollama model %s", model, exc_info=e)
             return await ctx.send(_("❌ Failed to delete `{}`: {}").format(model, e))
@@ -2720,6 +3361,7 @@ class Admin(MixinMeta):
             )
         dump = await attachments[0].read()
         self.db = await asyncio.to_thread(DB.parse_raw, dump)
+        self.storage.reset()
         await ctx.send(_("Cog has been restored!"))
         await self.save_conf()
 
@@ -2750,6 +3392,25 @@ class Admin(MixinMeta):
             await ctx.send(_("Persistent conversations have been **Enabled**"))
         await self.save_conf()
 
+    @assistant.command(name="persistvectors")
+    @commands.is_owner()
+    async def toggle_persistent_vectors(self, ctx: commands.Context):
+        """
+        Toggle keeping embedding indexes on disk between restarts
+
+        When enabled, embedding indexes are stored in the cog's data folder and only rebuilt when a server's embeddings change.
+        When disabled, indexes are kept in memory and rebuilt the first time each server is queried after a restart.
+        """
+        if self.db.persistent_vector_store:
+            self.db.persistent_vector_store = False
+            await asyncio.to_thread(set_vector_store_path, None)
+            await ctx.send(_("Embedding indexes will now be kept **in memory**"))
+        else:
+            self.db.persistent_vector_store = True
+            await asyncio.to_thread(set_vector_store_path, self.vector_store_path)
+            await ctx.send(_("Embedding indexes will now be **persisted to disk**"))
+        await self.save_conf()
+
     @assistant.command(name="resetglobalembeddings")
     @commands.is_owner()
     async def wipe_global_embeddings(self, ctx: commands.Context, yes_or_no: bool):
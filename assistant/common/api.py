@@ -3,11 +3,11 @@ import inspect
 import json
 import logging
 import math
-from typing import List, Optional
+from functools import partial
+from typing import Awaitable, Callable, List, Optional
 
 import aiohttp
 import discord
-import tiktoken
 import openai
 import ollama
 from openai.types.chat.chat_completion import ChatCompletion
@@ -19,9 +19,24 @@ from redbot.core.i18n import Translator, cog_i18n
 from redbot.core.utils.chat_formatting import box, humanize_number
 
 from ..abc import MixinMeta
-from .calls import request_chat_completion_raw, request_embedding_raw
-from .constants import MODELS, VISION_COSTS
-from .models import GuildSettings
+from . import tokenizer
+from .calls import (
+    OnDelta,
+    request_chat_completion_raw,
+    request_embedding_raw,
+    request_embeddings_raw,
+)
+from .constants import (
+    EMBED_BATCH_SIZE,
+    EMBED_BATCH_TOKENS,
+    EMBED_CONCURRENCY,
+    FUNCTION_TOKEN_OVERHEAD,
+    MODELS,
+)
+from .models import Conversation, GuildSettings
+from .ratelimit import is_input_too_large
+from .scheduler import QueueFull
+from .utils import plan_degradation
 
 log = logging.getLogger("red.vrt.assistant.api")
 _ = Translator("Assistant", __file__)
@@ -63,6 +78,7 @@ class API(MixinMeta):
         response_token_override: int = None,
         model_override: Optional[str] = None,
         temperature_override: Optional[float] = None,
+        on_delta: Optional[OnDelta] = None,
     ) -> ChatCompletionMessage:
         model = model_override or conf.get_chat_model(
             self.db.endpoint_override,
@@ -106,13 +122,16 @@ class API(MixinMeta):
             await self.save_conf()
 
         allow_all_ollama_tools = (conf.ollama_tool_scope or "").lower() == "all"
+        api_key = conf.api_key or "unprotected" if self.db.endpoint_override else conf.api_key
+        estimated_tokens = current_convo_tokens + response_tokens
 
         try:
+            # The slot is taken per attempt, retries back off without holding it
             response = await request_chat_completion_raw(
                 model=model,
                 messages=messages,
                 temperature=temperature_override if temperature_override is not None else conf.temperature,
-                api_key=conf.api_key or "unprotected" if self.db.endpoint_override else conf.api_key,
+                api_key=api_key,
                 max_tokens=response_tokens,
                 functions=functions,
                 frequency_penalty=conf.frequency_penalty,
@@ -122,7 +141,18 @@ class API(MixinMeta):
                 reasoning_effort=conf.reasoning_effort,
                 verbosity=conf.verbosity,
                 allow_all_ollama_tools=allow_all_ollama_tools,
+                on_delta=on_delta,
+                slot=partial(
+                    self.scheduler.slot,
+                    self.get_request_guild(conf, member),
+                    getattr(member, "id", 0),
+                    api_key,
+                    estimated_tokens,
+                ),
             )
+        except QueueFull as e:
+            log.warning(f"Chat request rejected: {e}")
+            raise commands.UserFeedbackCheckFailure(_("Too many requests are queued, try again in a moment.")) from e
         except openai.OpenAIError as e:
             log.error("OpenAI chat completion failed", exc_info=e)
             raise commands.UserFeedbackCheckFailure(_("OpenAI request failed: {}").format(e)) from e
@@ -135,12 +165,25 @@ class API(MixinMeta):
 
         if isinstance(response, ChatCompletion):
             message: ChatCompletionMessage = response.choices[0].message
-            conf.update_usage(
-                response.model,
-                response.usage.total_tokens,
-                response.usage.prompt_tokens,
-                response.usage.completion_tokens,
-            )
+            if response.usage:
+                details = getattr(response.usage, "prompt_tokens_details", None)
+                conf.update_usage(
+                    response.model,
+                    response.usage.total_tokens,
+                    response.usage.prompt_tokens,
+                    response.usage.completion_tokens,
+                    cached_tokens=getattr(details, "cached_tokens", 0) or 0,
+                )
+                self.scheduler.reconcile(api_key, estimated_tokens, response.usage.total_tokens)
+            else:
+                # Streamed responses from compatible endpoints may not report usage, estimate it instead
+                completion_tokens = await self.count_tokens(message.content or "", model)
+                conf.update_usage(
+                    response.model,
+                    current_convo_tokens + completion_tokens,
+                    current_convo_tokens,
+                    completion_tokens,
+                )
         elif isinstance(response, OllamaChatResponse):
             response_message = getattr(response, "message", {}) or {}
             role = getattr(response_message, "role", None)
@@ -167,16 +210,31 @@ class API(MixinMeta):
         return message
 
     async def request_embedding(self, text: str, conf: GuildSettings) -> List[float]:
+        """Embed a single string, reusing the shared embedding cache when the same text was embedded before"""
         embed_model = conf.get_embed_model(
             self.db.endpoint_override, self.db.ollama_models or None, self.db.endpoint_is_ollama
         )
+        key = self.embedding_cache.make_key(text, embed_model, self.db.endpoint_override)
+        return await self.embedding_cache.get_or_fetch(
+            key, lambda: self._request_embedding_uncached(text, embed_model, conf)
+        )
+
+    async def _request_embedding_uncached(self, text: str, embed_model: str, conf: GuildSettings) -> List[float]:
+        api_key = conf.api_key or "unprotected" if self.db.endpoint_override else conf.api_key
         try:
+            # Rough token estimate, not worth tokenizing just to queue the request
             response = await request_embedding_raw(
                 text=text,
-                api_key=conf.api_key or "unprotected" if self.db.endpoint_override else conf.api_key,
+                api_key=api_key,
                 model=embed_model,
                 base_url=self.db.endpoint_override,
+                slot=partial(
+                    self.scheduler.slot, self.get_request_guild(conf), api_key=api_key, tokens=len(text) // 4 + 1
+                ),
             )
+        except QueueFull as e:
+            log.warning(f"Embedding request rejected: {e}")
+            raise commands.UserFeedbackCheckFailure(_("Too many requests are queued, try again in a moment.")) from e
         except openai.OpenAIError as e:
             log.error("OpenAI embedding request failed", exc_info=e)
             raise commands.UserFeedbackCheckFailure(_("OpenAI embedding failed: {}").format(e)) from e
@@ -203,158 +261,165 @@ class API(MixinMeta):
 
         raise commands.UserFeedbackCheckFailure(_("Unsupported embedding response type from AI client."))
 
+    async def request_embeddings(
+        self,
+        texts: List[str],
+        conf: GuildSettings,
+        progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    ) -> List[List[float]]:
+        """Embed many strings using batched requests
+
+        Inputs are packed into batches of up to `EMBED_BATCH_SIZE` strings or `EMBED_BATCH_TOKENS` tokens,
+        with at most `EMBED_CONCURRENCY` batches in flight. A batch the provider rejects as too large is split in half and retried.
+
+        Args:
+            texts (List[str]): strings to embed
+            conf (GuildSettings): current guild settings
+            progress (Optional[Callable[[int, int], Awaitable[None]]]): called with (completed, total) after each batch
+
+        Returns:
+            List[List[float]]: one embedding per input in input order, empty if the provider returned nothing for it
+        """
+        if not texts:
+            return []
+        embed_model = conf.get_embed_model(
+            self.db.endpoint_override, self.db.ollama_models or None, self.db.endpoint_is_ollama
+        )
+        api_key = conf.api_key or "unprotected" if self.db.endpoint_override else conf.api_key
+
+        token_counts = await asyncio.to_thread(tokenizer.count_many, texts, embed_model)
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+        for idx, tokens in enumerate(token_counts):
+            if current and (len(current) >= EMBED_BATCH_SIZE or current_tokens + tokens > EMBED_BATCH_TOKENS):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(idx)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+
+        results: List[List[float]] = [[] for _ in texts]
+        guild_id = self.get_request_guild(conf)
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+        completed = 0
+
+        async def _embed(batch: List[int]):
+            try:
+                tokens = sum(token_counts[i] for i in batch)
+                response = await request_embeddings_raw(
+                    texts=[texts[i] for i in batch],
+                    api_key=api_key,
+                    model=embed_model,
+                    base_url=self.db.endpoint_override,
+                    slot=partial(self.scheduler.slot, guild_id, api_key=api_key, tokens=tokens),
+                )
+            except (openai.APIStatusError, ollama.ResponseError) as e:
+                if len(batch) == 1 or not is_input_too_large(e):
+                    raise
+                # Batch was too large for the provider, split it and try again
+                log.debug(f"Splitting rejected embedding batch of {len(batch)} inputs")
+                half = len(batch) // 2
+                await _embed(batch[:half])
+                await _embed(batch[half:])
+                return
+
+            if isinstance(response, CreateEmbeddingResponse):
+                conf.update_usage(response.model, response.usage.total_tokens, response.usage.prompt_tokens, 0)
+                vectors = [i.embedding for i in sorted(response.data, key=lambda x: x.index)]
+            elif isinstance(response, EmbedResponse):
+                conf.update_usage(response.model, 0, 0, 0)
+                vectors = list(response.embeddings or [])
+            else:
+                raise commands.UserFeedbackCheckFailure(_("Unsupported embedding response type from AI client."))
+            for idx, vector in zip(batch, vectors):
+                results[idx] = list(vector)
+
+        async def _run(batch: List[int]):
+            nonlocal completed
+            async with semaphore:
+                await _embed(batch)
+            completed += len(batch)
+            if progress is not None:
+                await progress(completed, len(texts))
+
+        tasks = [asyncio.create_task(_run(batch)) for batch in batches]
+        try:
+            await asyncio.gather(*tasks)
+        except QueueFull as e:
+            log.warning(f"Batch embedding request rejected: {e}")
+            raise commands.UserFeedbackCheckFailure(_("Too many requests are queued, try again in a moment.")) from e
+        except openai.OpenAIError as e:
+            log.error("OpenAI batch embedding request failed", exc_info=e)
+            raise commands.UserFeedbackCheckFailure(_("OpenAI embedding failed: {}").format(e)) from e
+        except ollama.ResponseError as e:
+            log.error("Ollama batch embedding request failed", exc_info=e)
+            raise commands.UserFeedbackCheckFailure(self._format_ollama_error(e, embed_model)) from e
+        except ollama.RequestError as e:
+            log.error("Ollama batch embedding request failed", exc_info=e)
+            raise commands.UserFeedbackCheckFailure(self._format_ollama_error(e, embed_model)) from e
+        finally:
+            # One failed batch fails the whole call, don't keep spending quota on the others
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                # Let them unwind (and release their scheduler slots) before returning
+                await asyncio.gather(*unfinished, return_exceptions=True)
+
+        log.debug(f"Embedded {len(texts)} inputs in {len(batches)} batches")
+        return results
+
     # -------------------------------------------------------
     # -------------------------------------------------------
     # ----------------------- HELPERS -----------------------
     # -------------------------------------------------------
     # -------------------------------------------------------
 
+    def get_request_guild(self, conf: GuildSettings, member: Optional[discord.Member] = None) -> int:
+        """Guild ID a request is queued under by the scheduler, 0 if the settings don't belong to a guild"""
+        guild = getattr(member, "guild", None)
+        if guild is not None:
+            return guild.id
+        return next((guild_id for guild_id, guild_conf in self.db.configs.items() if guild_conf is conf), 0)
+
     async def count_payload_tokens(self, messages: List[dict], model: str = "gpt-5.1") -> int:
         if not messages:
             return 0
+        return await asyncio.to_thread(tokenizer.count_messages, messages, model)
 
-        def _count_payload():
-            try:
-                encoding = tiktoken.encoding_for_model(model)
-            except KeyError:
-                encoding = tiktoken.get_encoding("o200k_base")
+    async def count_conversation_tokens(
+        self,
+        conversation: Conversation,
+        model: str = "gpt-5.1",
+        messages: Optional[List[dict]] = None,
+    ) -> int:
+        """Count payload tokens using the conversation's per-message token cache
 
-            tokens_per_message = 3
-            tokens_per_name = 1
-            num_tokens = 0
-            for message in messages:
-                num_tokens += tokens_per_message
-                for key, value in message.items():
-                    if key == "name":
-                        num_tokens += tokens_per_name
-
-                    if key == "content" and isinstance(value, list):
-                        for item in value:
-                            if item["type"] == "text":
-                                num_tokens += len(encoding.encode(item["text"]))
-                            elif item["type"] == "image_url":
-                                num_tokens += VISION_COSTS.get(model, [1000])[
-                                    0
-                                ]  # Just assume around 1k tokens for images
-                    else:  # String, probably
-                        num_tokens += len(encoding.encode(str(value)))
-
-            num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-            return num_tokens
-
-        return await asyncio.to_thread(_count_payload)
+        Args:
+            conversation (Conversation): conversation holding the token cache
+            model (str): model used to pick the encoding
+            messages (Optional[List[dict]]): payload built from the conversation, defaults to its messages
+        """
+        if conversation.uncached_messages(model, messages) > 5:
+            return await asyncio.to_thread(conversation.count_tokens, model, messages)
+        return conversation.count_tokens(model, messages)
 
     async def count_function_tokens(self, functions: List[dict], model: str = "gpt-5.1") -> int:
-        # Initialize function settings to 0
-        func_init = 0
-        prop_init = 0
-        prop_key = 0
-        enum_init = 0
-        enum_item = 0
-        func_end = 0
-
-        if model in [
-            "gpt-4o",
-            "gpt-4o-2024-05-13",
-            "gpt-4o-2024-08-06",
-            "gpt-4o-2024-11-20",
-            "gpt-4o-mini",
-            "gpt-4o-mini-2024-07-18",
-            "gpt-4.1",
-            "gpt-4.1-2025-04-14",
-            "gpt-4.1-mini",
-            "gpt-4.1-mini-2025-04-14",
-            "gpt-4.1-nano",
-            "gpt-4.1-nano-2025-04-14",
-            "o1-preview",
-            "o1-preview-2024-09-12",
-            "o1",
-            "o1-2024-12-17",
-            "o1-mini",
-            "o1-mini-2024-09-12",
-            "o3-mini",
-            "o3-mini-2025-01-31",
-            "o3",
-            "o3-2025-04-16",
-            "gpt-5",
-            "gpt-5-2025-04-16",
-            "gpt-5-mini",
-            "gpt-5-mini-2025-04-16",
-            "gpt-5-nano",
-            "gpt-5-nano-2025-04-16",
-            "gpt-5.1",
-            "gpt-5.1-2025-11-13",
-        ]:
-            # Set function settings for the above models
-            func_init = 7
-            prop_init = 3
-            prop_key = 3
-            enum_init = -3
-            enum_item = 3
-            func_end = 12
-        elif model in [
-            "gpt-3.5-turbo-1106",
-            "gpt-3.5-turbo-0125",
-            "gpt-4",
-            "gpt-4-turbo",
-            "gpt-4-turbo-preview",
-            "gpt-4-0125-preview",
-            "gpt-4-1106-preview",
-        ]:
-            # Set function settings for the above models
-            func_init = 10
-            prop_init = 3
-            prop_key = 3
-            enum_init = -3
-            enum_item = 3
-            func_end = 12
-        else:
+        """Sum the cached token cost of each function schema for a model"""
+        overhead = FUNCTION_TOKEN_OVERHEAD.get(model)
+        if overhead is None:
             # Custom endpoints (e.g., Ollama) can use arbitrary model names; avoid noisy warnings.
             if self.db.endpoint_override:
                 log.debug(f"Incompatible model for custom endpoint: {model}")
             else:
                 log.warning(f"Incompatible model: {model}")
-
-        def _count_tokens():
-            try:
-                encoding = tiktoken.encoding_for_model(model)
-            except KeyError:
-                encoding = tiktoken.get_encoding("o200k_base")
-
-            func_token_count = 0
-
-            if len(functions) > 0:
-                for f in functions:
-                    if "function" not in f.keys():
-                        f = {"function": f, "name": f["name"], "description": f["description"]}
-                    func_token_count += func_init  # Add tokens for start of each function
-                    function = f["function"]
-                    f_name = function["name"]
-                    f_desc = function["description"]
-                    if f_desc.endswith("."):
-                        f_desc = f_desc[:-1]
-                    line = f_name + ":" + f_desc
-                    func_token_count += len(encoding.encode(line))  # Add tokens for set name and description
-                    if len(function["parameters"]["properties"]) > 0:
-                        func_token_count += prop_init  # Add tokens for start of each property
-                        for key in list(function["parameters"]["properties"].keys()):
-                            func_token_count += prop_key  # Add tokens for each set property
-                            p_name = key
-                            p_type = function["parameters"]["properties"][key].get("type", "")
-                            p_desc = function["parameters"]["properties"][key].get("description", "")
-                            if "enum" in function["parameters"]["properties"][key].keys():
-                                func_token_count += enum_init  # Add tokens if property has enum list
-                                for item in function["parameters"]["properties"][key]["enum"]:
-                                    func_token_count += enum_item
-                                    func_token_count += len(encoding.encode(item))
-                            if p_desc.endswith("."):
-                                p_desc = p_desc[:-1]
-                            line = f"{p_name}:{p_type}:{p_desc}"
-                            func_token_count += len(encoding.encode(line))
-                func_token_count += func_end
-            return func_token_count
-
-        return await asyncio.to_thread(_count_tokens)
+            overhead = (0, 0, 0, 0, 0, 0)
+        if not functions:
+            return 0
+        return await tokenizer.acount_functions(functions, model, overhead)
 
     async def get_tokens(self, text: str, model: str = "gpt-5.1") -> list[int]:
         """Get token list from text"""
@@ -363,17 +428,7 @@ class API(MixinMeta):
             return []
         if isinstance(text, bytes):
             text = text.decode(encoding="utf-8")
-
-        def _get_encoding():
-            try:
-                enc = tiktoken.encoding_for_model(model)
-            except KeyError:
-                enc = tiktoken.get_encoding("o200k_base")
-            return enc
-
-        encoding = await asyncio.to_thread(_get_encoding)
-
-        return await asyncio.to_thread(encoding.encode, text)
+        return await tokenizer.aencode(text, model)
 
     async def count_tokens(self, text: str, model: str) -> int:
         if not text:
@@ -417,21 +472,22 @@ class API(MixinMeta):
         )
         target_dimension = len(sample_embed)
 
-        async def update_embedding(name: str, text: str):
-            conf.embeddings[name].embedding = await self.request_embedding(text, conf)
-            conf.embeddings[name].update()
-            conf.embeddings[name].model = target_model
-            log.debug(f"Updated embedding: {name}")
-
-        synced = 0
-        tasks = []
-        for name, em in conf.embeddings.items():
-            if target_model != em.model or len(em.embedding) != target_dimension:
-                synced += 1
-                tasks.append(update_embedding(name, em.text))
-
+        to_sync = [
+            name
+            for name, em in conf.embeddings.items()
+            if target_model != em.model or len(em.embedding) != target_dimension
+        ]
+        synced = len(to_sync)
         if synced:
-            await asyncio.gather(*tasks)
+            vectors = await self.request_embeddings([conf.embeddings[name].text for name in to_sync], conf)
+            for name, vector in zip(to_sync, vectors):
+                if not vector:
+                    log.warning(f"No embedding returned for {name} during resync")
+                    continue
+                conf.embeddings[name].embedding = vector
+                conf.embeddings[name].update()
+                conf.embeddings[name].model = target_model
+                log.debug(f"Updated embedding: {name}")
 
         await asyncio.to_thread(
             conf.sync_embeddings,
@@ -466,17 +522,7 @@ class API(MixinMeta):
 
     async def get_text(self, tokens: list, model: str = "gpt-5.1") -> str:
         """Get text from token list"""
-
-        def _get_encoding():
-            try:
-                enc = tiktoken.encoding_for_model(model)
-            except KeyError:
-                enc = tiktoken.get_encoding("o200k_base")
-            return enc
-
-        encoding = await asyncio.to_thread(_get_encoding)
-
-        return await asyncio.to_thread(encoding.decode, tokens)
+        return await tokenizer.adecode(tokens, model)
 
     # -------------------------------------------------------
     # -------------------------------------------------------
@@ -489,9 +535,10 @@ class API(MixinMeta):
         function_list: List[dict],
         conf: GuildSettings,
         user: Optional[discord.Member],
+        conversation: Optional[Conversation] = None,
     ) -> bool:
         """
-        Iteratively degrade a conversation payload in-place to fit within the max token limit, prioritizing more recent messages and critical context.
+        Degrade a conversation payload in-place to fit within the max token limit, prioritizing more recent messages and critical context.
 
         Order of importance:
         - System messages
@@ -506,6 +553,8 @@ class API(MixinMeta):
             messages (List[dict]): message entries sent to the api
             function_list (List[dict]): list of json function schemas for the model
             conf: (GuildSettings): current settings
+            user (Optional[discord.Member]): user the conversation belongs to
+            conversation (Optional[Conversation]): if provided, its token cache is used for counting
 
         Returns:
             bool: whether the conversation was degraded
@@ -516,8 +565,25 @@ class API(MixinMeta):
         )
         # Fetch the max token limit for the current user
         max_tokens = self.get_max_tokens(conf, user)
+
+        # Token weight of each message, counted once
+        def _weigh() -> List[int]:
+            if conversation is not None:
+                return [conversation.message_tokens(message, model) for message in messages]
+            encoding_name = tokenizer.get_encoding_name(model)
+            weights = []
+            for message in messages:
+                text_tokens, images = tokenizer.count_message(message, encoding_name)
+                weights.append(text_tokens + images * tokenizer.image_tokens(model))
+            return weights
+
+        if conversation is not None and conversation.uncached_messages(model, messages) <= 5:
+            weights = _weigh()
+        else:
+            weights = await asyncio.to_thread(_weigh)
+
         # Token count of current conversation
-        convo_tokens = await self.count_payload_tokens(messages, model)
+        convo_tokens = sum(weights) + 3 if messages else 0
         # Token count of function calls available to model
         function_tokens = await self.count_function_tokens(function_list, model)
 
@@ -529,71 +595,13 @@ class API(MixinMeta):
 
         log.debug(f"Degrading messages for {user} (total: {total_tokens}/max: {max_tokens})")
 
-        def count(role: str):
-            return sum(1 for msg in messages if msg["role"] == role)
-
-        async def pop(role: str) -> int:
-            for idx, msg in enumerate(messages):
-                if msg["role"] != role:
-                    continue
-                removed = messages.pop(idx)
-                reduction = 4
-                if "name" in removed:
-                    reduction += 1
-                if content := removed.get("content"):
-                    if isinstance(content, list):
-                        for i in content:
-                            if i["type"] == "text":
-                                reduction += await self.count_tokens(i["text"], model)
-                            else:
-                                reduction += 2
-                    else:
-                        reduction += await self.count_tokens(str(content), model)
-                elif tool_calls := removed.get("tool_calls"):
-                    reduction += await self.count_tokens(str(tool_calls), model)
-                elif function_call := removed.get("function_call"):
-                    reduction += await self.count_tokens(str(function_call), model)
-                return reduction
-            return 0
-
         # We will NOT remove the most recent user message or assistant message
         # We will also not touch system messages
         # We will also not touch function calls available to model (yet)
-        iters = 0
-        while True:
-            iters += 1
-            break_conditions = [
-                count("user") <= 1,
-                count("assistant") <= 1,
-                iters > 100,
-            ]
-            if any(break_conditions):
-                break
-            # First we will iterate through the messages and remove in the following sweep order:
-            # 1. Remove oldest tool call or response
-            reduced = await pop("tool")
-            if reduced:
-                total_tokens -= reduced
-                if total_tokens <= max_tokens:
-                    break
-            reduced = await pop("function")
-            if reduced:
-                total_tokens -= reduced
-                if total_tokens <= max_tokens:
-                    break
-            # 2. Remove oldest assistant message
-            reduced = await pop("assistant")
-            if reduced:
-                total_tokens -= reduced
-                if total_tokens <= max_tokens:
-                    break
-            # 3. Remove oldest user message
-            reduced = await pop("user")
-            if reduced:
-                total_tokens -= reduced
-                if total_tokens <= max_tokens:
-                    break
-            # Then we will repeat the process until we are under the max token limit
+        drop = plan_degradation([i["role"] for i in messages], weights, total_tokens - max_tokens)
+        if drop:
+            messages[:] = [message for idx, message in enumerate(messages) if idx not in drop]
+            total_tokens -= sum(weights[idx] for idx in drop)
 
         log.debug(f"Convo degradation finished for {user} (total: {total_tokens}/max: {max_tokens})")
         return True
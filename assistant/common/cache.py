@@ -0,0 +1,264 @@
+import asyncio
+import hashlib
+import logging
+import typing as t
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic
+
+import numpy as np
+
+from .constants import USER_PARAMS
+
+log = logging.getLogger("red.vrt.assistant.cache")
+
+
+def _normalize(vector: t.Sequence[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+def prompt_hash(*prompts: t.Optional[str]) -> str:
+    """Fingerprint of the prompt templates an answer was generated with"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for prompt in prompts:
+        hasher.update((prompt or "").encode())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def uses_user_params(*prompts: t.Optional[str]) -> bool:
+    """Whether any of the prompt templates contain placeholders that differ between users"""
+    text = "\0".join(prompt or "" for prompt in prompts)
+    return any("{" + param + "}" in text for param in USER_PARAMS)
+
+
+@dataclass
+class CachedAnswer:
+    vector: np.ndarray  # Normalized query embedding
+    question: str
+    answer: str
+    created: float
+    hits: int = 0
+
+
+# (embeddings version, model, prompt hash), answers are only reused within the same namespace
+Namespace = t.Tuple[tuple, str, str]
+
+
+class AnswerCache:
+    """Per-guild semantic cache of LLM answers, keyed by the query embedding
+
+    A cached answer is returned when a new question's embedding is similar enough to a previous one
+    that was asked with the same embeddings, model and prompts. Changing any of those changes the
+    namespace, which drops the guild's stale answers on the next lookup.
+    """
+
+    def __init__(self):
+        self._guilds: t.Dict[int, t.Tuple[Namespace, OrderedDict[int, CachedAnswer]]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return sum(len(entries) for _namespace, entries in self._guilds.values())
+
+    def _entries(self, guild_id: int, namespace: Namespace) -> OrderedDict[int, CachedAnswer]:
+        cached = self._guilds.get(guild_id)
+        if cached is None or cached[0] != namespace:
+            if cached is not None:
+                log.debug(f"Answer cache for guild {guild_id} invalidated, config changed")
+            cached = self._guilds[guild_id] = (namespace, OrderedDict())
+        return cached[1]
+
+    def lookup(
+        self,
+        guild_id: int,
+        query_embedding: t.Sequence[float],
+        namespace: Namespace,
+        threshold: float,
+        ttl: float,
+    ) -> t.Optional[CachedAnswer]:
+        """Find the most similar cached answer above the threshold"""
+        entries = self._entries(guild_id, namespace)
+        now = monotonic()
+        for key in [key for key, entry in entries.items() if now - entry.created > ttl]:
+            del entries[key]
+        if not entries or not len(query_embedding):
+            self.misses += 1
+            return None
+
+        keys = list(entries)
+        matrix = np.stack([entries[key].vector for key in keys])
+        vector = _normalize(query_embedding)
+        if matrix.shape[1] != vector.shape[0]:
+            # Embed model changed dimensions, nothing here is comparable
+            entries.clear()
+            self.misses += 1
+            return None
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            self.misses += 1
+            return None
+
+        entry = entries[keys[best]]
+        entries.move_to_end(keys[best])
+        entry.hits += 1
+        self.hits += 1
+        log.debug(f"Answer cache hit in guild {guild_id} ({round(float(scores[best]), 4)}): {entry.question[:50]}")
+        return entry
+
+    def store(
+        self,
+        guild_id: int,
+        query_embedding: t.Sequence[float],
+        namespace: Namespace,
+        question: str,
+        answer: str,
+        max_entries: int,
+    ) -> None:
+        if not len(query_embedding) or max_entries <= 0:
+            return
+        entries = self._entries(guild_id, namespace)
+        self._next_id += 1
+        entries[self._next_id] = CachedAnswer(
+            vector=_normalize(query_embedding),
+            question=question,
+            answer=answer,
+            created=monotonic(),
+        )
+        while len(entries) > max_entries:
+            # Least recently used first
+            entries.popitem(last=False)
+
+    def clear(self, guild_id: t.Optional[int] = None) -> None:
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
+
+    def size(self, guild_id: int) -> int:
+        cached = self._guilds.get(guild_id)
+        return len(cached[1]) if cached else 0
+
+
+class EmbeddingCache:
+    """Size-bounded LRU cache of query embeddings shared by chat, auto-answer and memory search
+
+    Keys are a hash of the normalized text plus the embed model and endpoint, so API keys never
+    end up in the key and the same text is only embedded once per model. Concurrent requests
+    for the same key share a single API call.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._pending: t.Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(text: str, model: str, endpoint: t.Optional[str] = None) -> str:
+        normalized = " ".join(unicodedata.normalize("NFC", text).split())
+        digest = hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+        return f"{endpoint or 'openai'}|{model}|{digest}"
+
+    def get(self, key: str) -> t.Optional[np.ndarray]:
+        vector = self._entries.get(key)
+        if vector is not None:
+            self._entries.move_to_end(key)
+        return vector
+
+    def put(self, key: str, vector: t.Sequence[float]) -> None:
+        if self.max_entries <= 0 or not len(vector):
+            return
+        self._entries[key] = np.asarray(vector, dtype=np.float32)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def resize(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        while len(self._entries) > max(max_entries, 0):
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_fetch(
+        self,
+        key: str,
+        fetch: t.Callable[[], t.Awaitable[t.List[float]]],
+    ) -> t.List[float]:
+        """Return the cached embedding for a key, calling `fetch` once on a miss"""
+        while True:
+            vector = self.get(key)
+            if vector is not None:
+                self.hits += 1
+                return vector.tolist()
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            # Someone is already embedding this text
+            try:
+                embedding = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                cancelling = getattr(task, "cancelling", None)
+                if not pending.cancelled() or (cancelling is not None and cancelling()):
+                    # We were cancelled ourselves
+                    raise
+                # The request that owned the fetch was cancelled, not us, fetch it again
+                continue
+            self.hits += 1
+            return list(embedding)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            embedding = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting, don't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            self._pending.pop(key, None)
+        future.set_result(embedding)
+        self.put(key, embedding)
+        return embedding
+
+    def save(self, path: Path) -> int:
+        """Write the cache to disk, returning the number of entries saved"""
+        keys = list(self._entries)
+        vectors = [self._entries[key] for key in keys]
+        np.savez(
+            path,
+            keys=np.array(keys, dtype=str),
+            dims=np.array([len(vector) for vector in vectors], dtype=np.int32),
+            data=np.concatenate(vectors) if vectors else np.zeros(0, dtype=np.float32),
+        )
+        return len(keys)
+
+    def load(self, path: Path) -> int:
+        """Load entries saved with `save`, returning the number of entries loaded"""
+        if not path.exists():
+            return 0
+        with np.load(path) as saved:
+            keys, dims, data = saved["keys"], saved["dims"], saved["data"]
+        offset = 0
+        for key, dim in zip(keys.tolist(), dims.tolist()):
+            self.put(key, data[offset : offset + dim])
+            offset += dim
+        return len(self._entries)
@@ -1,5 +1,8 @@
+import asyncio
 import logging
 import typing as t
+from contextlib import contextmanager
+from time import monotonic
 from typing import List, Optional
 
 import httpx
@@ -12,22 +15,190 @@ from openai.types import CreateEmbeddingResponse, Image, ImagesResponse
 from openai.types.chat import ChatCompletion
 from pydantic import BaseModel
 from sentry_sdk import add_breadcrumb
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_random_exponential,
-)
 
 from .constants import NO_DEVELOPER_ROLE, PRICES, SUPPORTS_SEED, SUPPORTS_TOOLS
+from .ratelimit import rate_limits, retry_provider
 from .utils import convert_functions_to_ollama_tools
 
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 log = logging.getLogger("red.vrt.assistant.calls")
 
+ClientKey = t.Tuple[str, Optional[str], Optional[str]]  # (backend, base_url, api_key)
+LLMClient = t.Union[openai.AsyncOpenAI, ollama.AsyncClient]
+# Receives the full reply text generated so far each time a streamed chunk arrives
+OnDelta = t.Callable[[str], t.Awaitable[None]]
+
+
+class ClientRegistry:
+    """
+    Process-wide cache of LLM clients so connections are reused between requests.
+
+    Clients are keyed by (backend, base_url, api_key) and share keep-alive connection pools
+    (HTTP/2 when the `h2` package is installed). Clients that have not been used for
+    `idle_timeout` seconds are closed by `evict_idle`, requests made inside `in_use` keep their
+    client open until they finish no matter how long they take.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        idle_timeout: float = 900.0,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.idle_timeout = idle_timeout
+        self._clients: t.Dict[ClientKey, LLMClient] = {}
+        self._last_used: t.Dict[ClientKey, float] = {}
+        self._retired: t.List[t.Tuple[float, LLMClient]] = []
+        self._active: t.Dict[int, int] = {}  # {id(client): requests in flight}
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def configure(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+    ) -> None:
+        """Update pool limits
+
+        Clients created with the old limits are retired and closed by the next `evict_idle` sweep
+        once they have had time to finish any in-flight requests.
+        """
+        old_limits = (self.max_connections, self.max_keepalive_connections)
+        if max_connections is not None:
+            self.max_connections = max_connections
+        if max_keepalive_connections is not None:
+            self.max_keepalive_connections = max_keepalive_connections
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+        if old_limits != (self.max_connections, self.max_keepalive_connections):
+            now = monotonic()
+            self._retired.extend((now, client) for client in self._clients.values())
+            self._clients.clear()
+            self._last_used.clear()
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def get_openai(self, api_key: Optional[str], base_url: Optional[str] = None) -> openai.AsyncOpenAI:
+        api_key = api_key or "unprotected" if base_url else api_key
+        key = ("openai", base_url, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            http_client = openai.DefaultAsyncHttpxClient(
+                limits=self._limits(),
+                http2=HTTP2_AVAILABLE,
+                # Every response updates the key's shared rate limit budget
+                event_hooks={"response": [rate_limits.hook(api_key)]} if api_key else None,
+            )
+            # retry_provider is the only retry layer, the SDK's own retries would multiply its attempts
+            client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            self._clients[key] = client
+            log.debug(f"Created pooled OpenAI client for {base_url or 'api.openai.com'}")
+        self._last_used[key] = monotonic()
+        return client
+
+    def get_ollama(self, base_url: str) -> ollama.AsyncClient:
+        key = ("ollama", base_url, None)
+        client = self._clients.get(key)
+        if client is None:
+            client = ollama.AsyncClient(host=base_url, limits=self._limits(), http2=HTTP2_AVAILABLE)
+            self._clients[key] = client
+            log.debug(f"Created pooled Ollama client for {base_url}")
+        self._last_used[key] = monotonic()
+        return client
+
+    @contextmanager
+    def in_use(self, client: LLMClient):
+        """Mark a client as busy so `evict_idle` doesn't close it under a long request or stream"""
+        ref = id(client)
+        self._active[ref] = self._active.get(ref, 0) + 1
+        try:
+            yield client
+        finally:
+            if self._active[ref] > 1:
+                self._active[ref] -= 1
+            else:
+                del self._active[ref]
+            # Idle time counts from when the client was last done with, not when it was fetched
+            now = monotonic()
+            for key, pooled in self._clients.items():
+                if pooled is client:
+                    self._last_used[key] = now
+
+    def busy(self, client: LLMClient) -> bool:
+        return id(client) in self._active
+
+    @staticmethod
+    async def _close_client(client: LLMClient) -> None:
+        try:
+            if isinstance(client, openai.AsyncOpenAI):
+                await client.close()
+            else:
+                # ollama.AsyncClient wraps an httpx.AsyncClient
+                await client._client.aclose()
+        except Exception as e:  # noqa: BLE001
+            log.debug("Failed to close pooled client", exc_info=e)
+
+    async def evict_idle(self) -> int:
+        """Close clients that have been idle for longer than the idle timeout
+
+        Clients with requests still in flight are skipped until a later sweep.
+
+        Returns:
+            int: number of clients closed
+        """
+        now = monotonic()
+        stale = [
+            key
+            for key, last_used in self._last_used.items()
+            if now - last_used > self.idle_timeout and not self.busy(self._clients[key])
+        ]
+        for key in stale:
+            self._last_used.pop(key, None)
+            client = self._clients.pop(key, None)
+            if client is not None:
+                await self._close_client(client)
+        expired = [i for i in self._retired if now - i[0] > self.idle_timeout and not self.busy(i[1])]
+        retired = [client for _, client in expired]
+        self._retired = [i for i in self._retired if i not in expired]
+        for client in retired:
+            await self._close_client(client)
+        closed = len(stale) + len(retired)
+        if closed:
+            log.debug(f"Evicted {closed} idle LLM clients")
+        return closed
+
+    async def close(self) -> None:
+        """Close every pooled client, called when the cog unloads"""
+        clients = list(self._clients.values()) + [client for _, client in self._retired]
+        self._clients.clear()
+        self._last_used.clear()
+        self._retired.clear()
+        await asyncio.gather(*(self._close_client(client) for client in clients))
+
+
+client_registry = ClientRegistry()
+
 
 def _get_ollama_client(base_url: str) -> ollama.AsyncClient:
     """
-    Instantiate Ollama AsyncClient with proper host configuration.
+    Fetch a pooled Ollama AsyncClient with proper host configuration.
 
     Args:
         base_url: The Ollama endpoint URL (e.g., "http://localhost:11434")
@@ -35,13 +206,19 @@ def _get_ollama_client(base_url: str) -> ollama.AsyncClient:
     Returns:
         ollama.AsyncClient instance configured with the host
     """
-    return ollama.AsyncClient(host=base_url)
+    return client_registry.get_ollama(base_url)
+
+
+def _get_openai_client(api_key: Optional[str], base_url: Optional[str] = None) -> openai.AsyncOpenAI:
+    """Fetch a pooled OpenAI AsyncClient for the given key and endpoint."""
+    return client_registry.get_openai(api_key, base_url)
 
 
 async def list_ollama_models(base_url: str) -> list[dict]:
     """List Ollama models from the configured host."""
     client = _get_ollama_client(base_url)
-    response = await client.list()
+    with client_registry.in_use(client):
+        response = await client.list()
     if isinstance(response, dict):
         return response.get("models", [])
     return getattr(response, "models", []) or []
@@ -68,20 +245,7 @@ async def _should_use_ollama(base_url: Optional[str]) -> bool:
         return False
 
 
-@retry(
-    retry=retry_if_exception_type(
-        t.Union[
-            httpx.TimeoutException,
-            httpx.ReadTimeout,
-            openai.InternalServerError,
-            ollama.RequestError,
-            ollama.ResponseError,
-        ]
-    ),
-    wait=wait_random_exponential(min=1, max=30),
-    stop=stop_after_attempt(5),
-    reraise=True,
-)
+@retry_provider(min_wait=1, max_wait=30)
 async def request_chat_completion_raw(
     model: str,
     messages: List[dict],
@@ -96,13 +260,22 @@ async def request_chat_completion_raw(
     reasoning_effort: Optional[str] = None,
     verbosity: Optional[str] = None,
     allow_all_ollama_tools: bool = False,
+    on_delta: Optional[OnDelta] = None,
 ) -> t.Union[ChatCompletion, OllamaChatResponse]:
+    """Request a chat completion
+
+    If `on_delta` is provided the completion is streamed, `on_delta` is called with the text
+    generated so far as chunks arrive, and the chunks are reassembled into the same response
+    type a non-streamed request returns.
+    """
     use_ollama = await _should_use_ollama(base_url)
 
     if use_ollama:
         client = _get_ollama_client(base_url)
     else:
-        client = openai.AsyncOpenAI(api_key=api_key or "unprotected" if base_url else api_key, base_url=base_url)
+        client = _get_openai_client(api_key, base_url)
+        # Another request on this key may have been told to back off
+        await rate_limits.wait(api_key)
 
     kwargs = {"model": model, "messages": messages}
 
@@ -171,10 +344,16 @@ async def request_chat_completion_raw(
         data=kwargs,
     )
     try:
-        if use_ollama:
-            response: OllamaChatResponse = await client.chat(**kwargs)
-        else:
-            response = await client.chat.completions.create(**kwargs)
+        with client_registry.in_use(client):
+            if use_ollama and on_delta is not None:
+                response = await _stream_ollama_chat(client, kwargs, on_delta)
+            elif use_ollama:
+                response: OllamaChatResponse = await client.chat(**kwargs)
+            elif on_delta is not None:
+                # Usage reporting in streams is an OpenAI extension, compatible endpoints may reject it
+                response = await _stream_openai_chat(client, kwargs, on_delta, include_usage=base_url is None)
+            else:
+                response = await client.chat.completions.create(**kwargs)
     except openai.OpenAIError as e:
         add_breadcrumb(category="api", message="OpenAI chat completion failed", level="error", data={"error": str(e)})
         log.error("OpenAI chat completion failed", exc_info=e)
@@ -192,21 +371,97 @@ async def request_chat_completion_raw(
     return response
 
 
-@cached(ttl=60)
-@retry(
-    retry=retry_if_exception_type(
-        t.Union[
-            httpx.TimeoutException,
-            httpx.ReadTimeout,
-            openai.InternalServerError,
-            ollama.RequestError,
-            ollama.ResponseError,
-        ]
-    ),
-    wait=wait_random_exponential(min=5, max=30),
-    stop=stop_after_attempt(5),
-    reraise=True,
-)
+async def _stream_openai_chat(
+    client: openai.AsyncOpenAI,
+    kwargs: dict,
+    on_delta: OnDelta,
+    include_usage: bool = True,
+) -> ChatCompletion:
+    """Stream an OpenAI chat completion and reassemble the chunks, including tool call deltas"""
+    kwargs = {**kwargs, "stream": True}
+    if include_usage:
+        kwargs["stream_options"] = {"include_usage": True}
+
+    text = ""
+    tool_calls: t.Dict[int, dict] = {}
+    function_call: Optional[dict] = None
+    finish_reason = None
+    usage = None
+    completion_id, created, model = "", 0, kwargs["model"]
+
+    stream = await client.chat.completions.create(**kwargs)
+    async for chunk in stream:
+        completion_id = chunk.id or completion_id
+        created = chunk.created or created
+        model = chunk.model or model
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        finish_reason = choice.finish_reason or finish_reason
+        delta = choice.delta
+        if delta.content:
+            text += delta.content
+            await on_delta(text)
+        # Tool calls arrive as fragments keyed by index, the name and id come first and arguments trickle in
+        for tool_delta in delta.tool_calls or []:
+            tool_call = tool_calls.setdefault(
+                tool_delta.index,
+                {"id": f"call_{tool_delta.index}", "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            if tool_delta.id:
+                tool_call["id"] = tool_delta.id
+            if tool_delta.function:
+                tool_call["function"]["name"] += tool_delta.function.name or ""
+                tool_call["function"]["arguments"] += tool_delta.function.arguments or ""
+        if delta.function_call:
+            function_call = function_call or {"name": "", "arguments": ""}
+            function_call["name"] += delta.function_call.name or ""
+            function_call["arguments"] += delta.function_call.arguments or ""
+
+    message = {"role": "assistant", "content": text or None}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    if function_call:
+        message["function_call"] = function_call
+    return ChatCompletion.model_validate(
+        {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": finish_reason or "stop", "message": message}],
+            "usage": usage.model_dump() if usage else None,
+        }
+    )
+
+
+async def _stream_ollama_chat(
+    client: ollama.AsyncClient,
+    kwargs: dict,
+    on_delta: OnDelta,
+) -> OllamaChatResponse:
+    """Stream an Ollama chat response and merge the parts into the final one"""
+    text = ""
+    tool_calls = []
+    final: Optional[OllamaChatResponse] = None
+    async for part in await client.chat(**kwargs, stream=True):
+        final = part
+        if part.message.content:
+            text += part.message.content
+            await on_delta(text)
+        if part.message.tool_calls:
+            tool_calls.extend(part.message.tool_calls)
+    if final is None:
+        raise ResponseError("Ollama returned an empty response stream")
+    # The last part carries the token counts, give it the complete message
+    final.message.content = text
+    final.message.tool_calls = tool_calls or None
+    return final
+
+
+@retry_provider(min_wait=5, max_wait=30)
 async def request_embedding_raw(
     text: str,
     api_key: str,
@@ -214,7 +469,9 @@ async def request_embedding_raw(
     base_url: Optional[str] = None,
 ) -> t.Union[CreateEmbeddingResponse, EmbedResponse]:
     use_ollama = await _should_use_ollama(base_url)
-    client = _get_ollama_client(base_url) if use_ollama else openai.AsyncOpenAI(api_key=api_key or "unprotected" if base_url else api_key, base_url=base_url)
+    client = _get_ollama_client(base_url) if use_ollama else _get_openai_client(api_key, base_url)
+    if not use_ollama:
+        await rate_limits.wait(api_key)
     add_breadcrumb(
         category="api",
         message="Calling request_embedding_raw",
@@ -222,10 +479,11 @@ async def request_embedding_raw(
         data={"text": text},
     )
     try:
-        if use_ollama:
-            response: EmbedResponse = await client.embed(model=model, input=text)
-        else:
-            response = await client.embeddings.create(input=text, model=model)
+        with client_registry.in_use(client):
+            if use_ollama:
+                response: EmbedResponse = await client.embed(model=model, input=text)
+            else:
+                response = await client.embeddings.create(input=text, model=model)
     except openai.OpenAIError as e:
         add_breadcrumb(category="api", message="OpenAI embedding failed", level="error", data={"error": str(e)})
         log.error("OpenAI embedding failed", exc_info=e)
@@ -243,20 +501,48 @@ async def request_embedding_raw(
     return response
 
 
-@retry(
-    retry=retry_if_exception_type(
-        t.Union[
-            httpx.TimeoutException,
-            httpx.ReadTimeout,
-            openai.InternalServerError,
-            ollama.RequestError,
-            ollama.ResponseError,
-        ]
-    ),
-    wait=wait_random_exponential(min=5, max=30),
-    stop=stop_after_attempt(5),
-    reraise=True,
-)
+@retry_provider(min_wait=5, max_wait=30)
+async def request_embeddings_raw(
+    texts: t.List[str],
+    api_key: str,
+    model: str,
+    base_url: Optional[str] = None,
+) -> t.Union[CreateEmbeddingResponse, EmbedResponse]:
+    """Embed a batch of strings in a single request, results are returned in input order"""
+    use_ollama = await _should_use_ollama(base_url)
+    client = _get_ollama_client(base_url) if use_ollama else _get_openai_client(api_key, base_url)
+    if not use_ollama:
+        await rate_limits.wait(api_key)
+    add_breadcrumb(
+        category="api",
+        message="Calling request_embeddings_raw",
+        level="info",
+        data={"inputs": len(texts)},
+    )
+    try:
+        with client_registry.in_use(client):
+            if use_ollama:
+                response: EmbedResponse = await client.embed(model=model, input=texts)
+            else:
+                response = await client.embeddings.create(input=texts, model=model)
+    except openai.OpenAIError as e:
+        add_breadcrumb(category="api", message="OpenAI batch embedding failed", level="error", data={"error": str(e)})
+        log.error("OpenAI batch embedding failed", exc_info=e)
+        raise
+    except ResponseError as e:
+        add_breadcrumb(category="api", message="Ollama batch embedding failed", level="error", data={"error": str(e)})
+        log.error("Ollama batch embedding failed", exc_info=e)
+        raise
+    except RequestError as e:
+        add_breadcrumb(category="api", message="Ollama batch embed request failed", level="error", data={"error": str(e)})
+        log.error("Ollama batch embed request failed", exc_info=e)
+        raise
+
+    log.debug(f"request_embeddings_raw: {model} -> {response.model} ({len(texts)} inputs)")
+    return response
+
+
+@retry_provider(min_wait=5, max_wait=30)
 async def request_image_raw(
     prompt: str,
     api_key: str,
@@ -266,7 +552,8 @@ async def request_image_raw(
     model: t.Literal["dall-e-3", "gpt-image-1"] = "dall-e-3",
     base_url: Optional[str] = None,
 ) -> Image:
-    client = openai.AsyncOpenAI(api_key=api_key or "unprotected" if base_url else api_key, base_url=base_url)
+    client = _get_openai_client(api_key, base_url)
+    await rate_limits.wait(api_key)
 
     kwargs = {
         "model": model,
@@ -287,11 +574,13 @@ async def request_image_raw(
             kwargs["quality"] = "medium"
         # gpt-image-1 doesn't support style parameter
 
-    response: ImagesResponse = await client.images.generate(**kwargs)
+    with client_registry.in_use(client):
+        response: ImagesResponse = await client.images.generate(**kwargs)
     images: list[Image] = response.data
     return images[0]
 
 
+@retry_provider(min_wait=5, max_wait=30)
 async def request_image_edit_raw(
     prompt: str,
     api_key: str,
@@ -299,13 +588,14 @@ async def request_image_edit_raw(
     base_url: Optional[str] = None,
 ) -> Image:
     assert all(isinstance(image, bytes) for image in images), "All images must be bytes."
-    client = openai.AsyncOpenAI(api_key=api_key or "unprotected" if base_url else api_key, base_url=base_url)
-
-    response: ImagesResponse = await client.images.edit(
-        model="gpt-image-1",
-        prompt=prompt,
-        image=images,
-    )
+    client = _get_openai_client(api_key, base_url)
+
+    with client_registry.in_use(client):
+        response: ImagesResponse = await client.images.edit(
+            model="gpt-image-1",
+            prompt=prompt,
+            image=images,
+        )
     images: list[Image] = response.data
     return images[0]
 
@@ -315,15 +605,17 @@ class CreateMemoryResponse(BaseModel):
     memory_content: str
 
 
+@retry_provider(min_wait=1, max_wait=30)
 async def create_memory_call(
     messages: t.List[dict],
     api_key: str,
     base_url: Optional[str] = None,
 ) -> t.Union[CreateMemoryResponse, None]:
-    client = openai.AsyncOpenAI(api_key=api_key or "unprotected" if base_url else api_key, base_url=base_url)
-    response = await client.beta.chat.completions.parse(
-        model="o3",
-        messages=messages,
-        response_format=CreateMemoryResponse,
-    )
+    client = _get_openai_client(api_key, base_url)
+    with client_registry.in_use(client):
+        response = await client.beta.chat.completions.parse(
+            model="o3",
+            messages=messages,
+            response_format=CreateMemoryResponse,
+        )
     return response.choices[0].message.parsed
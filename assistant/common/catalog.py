@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import logging
+import typing as t
+from time import monotonic
+
+import discord
+import orjson
+from redbot.core.bot import Red
+
+log = logging.getLogger("red.vrt.assistant.catalog")
+
+# Seconds a member's permission tier is reused before checking their roles again
+PERMISSION_TTL = 60
+# Expired permission entries are swept once the cache grows past this
+PERMISSION_CACHE_SIZE = 5000
+
+# ([function schemas], {function_name: callable})
+Prepped = t.Tuple[t.List[dict], t.Dict[str, t.Callable]]
+
+
+def schema_digest(schema: dict) -> str:
+    """Content hash of a function schema (or registry entry), schemas edited in place get a new digest"""
+    dump = orjson.dumps(schema, option=orjson.OPT_SORT_KEYS, default=str)
+    return hashlib.blake2b(dump, digest_size=16).hexdigest()
+
+
+class FunctionCatalog:
+    """Memoized results of `DB.prep_functions`
+
+    - The permission levels a member can use are cached for `PERMISSION_TTL` seconds
+    - The prepped schemas and callables are cached per (guild, permission tier) until a function,
+      a function's enabled status or the registry changes, detected by comparing fingerprints
+    """
+
+    def __init__(self, ttl: float = PERMISSION_TTL):
+        self.ttl = ttl
+        # {(guild_id, member_id): (expires, permission levels)}
+        self._permissions: t.Dict[t.Tuple[int, int], t.Tuple[float, t.FrozenSet[str]]] = {}
+        # {(guild_id, permission levels, showall): (fingerprint, prepped)}
+        self._catalogs: t.Dict[tuple, t.Tuple[tuple, Prepped]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def permission_levels(self, bot: Red, member: t.Optional[discord.Member]) -> t.FrozenSet[str]:
+        """Permission levels (user, mod, admin, owner) a member can use functions from"""
+        if not isinstance(member, discord.Member):
+            return frozenset({"user"})
+        key = (member.guild.id, member.id)
+        now = monotonic()
+        cached = self._permissions.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        is_mod, is_admin, is_owner = await asyncio.gather(
+            bot.is_mod(member),
+            bot.is_admin(member),
+            bot.is_owner(member),
+        )
+        levels = {"user"}
+        if member.guild_permissions.manage_messages or is_mod:
+            levels.add("mod")
+        if member.guild_permissions.administrator or is_admin:
+            levels.add("admin")
+        if is_owner:
+            levels.add("owner")
+
+        if len(self._permissions) >= PERMISSION_CACHE_SIZE:
+            self._permissions = {k: v for k, v in self._permissions.items() if v[0] > now}
+        self._permissions[key] = (now + self.ttl, frozenset(levels))
+        return self._permissions[key][1]
+
+    def get(self, key: tuple, fingerprint: tuple) -> t.Optional[Prepped]:
+        cached = self._catalogs.get(key)
+        if cached is None or cached[0] != fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        function_calls, function_map = cached[1]
+        # Callers add and remove entries, hand out copies
+        return list(function_calls), dict(function_map)
+
+    def put(self, key: tuple, fingerprint: tuple, prepped: Prepped) -> None:
+        function_calls, function_map = prepped
+        self._catalogs[key] = (fingerprint, (list(function_calls), dict(function_map)))
+
+    def clear(self) -> None:
+        self._permissions.clear()
+        self._catalogs.clear()
@@ -1,15 +1,13 @@
 import asyncio
 import base64
-import functools
 import json
 import logging
-import multiprocessing as mp
 import re
 import traceback
 from datetime import datetime
 from inspect import iscoroutinefunction
 from io import BytesIO, StringIO
-from typing import Callable, Dict, List, Optional, Union
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
 import discord
 import httpx
@@ -28,9 +26,19 @@ from redbot.core.utils.chat_formatting import box, humanize_number, text_to_file
 from sentry_sdk import add_breadcrumb
 
 from ..abc import MixinMeta
-from .constants import DO_NOT_RESPOND_SCHEMA, READ_EXTENSIONS, SUPPORTS_VISION
+from .constants import (
+    DO_NOT_RESPOND_SCHEMA,
+    READ_EXTENSIONS,
+    SUPPORTS_VISION,
+    TOOL_CALL_CONCURRENCY,
+    TOOL_CALL_TIMEOUT,
+    VOLATILE_PARAMS,
+)
+from .cache import prompt_hash, uses_user_params
 from .models import Conversation, GuildSettings
-from .reply import send_reply
+from .patterns import sub_all
+from .reply import StreamingReply, send_reply
+from .timing import StageTimer
 from .utils import (
     clean_name,
     clean_response,
@@ -169,6 +177,20 @@ class ChatHandler(MixinMeta):
                         name = f"@{ref_author.name}({ref_author.display_name})"
                     question = f"{name}: {ref.content}\n\n# REPLY\n{question}"
 
+        # Stream plain replies into a placeholder message, file output is only sent once complete.
+        # Replies that may be redacted by the blacklist or withheld entirely (auto answer) are never previewed.
+        streamer = None
+        if (
+            conf.stream_responses
+            and not outputfile
+            and not extract
+            and not get_last_message
+            and not listener
+            and not auto_answer
+            and not conf.regex_blacklist
+        ):
+            streamer = StreamingReply(message, conf)
+
         if get_last_message:
             reply = conversation.messages[-1]["content"] if conversation.messages else _("No message history!")
         else:
@@ -184,6 +206,7 @@ class ChatHandler(MixinMeta):
                     model_override=model_override,
                     auto_answer=auto_answer,
                     trigger_prompt=trigger_prompt,
+                    streamer=streamer,
                 )
             except openai.InternalServerError as e:
                 if e.body and isinstance(e.body, dict):
@@ -218,6 +241,8 @@ class ChatHandler(MixinMeta):
                 reply += "\n\n" + _("API Status: {}").format(status)
 
         if reply is None:
+            if streamer:
+                await streamer.discard()
             return
 
         files = None
@@ -245,6 +270,12 @@ class ChatHandler(MixinMeta):
 
         to_send = [str(i) for i in to_send if str(i).strip()]
 
+        if streamer:
+            if not to_send:
+                await streamer.discard()
+            elif await streamer.finish(to_send[0]):
+                return
+
         if not to_send and listener:
             return
         elif not to_send and not listener:
@@ -277,27 +308,30 @@ class ChatHandler(MixinMeta):
         model_override: Optional[str] = None,
         auto_answer: Optional[bool] = False,
         trigger_prompt: Optional[str] = None,
+        streamer: Optional[StreamingReply] = None,
     ) -> Union[str, None]:
         """Call the API asynchronously"""
-        functions = function_calls.copy() if function_calls else []
-        mapping = function_map.copy() if function_map else {}
 
         async def do_not_respond(*args, **kwargs):
             return {"return_null": True, "content": "do_not_respond"}
 
-        if conf.use_function_calls and extend_function_calls:
-            # Prepare registry and custom functions
-            prepped_function_calls, prepped_function_map = await self.db.prep_functions(
-                bot=self.bot, conf=conf, registry=self.registry, member=author
-            )
-            functions.extend(prepped_function_calls)
-            mapping.update(prepped_function_map)
-            if auto_answer:
-                functions.append(DO_NOT_RESPOND_SCHEMA)
-                mapping["do_not_respond"] = do_not_respond
+        async def prepare_functions() -> Tuple[List[dict], Dict[str, Callable]]:
+            functions = function_calls.copy() if function_calls else []
+            mapping = function_map.copy() if function_map else {}
+            if conf.use_function_calls and extend_function_calls:
+                # Prepare registry and custom functions
+                prepped_function_calls, prepped_function_map = await self.db.prep_functions(
+                    bot=self.bot, conf=conf, registry=self.registry, member=author
+                )
+                functions.extend(prepped_function_calls)
+                mapping.update(prepped_function_map)
+                if auto_answer:
+                    functions.append(DO_NOT_RESPOND_SCHEMA)
+                    mapping["do_not_respond"] = do_not_respond
 
-        if not conf.use_function_calls and functions:
-            functions = []
+            if not conf.use_function_calls and functions:
+                functions = []
+            return functions, mapping
 
         mem_id = author if isinstance(author, int) else author.id
         chan_id = channel if isinstance(channel, int) else channel.id
@@ -319,13 +353,13 @@ class ChatHandler(MixinMeta):
                 channel=channel,
                 conf=conf,
                 conversation=conversation,
-                function_calls=functions,
-                function_map=mapping,
+                prepare_functions=prepare_functions,
                 message_obj=message_obj,
                 images=images,
                 model_override=model_override,
                 auto_answer=auto_answer,
                 trigger_prompt=trigger_prompt,
+                streamer=streamer,
             )
         finally:
             conversation.cleanup(conf, author)
@@ -339,20 +373,19 @@ class ChatHandler(MixinMeta):
         channel: Union[discord.TextChannel, discord.Thread, discord.ForumChannel, int],
         conf: GuildSettings,
         conversation: Conversation,
-        function_calls: List[dict],
-        function_map: Dict[str, Callable],
+        prepare_functions: Callable[[], Awaitable[Tuple[List[dict], Dict[str, Callable]]]],
         message_obj: Optional[discord.Message] = None,
         images: list[str] = None,
         model_override: Optional[str] = None,
         auto_answer: Optional[bool] = False,
         trigger_prompt: Optional[str] = None,
+        streamer: Optional[StreamingReply] = None,
     ) -> Union[str, None]:
         if isinstance(author, int):
             author = guild.get_member(author)
         if isinstance(channel, int):
             channel = guild.get_channel(channel)
 
-        query_embedding = []
         user = author if isinstance(author, discord.Member) else guild.get_member(author)
         user_id = author.id if isinstance(author, discord.Member) else author
         model = conf.get_chat_model(
@@ -363,34 +396,109 @@ class ChatHandler(MixinMeta):
         # Ensure the message is not longer than 1048576 characters
         message = message[:1048576]
 
-        # Determine if we should embed the user's message
-        message_tokens = await self.count_tokens(message, model)
-        words = message.split(" ")
-        get_embed_conditions = [
-            conf.embeddings,  # We actually have embeddings to compare with
-            len(words) > 1,  # Message is long enough
-            conf.top_n,  # Top n is greater than 0
-            message_tokens < 8191,
-        ]
-        if all(get_embed_conditions):
-            if conf.question_mode:
+        prompt_templates = (
+            conf.system_prompt,
+            conf.prompt,
+            conf.channel_prompts.get(getattr(channel, "id", channel)),
+            conversation.system_prompt_override,
+            trigger_prompt,
+        )
+        # Fresh questions (no conversation context) can be answered from the semantic answer cache.
+        # Prompts with per-user placeholders ({username}, {balance}, etc.) make answers personal, those aren't shared.
+        check_answer_cache = bool(
+            conf.answer_cache
+            and (auto_answer or not conversation.messages)
+            and not images
+            and not uses_user_params(*prompt_templates)
+        )
+
+        route_tools = bool(conf.tool_router and conf.use_function_calls)
+
+        async def embed_query() -> Tuple[List[float], List[float], List[float]]:
+            """Returns the embeddings used for related embeddings, the answer cache and tool routing
+
+            The message is embedded at most once, each use only gets the vector if its own conditions allow it.
+            """
+            # Determine if we should embed the user's message
+            message_tokens = await self.count_tokens(message, model)
+            if message_tokens >= 8191:
+                return [], [], []
+            words = message.split(" ")
+            get_embed_conditions = [
+                conf.embeddings,  # We actually have embeddings to compare with
+                len(words) > 1,  # Message is long enough
+                conf.top_n,  # Top n is greater than 0
+            ]
+            related = False
+            if all(get_embed_conditions):
                 # If question mode is enabled, only the first message and messages that end with a ? will be embedded
-                if message.endswith("?") or not conversation.messages:
-                    query_embedding = await self.request_embedding(message, conf)
-            else:
-                query_embedding = await self.request_embedding(message, conf)
+                related = not conf.question_mode or message.endswith("?") or not conversation.messages
+            if related:
+                embedding = await self.request_embedding(message, conf)
+                return embedding, embedding if check_answer_cache else [], embedding if route_tools else []
+            if not check_answer_cache and not route_tools:
+                return [], [], []
+            try:
+                embedding = await self.request_embedding(message, conf)
+            except Exception as e:
+                # The answer cache and routing are optimizations, without them the request goes through as usual
+                log.warning("Failed to embed message for the answer cache or tool routing", exc_info=e)
+                return [], [], []
+            return [], embedding if check_answer_cache else [], embedding if route_tools else []
+
+        async def get_extras() -> dict:
+            mem = guild.get_member(author) if isinstance(author, int) else author
+            lookups = [bank.is_global(), bank.get_currency_name(guild), bank.get_bank_name(guild)]
+            if mem:
+                lookups.append(bank.get_balance(mem))
+            is_global, currency, bank_name, *balance = await asyncio.gather(*lookups)
+            return {
+                "banktype": "global bank" if is_global else "local bank",
+                "currency": currency,
+                "bank": bank_name,
+                "balance": humanize_number(balance[0]) if balance else _("None"),
+            }
+
+        # The embedding, bank lookups and function prep don't depend on each other.
+        # Only the embedding is needed for the answer cache, the rest is cancelled on a cache hit.
+        timer = StageTimer()
+        pending = (
+            asyncio.create_task(timer.run("bank", get_extras())),
+            asyncio.create_task(timer.run("functions", prepare_functions())),
+        )
+        try:
+            query_embedding, cache_embedding, route_embedding = await timer.run("embedding", embed_query())
+
+            answer_namespace = None
+            if check_answer_cache and cache_embedding:
+                answer_namespace = (
+                    conf.embeddings_version(),
+                    model_override or model,
+                    prompt_hash(*prompt_templates),
+                )
+                cached = self.answer_cache.lookup(
+                    guild.id,
+                    cache_embedding,
+                    answer_namespace,
+                    threshold=conf.answer_cache_threshold,
+                    ttl=conf.answer_cache_ttl,
+                )
+                if cached:
+                    user_message = {"role": "user", "content": message}
+                    if author:
+                        user_message["name"] = clean_name(author.name)
+                    conversation.messages.append(user_message)
+                    conversation.update_messages(cached.answer, "assistant", clean_name(self.bot.user.name))
+                    return cached.answer
+
+            extras, (function_calls, function_map) = await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                if not task.done():
+                    task.cancel()
 
         log.debug(f"Query embedding: {len(query_embedding)}")
 
-        mem = guild.get_member(author) if isinstance(author, int) else author
-        bal = humanize_number(await bank.get_balance(mem)) if mem else _("None")
-        extras = {
-            "banktype": "global bank" if await bank.is_global() else "local bank",
-            "currency": await bank.get_currency_name(guild),
-            "bank": await bank.get_bank_name(guild),
-            "balance": bal,
-        }
-
         if using_ollama_endpoint and function_calls:
             function_calls = [i for i in function_calls if is_core_tool(i.get("name", ""))]
             function_map = {k: v for k, v in function_map.items() if is_core_tool(k)}
@@ -434,6 +542,15 @@ class ChatHandler(MixinMeta):
                     function_calls = [i for i in function_calls if i["name"] != func]
                     del function_map[func]
 
+        if route_tools and route_embedding and len(function_calls) > conf.tool_router_top_k:
+            function_calls = await timer.run(
+                "router", self.route_functions(guild, conf, model, function_calls, route_embedding)
+            )
+
+        if conf.cache_friendly_prompts:
+            # Tool schemas are sent ahead of the messages, a stable order keeps them part of the cached prefix
+            function_calls = sorted(function_calls, key=lambda i: i.get("name", ""))
+
         messages = await self.prepare_messages(
             message=message,
             guild=guild,
@@ -447,7 +564,11 @@ class ChatHandler(MixinMeta):
             images=images,
             auto_answer=auto_answer,
             trigger_prompt=trigger_prompt,
+            timer=timer,
         )
+        timer.mark("total")
+        self.stage_metrics.record(timer)
+        log.debug(f"Pre-LLM stages: {timer.summary()}")
         reply = None
 
         calls = 0
@@ -472,7 +593,7 @@ class ChatHandler(MixinMeta):
                         i["role"] = "system"
 
             # Iteratively degrade the conversation to ensure it is always under the token limit
-            degraded = await self.degrade_conversation(messages, function_calls, conf, author)
+            degraded = await self.degrade_conversation(messages, function_calls, conf, author, conversation)
 
             before = len(messages)
             cleaned = await ensure_tool_consistency(messages)
@@ -494,6 +615,7 @@ class ChatHandler(MixinMeta):
                     functions=function_calls,
                     member=author,
                     model_override=model_override,
+                    on_delta=streamer.update if streamer else None,
                 )
             except httpx.ReadTimeout:
                 reply = _("Request timed out, please try again.")
@@ -533,6 +655,10 @@ class ChatHandler(MixinMeta):
 
             await clean_response(response)
 
+            if streamer:
+                # Tools may send to the channel themselves, don't leave a stale preview above their output
+                await streamer.discard()
+
             if response.tool_calls:
                 log.debug("Tool calls detected")
                 response_functions: list[ChatCompletionMessageToolCall] = response.tool_calls
@@ -561,6 +687,8 @@ class ChatHandler(MixinMeta):
             # Add function call count
             conf.functions_called += len(response_functions)
 
+            # Resolve every call first, then run them concurrently and handle the results in the order requested
+            resolved = []  # (function_name, arguments, args, tool_id, role, status)
             for function_call in response_functions:
                 if hasattr(function_call, "name") and hasattr(function_call, "arguments"):
                     # This is a FunctionCall
@@ -586,17 +714,7 @@ class ChatHandler(MixinMeta):
 
                 if function_name not in function_map:
                     log.error(f"GPT suggested a function not provided: {function_name}")
-                    e = {
-                        "role": role,
-                        "name": "invalid_function",
-                        "content": f"{function_name} is not a valid function name",
-                    }
-                    if tool_id:
-                        e["tool_call_id"] = tool_id
-                    messages.append(e)
-                    conversation.messages.append(e)
-                    # Remove the function call from the list
-                    function_calls = [i for i in function_calls if i["name"] != function_name]
+                    resolved.append((function_name, arguments, {}, tool_id, role, "invalid"))
                     continue
 
                 if arguments != "{}":
@@ -613,35 +731,70 @@ class ChatHandler(MixinMeta):
                 if using_ollama_endpoint and not parse_success:
                     log.warning(f"Ollama tool call argument parsing failed for {function_name}: {arguments}")
 
-                if parse_success:
-                    data = {
-                        **extras,
-                        "user": guild.get_member(author) if isinstance(author, int) else author,
-                        "channel": guild.get_channel_or_thread(channel) if isinstance(channel, int) else channel,
-                        "guild": guild,
-                        "bot": self.bot,
-                        "conf": conf,
-                        "conversation": conversation,
-                        "messages": messages,
-                        "message_obj": message_obj,
+                resolved.append((function_name, arguments, args, tool_id, role, "ok" if parse_success else "bad_args"))
+
+            data = {
+                **extras,
+                "user": guild.get_member(author) if isinstance(author, int) else author,
+                "channel": guild.get_channel_or_thread(channel) if isinstance(channel, int) else channel,
+                "guild": guild,
+                "bot": self.bot,
+                "conf": conf,
+                "conversation": conversation,
+                "messages": messages,
+                "message_obj": message_obj,
+            }
+            semaphore = asyncio.Semaphore(TOOL_CALL_CONCURRENCY)
+
+            async def run_function(function_name: str, args: dict):
+                func = function_map[function_name]
+                kwargs = {**args, **data}
+                async with semaphore:
+                    if iscoroutinefunction(func):
+                        return await asyncio.wait_for(func(**kwargs), TOOL_CALL_TIMEOUT)
+                    return await asyncio.wait_for(asyncio.to_thread(func, **kwargs), TOOL_CALL_TIMEOUT)
+
+            if len(resolved) > 1:
+                log.debug(f"Running {len(resolved)} function calls concurrently")
+            results = await asyncio.gather(
+                *(
+                    run_function(function_name, args) if status == "ok" else asyncio.sleep(0)
+                    for function_name, _arguments, args, _tool_id, _role, status in resolved
+                ),
+                return_exceptions=True,
+            )
+
+            for (function_name, arguments, args, tool_id, role, status), func_result in zip(resolved, results):
+                if status == "invalid":
+                    e = {
+                        "role": role,
+                        "name": "invalid_function",
+                        "content": f"{function_name} is not a valid function name",
                     }
-                    kwargs = {**args, **data}
-                    func = function_map[function_name]
-                    try:
-                        if iscoroutinefunction(func):
-                            func_result = await func(**kwargs)
-                        else:
-                            func_result = await asyncio.to_thread(func, **kwargs)
-                    except Exception as e:
-                        log.error(
-                            f"Custom function {function_name} failed to execute!\nArgs: {arguments}",
-                            exc_info=e,
-                        )
-                        func_result = traceback.format_exc()
-                        function_calls = [i for i in function_calls if i["name"] != function_name]
-                else:
+                    if tool_id:
+                        e["tool_call_id"] = tool_id
+                    messages.append(e)
+                    conversation.messages.append(e)
+                    # Remove the function call from the list
+                    function_calls = [i for i in function_calls if i["name"] != function_name]
+                    continue
+
+                if status == "bad_args":
                     # Help the model self-correct
                     func_result = f"JSONDecodeError: Failed to parse arguments for function {function_name}"
+                elif isinstance(func_result, asyncio.TimeoutError):
+                    log.error(f"Custom function {function_name} timed out after {TOOL_CALL_TIMEOUT}s!\nArgs: {arguments}")
+                    func_result = f"TimeoutError: {function_name} took longer than {TOOL_CALL_TIMEOUT} seconds"
+                    function_calls = [i for i in function_calls if i["name"] != function_name]
+                elif isinstance(func_result, Exception):
+                    log.error(
+                        f"Custom function {function_name} failed to execute!\nArgs: {arguments}",
+                        exc_info=func_result,
+                    )
+                    func_result = "".join(
+                        traceback.format_exception(type(func_result), func_result, func_result.__traceback__)
+                    )
+                    function_calls = [i for i in function_calls if i["name"] != function_name]
 
                 return_null = False
 
@@ -744,15 +897,11 @@ class ChatHandler(MixinMeta):
 
         block = False
         if reply:
-            for regex in conf.regex_blacklist:
-                try:
-                    reply = await self.safe_regex(regex, reply)
-                except (asyncio.TimeoutError, mp.TimeoutError):
-                    log.error(f"Regex {regex} in {guild.name} took too long to process. Skipping...")
-                    if conf.block_failed_regex:
-                        block = True
-                except Exception as e:
-                    log.error("Regex sub error", exc_info=e)
+            reply, timed_out = await sub_all(conf.regex_blacklist, reply, self.mp_pool)
+            for regex in timed_out:
+                log.error(f"Regex {regex} in {guild.name} took too long to process. Skipping...")
+                if conf.block_failed_regex:
+                    block = True
 
             conversation.update_messages(reply, "assistant", clean_name(self.bot.user.name))
 
@@ -763,22 +912,64 @@ class ChatHandler(MixinMeta):
             log.info("Auto answer triggered, not responding to user")
             return None
 
+        if reply and answer_namespace and not calls and not block:
+            # Answers that needed tool calls may depend on side effects, only plain answers are reused
+            self.answer_cache.store(
+                guild.id,
+                cache_embedding,
+                answer_namespace,
+                question=message,
+                answer=reply,
+                max_entries=conf.answer_cache_size,
+            )
+
         return reply
 
-    async def safe_regex(self, regex: str, content: str):
-        process = self.mp_pool.apply_async(
-            re.sub,
-            args=(
-                regex,
-                "",
-                content,
-            ),
+    async def route_functions(
+        self,
+        guild: discord.Guild,
+        conf: GuildSettings,
+        model: str,
+        function_calls: List[dict],
+        query_embedding: List[float],
+    ) -> List[dict]:
+        """Narrow the functions sent with a request down to the ones most relevant to the query
+
+        Args:
+            guild (discord.Guild): guild the request is for
+            conf (GuildSettings): current guild settings
+            model (str): chat model, for counting the tokens saved
+            function_calls (List[dict]): every function available this turn
+            query_embedding (List[float]): embedding of the user's message
+
+        Returns:
+            List[dict]: the routed functions, or all of them if routing failed
+        """
+        embed_model = conf.get_embed_model(
+            self.db.endpoint_override, self.db.ollama_models or None, self.db.endpoint_is_ollama
+        )
+        try:
+            routed = await self.tool_router.select(
+                function_calls,
+                query_embedding,
+                top_k=conf.tool_router_top_k,
+                model_key=f"{self.db.endpoint_override or ''}|{embed_model}",
+                embed=lambda texts: self.request_embeddings(texts, conf),
+            )
+        except Exception as e:
+            log.warning("Tool routing failed, sending every function", exc_info=e)
+            return function_calls
+        if len(routed) == len(function_calls):
+            return function_calls
+
+        before, after = await asyncio.gather(
+            self.count_function_tokens(function_calls, model),
+            self.count_function_tokens(routed, model),
         )
-        task = functools.partial(process.get, timeout=2)
-        loop = asyncio.get_running_loop()
-        new_task = loop.run_in_executor(None, task)
-        subbed = await asyncio.wait_for(new_task, timeout=5)
-        return subbed
+        saved = max(before - after, 0)
+        self.tool_router.record(guild.id, len(function_calls) - len(routed), saved)
+        log.debug(f"Tool router sent {len(routed)}/{len(function_calls)} functions, saving {saved} tokens")
+        return routed
 
     async def prepare_messages(
         self,
@@ -794,6 +985,7 @@ class ChatHandler(MixinMeta):
         images: list[str] | None,
         auto_answer: Optional[bool] = False,
         trigger_prompt: Optional[str] = None,
+        timer: Optional[StageTimer] = None,
     ) -> List[dict]:
         """Prepare content for calling the GPT API
 
@@ -810,47 +1002,75 @@ class ChatHandler(MixinMeta):
             images (list[str] | None): list of image URLs to include in the prompt
             auto_answer (Optional[bool]): whether this is an auto answer response
             trigger_prompt (Optional[str]): custom prompt to use when triggered by keywords
+            timer (Optional[StageTimer]): records how long each preparation stage took
 
         Returns:
             List[dict]: list of messages prepped for api
         """
+        timer = timer or StageTimer()
         now = datetime.now().astimezone(pytz.timezone(conf.timezone))
-        params = await asyncio.to_thread(get_params, self.bot, guild, now, author, channel, extras)
+        # Prompt params and the embedding search are independent, both run in threads
+        params, related = await asyncio.gather(
+            timer.run("params", asyncio.to_thread(get_params, self.bot, guild, now, author, channel, extras)),
+            timer.run("related", asyncio.to_thread(conf.get_related_embeddings, guild.id, query_embedding)),
+        )
 
-        def format_string(text: str):
+        # Cache-friendly prompts keep everything that can change between turns out of the system and initial
+        # prompts so their tokens stay identical and the provider's prompt cache can reuse them
+        cache_friendly = conf.cache_friendly_prompts
+
+        def format_string(text: str, stable_only: bool = False):
             """Instead of format(**params) possibly giving a KeyError if prompt has code in it"""
             for k, v in params.items():
                 key = "{" + k + "}"
-                text = text.replace(key, str(v))
+                if stable_only and k in VOLATILE_PARAMS:
+                    # The current value is sent with the context after the cached prefix
+                    text = text.replace(key, f"[{k}]")
+                else:
+                    text = text.replace(key, str(v))
             return text
 
         if channel.id in conf.channel_prompts:
-            system_prompt = format_string(conf.channel_prompts[channel.id])
+            raw_system_prompt = conf.channel_prompts[channel.id]
         else:
-            system_prompt = format_string(conversation.system_prompt_override or conf.system_prompt)
+            raw_system_prompt = conversation.system_prompt_override or conf.system_prompt
+        system_prompt = format_string(raw_system_prompt, stable_only=cache_friendly)
+        initial_prompt = format_string(conf.prompt, stable_only=cache_friendly)
+        context_parts: List[str] = []
+        if cache_friendly:
+            used = [k for k in VOLATILE_PARAMS if "{" + k + "}" in raw_system_prompt + conf.prompt]
+            if used:
+                values = "\n".join(f"[{k}]: {params[k]}" for k in used)
+                context_parts.append(f"# CONTEXT\nCurrent values of the bracketed placeholders above:\n{values}")
 
-        initial_prompt = format_string(conf.prompt)
         model = conf.get_chat_model(
             self.db.endpoint_override, author, self.db.ollama_models or None, self.db.endpoint_is_ollama
         )
-        current_tokens = await self.count_tokens(message + system_prompt + initial_prompt, model)
-        current_tokens += await self.count_payload_tokens(conversation.messages, model)
-        current_tokens += await self.count_function_tokens(function_calls, model)
+        counts = await timer.run(
+            "tokens",
+            asyncio.gather(
+                self.count_tokens(message + system_prompt + initial_prompt + "".join(context_parts), model),
+                self.count_conversation_tokens(conversation, model),
+                self.count_function_tokens(function_calls, model),
+                *(self.count_tokens(i[1], model) for i in related),
+            ),
+        )
+        current_tokens = sum(counts[:3])
 
         max_tokens = self.get_max_tokens(conf, author)
 
-        related = await asyncio.to_thread(conf.get_related_embeddings, guild.id, query_embedding)
-
         embeds: List[str] = []
         # Get related embeddings (Name, text, score, dimensions)
-        for i in related:
-            embed_tokens = await self.count_tokens(i[1], model)
+        for i, embed_tokens in zip(related, counts[3:]):
             if embed_tokens + current_tokens > max_tokens:
                 log.debug("Cannot fit anymore embeddings")
                 break
             embeds.append(f"[{i[0]}](Relatedness: {round(i[2], 4)}): {i[1]}\n")
 
-        if embeds:
+        if embeds and cache_friendly:
+            # Retrieved embeddings change every turn, they always go after the cached prefix
+            context_parts.append(f"# RELATED EMBEDDINGS\n{''.join(embeds)}")
+        elif embeds:
             if conf.embed_method == "static":
                 # Ebeddings go directly into the user message
                 message += f"\n\n# RELATED EMBEDDINGS\n{''.join(embeds)}"
@@ -865,8 +1085,9 @@ class ChatHandler(MixinMeta):
                 if len(embeds) > 1:
                     system_prompt += f"\n\n# RELATED EMBEDDINGS\n{''.join(embeds[1:])}"
 
+        turn_instructions = ""
         if auto_answer:
-            initial_prompt += (
+            turn_instructions += (
                 "\n# AUTO ANSWER:\nYou are responding to a triggered event not specifically requested by the user. "
                 "You may opt to not respond if necessary by calling the `do_not_respond` function.\n"
                 "If you do not have access to functions, you may respond with the exact phrase `do_not_respond`"
@@ -874,7 +1095,12 @@ class ChatHandler(MixinMeta):
 
         if trigger_prompt:
             formatted_trigger = format_string(trigger_prompt)
-            initial_prompt += f"\n# TRIGGER RESPONSE:\n{formatted_trigger}"
+            turn_instructions += f"\n# TRIGGER RESPONSE:\n{formatted_trigger}"
+
+        if cache_friendly and turn_instructions:
+            context_parts.append(turn_instructions.strip())
+        else:
+            initial_prompt += turn_instructions
 
         images = images if model in SUPPORTS_VISION else []
         messages = conversation.prepare_chat(
@@ -884,5 +1110,6 @@ class ChatHandler(MixinMeta):
             name=clean_name(author.name) if author else None,
             images=images,
             resolution=conf.vision_detail,
+            context="\n\n".join(context_parts),
         )
         return messages
@@ -296,6 +296,100 @@ READ_EXTENSIONS = [
     ".sql",
     ".log",
 ]
+# Batched embedding limits (OpenAI accepts up to 2048 inputs and 300k tokens per request)
+EMBED_BATCH_SIZE = 256  # Max inputs per request
+EMBED_BATCH_TOKENS = 200000  # Max tokens per request
+EMBED_CONCURRENCY = 4  # Max batch requests in flight at once
+# Streamed replies edit their placeholder at most this often (Discord allows ~5 edits per 5s per channel)
+STREAM_EDIT_INTERVAL = 1.5
+# Tool calls from a single assistant turn run concurrently
+TOOL_CALL_CONCURRENCY = 4  # Max functions running at once
+TOOL_CALL_TIMEOUT = 180  # Seconds before a function call is abandoned
+# Token overhead of function definitions per model: (func_init, prop_init, prop_key, enum_init, enum_item, func_end)
+FUNCTION_TOKEN_OVERHEAD = {
+    **dict.fromkeys(
+        [
+            "gpt-4o",
+            "gpt-4o-2024-05-13",
+            "gpt-4o-2024-08-06",
+            "gpt-4o-2024-11-20",
+            "gpt-4o-mini",
+            "gpt-4o-mini-2024-07-18",
+            "gpt-4.1",
+            "gpt-4.1-2025-04-14",
+            "gpt-4.1-mini",
+            "gpt-4.1-mini-2025-04-14",
+            "gpt-4.1-nano",
+            "gpt-4.1-nano-2025-04-14",
+            "o1-preview",
+            "o1-preview-2024-09-12",
+            "o1",
+            "o1-2024-12-17",
+            "o1-mini",
+            "o1-mini-2024-09-12",
+            "o3-mini",
+            "o3-mini-2025-01-31",
+            "o3",
+            "o3-2025-04-16",
+            "gpt-5",
+            "gpt-5-2025-04-16",
+            "gpt-5-mini",
+            "gpt-5-mini-2025-04-16",
+            "gpt-5-nano",
+            "gpt-5-nano-2025-04-16",
+            "gpt-5.1",
+            "gpt-5.1-2025-11-13",
+        ],
+        (7, 3, 3, -3, 3, 12),
+    ),
+    **dict.fromkeys(
+        [
+            "gpt-3.5-turbo-1106",
+            "gpt-3.5-turbo-0125",
+            "gpt-4",
+            "gpt-4-turbo",
+            "gpt-4-turbo-preview",
+            "gpt-4-0125-preview",
+            "gpt-4-1106-preview",
+        ],
+        (10, 3, 3, -3, 3, 12),
+    ),
+}
+# Prompt params that can change between turns, kept out of the cached prompt prefix in cache-friendly mode
+VOLATILE_PARAMS = (
+    "timestamp",
+    "datetime",
+    "day",
+    "date",
+    "time",
+    "timetz",
+    "members",
+    "balance",
+    "username",
+    "user",
+    "displayname",
+    "roles",
+    "rolementions",
+    "avatar",
+    "userjoindate",
+    "userjointime",
+    "channelname",
+    "channelmention",
+    "topic",
+)
+# Placeholders that render differently for each user, answers generated with them are personal
+USER_PARAMS = (
+    "balance",
+    "username",
+    "user",
+    "displayname",
+    "roles",
+    "rolementions",
+    "avatar",
+    "userjoindate",
+    "userjointime",
+)
+
 LOADING = "https://i.imgur.com/l3p6EMX.gif"
 REACT_SUMMARY_MESSAGE = """
 Ignore previous instructions. You will be given a snippet of text, your job is to create a "memory" for the given text to provide context for future conversations.
@@ -1,21 +1,103 @@
+import base64
+import hashlib
 import logging
 import typing as t
 from datetime import datetime, timezone
+from pathlib import Path
 from time import perf_counter
 
 import chromadb
 import discord
 import numpy as np
 import orjson
+from chromadb.api import ClientAPI
 from chromadb.errors import ChromaError
-from pydantic import VERSION, BaseModel, Field
+from pydantic import (
+    VERSION,
+    BaseModel,
+    BeforeValidator,
+    ConfigDict,
+    Field,
+    PlainSerializer,
+    PrivateAttr,
+)
 from redbot.core.bot import Red
 
+from . import tokenizer
+from .catalog import FunctionCatalog, schema_digest
 from .constants import MODELS
+from .retrieval import (
+    ENGINES,
+    EngineUnavailable,
+    Match,
+    RetrievalEngine,
+    forget_guild,
+    register_engine,
+    select_engine,
+)
 
 log = logging.getLogger("red.vrt.assistant.models")
 
-_chroma_client = chromadb.Client()
+_chroma_client: t.Optional[ClientAPI] = None
+# Guild ID -> content hash of the embeddings last synced to (or verified in) the vector store this session
+_synced_hashes: t.Dict[int, str] = {}
+
+
+def _get_chroma() -> ClientAPI:
+    """Get the Chroma client, falling back to an in-memory store if no persistent path was configured"""
+    global _chroma_client
+    if _chroma_client is None:
+        _chroma_client = chromadb.Client()
+    return _chroma_client
+
+
+def set_vector_store_path(path: t.Optional[Path]) -> None:
+    """Switch the vector store between on-disk (path provided) and in-memory (None) mode
+
+    Collections are reloaded lazily the next time each guild is queried.
+    """
+    global _chroma_client
+    if path is None:
+        _chroma_client = chromadb.Client()
+    else:
+        path.mkdir(parents=True, exist_ok=True)
+        _chroma_client = chromadb.PersistentClient(path=str(path))
+    _synced_hashes.clear()
+
+
+def delete_vector_store(guild_id: int) -> None:
+    """Remove a guild's collection from the vector store"""
+    forget_guild(guild_id)
+    try:
+        _get_chroma().delete_collection(f"assistant-{guild_id}")
+    except (ChromaError, ValueError):
+        pass
+
+
+class ChromaEngine(RetrievalEngine):
+    """HNSW search through the guild's Chroma collection, kept in sync on every change"""
+
+    name = "chroma"
+
+    def sync(self, conf: "GuildSettings", guild_id: int, **kwargs) -> None:
+        conf.sync_chroma(guild_id, **kwargs)
+
+    def forget(self, guild_id: int) -> None:
+        # Verified against the stored content hash if the guild switches back
+        _synced_hashes.pop(guild_id, None)
+
+    def search(
+        self,
+        conf: "GuildSettings",
+        guild_id: int,
+        query_embedding: t.Sequence[float],
+        top_n: int,
+        min_relatedness: float,
+    ) -> t.List[Match]:
+        return conf.query_chroma(guild_id, query_embedding, top_n, min_relatedness)
+
+
+register_engine(ChromaEngine())
 
 
 class AssistantBaseModel(BaseModel):
@@ -31,9 +113,32 @@ class AssistantBaseModel(BaseModel):
         return orjson.loads(super().json(exclude_defaults=exclude_defaults, **kwargs))
 
 
+def _to_vector(value: t.Any) -> np.ndarray:
+    """Accept a float32 array, a list of floats (legacy configs) or a base64 string of float32 bytes"""
+    if isinstance(value, np.ndarray):
+        return value if value.dtype == np.float32 else value.astype(np.float32)
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype=np.float32).copy()
+    return np.asarray(value if value is not None else [], dtype=np.float32)
+
+
+def _vector_to_b64(value: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(value, dtype=np.float32).tobytes()).decode()
+
+
+# Embedding vectors are held as float32 arrays in memory and stored as base64 in the config
+Vector = t.Annotated[
+    np.ndarray,
+    BeforeValidator(_to_vector),
+    PlainSerializer(_vector_to_b64, return_type=str),
+]
+
+
 class Embedding(AssistantBaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True, validate_assignment=True)
+
     text: str
-    embedding: t.List[float]
+    embedding: Vector
     ai_created: bool = False
     created: datetime = Field(default_factory=lambda: datetime.now(tz=timezone.utc))
     modified: datetime = Field(default_factory=lambda: datetime.now(tz=timezone.utc))
@@ -50,9 +155,25 @@ class Embedding(AssistantBaseModel):
     def update(self):
         self.modified = datetime.now(tz=timezone.utc)
 
+    def content_hash(self) -> str:
+        """Hash of everything that ends up in the vector store for this entry"""
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(f"{self.text}\0{self.model}\0{self.ai_created}\0{self.modified.timestamp()}\0".encode())
+        hasher.update(np.asarray(self.embedding, dtype=np.float32).tobytes())
+        return hasher.hexdigest()
+
     def __str__(self) -> str:
         return self.text
 
+    def __eq__(self, other: object) -> bool:
+        # The default comparison would evaluate `ndarray == ndarray` as a bool, which raises
+        if not isinstance(other, Embedding):
+            return NotImplemented
+        fields = [name for name in type(self).model_fields if name != "embedding"]
+        return all(getattr(self, name) == getattr(other, name) for name in fields) and np.array_equal(
+            self.embedding, other.embedding
+        )
+
 
 class CustomFunction(AssistantBaseModel):
     """Functions added by bot owner via string"""
@@ -61,16 +182,34 @@ class CustomFunction(AssistantBaseModel):
     jsonschema: dict
     permission_level: str = "user"  # user, mod, admin, owner
 
+    # (code, function name, callable) of the last exec, reused until the code or name changes
+    _prepped: t.Optional[t.Tuple[str, str, t.Callable]] = PrivateAttr(default=None)
+
     def prep(self) -> t.Callable:
         """Prep function for execution"""
-        exec(self.code, globals())
-        return globals()[self.jsonschema["name"]]
+        name = self.jsonschema["name"]
+        cached = self._prepped
+        if cached is None or cached[0] != self.code or cached[1] != name:
+            exec(self.code, globals())
+            cached = self._prepped = (self.code, name, globals()[name])
+        return cached[2]
 
 
 class Usage(AssistantBaseModel):
     total_tokens: int = 0
     input_tokens: int = 0
     output_tokens: int = 0
+    cached_tokens: int = 0  # Input tokens served from the provider's prompt cache
+
+
+class ListenerFilter(t.NamedTuple):
+    """Set views of the ID lists the listener checks on every message"""
+
+    listen_channels: t.FrozenSet[int]
+    tutors: t.FrozenSet[int]
+    blacklist: t.FrozenSet[int]
+    trigger_ignore_channels: t.FrozenSet[int]
+    auto_answer_ignored_channels: t.FrozenSet[int]
 
 
 class GuildSettings(AssistantBaseModel):
@@ -85,6 +224,10 @@ class GuildSettings(AssistantBaseModel):
     top_n: int = 3
     min_relatedness: float = 0.78
     embed_method: str = "dynamic"  # hybrid, dynamic, static, user
+    retrieval_engine: str = "auto"  # auto, numpy, chroma
+    retrieval_quantization: str = "none"  # none, int8, binary (NumPy engine only)
+    retrieval_oversample: int = 10  # Quantized search rescores top_n * this many candidates
+    cache_friendly_prompts: bool = False  # Keep the prompt prefix identical between turns for provider prompt caching
     question_mode: bool = False  # If True, only the first message and messages that end with ? will have emebddings
     channel_id: t.Optional[int] = 0  # The main auto-response channel ID
     listen_channels: t.List[int] = []  # Channels to listen to for auto-reply
@@ -97,6 +240,13 @@ class GuildSettings(AssistantBaseModel):
     max_tokens: int = 4000
     mention: bool = False
     mention_respond: bool = True
+    stream_responses: bool = False  # Progressively edit the reply while it is being generated
+    answer_cache: bool = False  # Reuse answers to semantically identical fresh questions
+    answer_cache_threshold: float = 0.95  # Min query similarity to reuse an answer
+    answer_cache_ttl: int = 86400  # Seconds before a cached answer expires
+    answer_cache_size: int = 200  # Max cached answers per server
+    tool_router: bool = False  # Only send the functions most relevant to the message
+    tool_router_top_k: int = 8  # Functions kept by the router on top of the core tools
     enabled: bool = True  # Auto-reply channel
     model: str = "gpt-5.1"
     embed_model: str = "text-embedding-3-small"  # Or text-embedding-3-large, text-embedding-ada-002
@@ -143,12 +293,95 @@ class GuildSettings(AssistantBaseModel):
     function_statuses: t.Dict[str, bool] = {}  # {"function_name": True/False for enabled/disabled}
     functions_called: int = 0
 
+    _listener_filter: t.Optional[ListenerFilter] = PrivateAttr(default=None)
+    # Bumped by `sync_embeddings`, which is called after every change to the embeddings
+    _embeddings_version: int = PrivateAttr(default=0)
+
+    def listener_filter(self) -> ListenerFilter:
+        """Frozen sets of the listener ID lists, built once and reused until `invalidate_listener_filter`"""
+        if self._listener_filter is None:
+            self._listener_filter = ListenerFilter(
+                frozenset(self.listen_channels),
+                frozenset(self.tutors),
+                frozenset(self.blacklist),
+                frozenset(self.trigger_ignore_channels),
+                frozenset(self.auto_answer_ignored_channels),
+            )
+        return self._listener_filter
+
+    def invalidate_listener_filter(self) -> None:
+        """Call after editing any of the lists in `ListenerFilter`"""
+        self._listener_filter = None
+
+    def embeddings_version(self) -> tuple:
+        """Cheap stand-in for `embeddings_hash` that changes whenever the embeddings are synced, added or removed"""
+        return (self._embeddings_version, id(self.embeddings), len(self.embeddings))
+
+    def embeddings_hash(self) -> str:
+        """Fingerprint of the embedding entries, used to tell if the vector store is stale"""
+        hasher = hashlib.blake2b(digest_size=16)
+        for name in sorted(self.embeddings):
+            em = self.embeddings[name]
+            hasher.update(
+                f"{name}\0{em.model}\0{em.modified.timestamp()}\0{len(em.embedding)}\0{em.embedding[:8].tobytes().hex()}\0".encode()
+            )
+        return hasher.hexdigest()
+
+    def get_retrieval_engine(self) -> RetrievalEngine:
+        quantized = self.retrieval_quantization != "none"
+        return select_engine(self.retrieval_engine, len(self.embeddings), quantized)
+
     def sync_embeddings(
         self,
         guild_id: int,
         target_dimension: t.Optional[int] = None,
         force_reset: bool = False,
         target_model: t.Optional[str] = None,
+    ):
+        """Bring the guild's retrieval engine up to date after its embeddings changed"""
+        self._embeddings_version += 1
+        engine = self.get_retrieval_engine()
+        for other in ENGINES.values():
+            if other is not engine:
+                other.forget(guild_id)
+        engine.sync(
+            self,
+            guild_id,
+            target_dimension=target_dimension,
+            force_reset=force_reset,
+            target_model=target_model,
+        )
+
+    def ensure_synced(self, guild_id: int) -> None:
+        """Lazily load a guild's collection, only rebuilding it when its content hash is out of date"""
+        if guild_id in _synced_hashes:
+            return
+        content_hash = self.embeddings_hash()
+        try:
+            collection = _get_chroma().get_collection(f"assistant-{guild_id}")
+            stored_hash = (collection.metadata or {}).get("content_hash")
+        except (ChromaError, ValueError):
+            stored_hash = None
+        if stored_hash == content_hash:
+            log.debug(f"Vector store for guild {guild_id} is up to date, skipping sync")
+            _synced_hashes[guild_id] = content_hash
+            return
+        self.sync_chroma(guild_id)
+
+    def _store_content_hash(self, collection, guild_id: int) -> None:
+        content_hash = self.embeddings_hash()
+        try:
+            collection.modify(metadata={**(collection.metadata or {}), "content_hash": content_hash})
+        except (ChromaError, ValueError) as e:
+            log.debug(f"Failed to store content hash for guild {guild_id}: {e}")
+        _synced_hashes[guild_id] = content_hash
+
+    def sync_chroma(
+        self,
+        guild_id: int,
+        target_dimension: t.Optional[int] = None,
+        force_reset: bool = False,
+        target_model: t.Optional[str] = None,
     ):
         """Sync in-memory embeddings with the Chroma collection, validating dimensions."""
 
@@ -166,7 +399,7 @@ class GuildSettings(AssistantBaseModel):
         collection_name = f"assistant-{guild_id}"
         # Determine the expected dimension from target override or stored embeddings
         dim_candidates = (
-            {len(em.embedding) for em in self.embeddings.values() if em.embedding}
+            {len(em.embedding) for em in self.embeddings.values() if len(em.embedding)}
             if target_dimension is None
             else {target_dimension}
         )
@@ -188,12 +421,12 @@ class GuildSettings(AssistantBaseModel):
         collection = None
         if force_reset:
             try:
-                _chroma_client.delete_collection(collection_name)
+                _get_chroma().delete_collection(collection_name)
             except ChromaError as e:
                 log.warning(f"Failed to delete collection for guild {guild_id}: {e}")
         else:
             try:
-                collection = _chroma_client.get_collection(collection_name)
+                collection = _get_chroma().get_collection(collection_name)
             except ChromaError as e:
                 log.info(f"Failed to get collection for guild {guild_id}: {e}")
                 collection = None
@@ -216,7 +449,7 @@ class GuildSettings(AssistantBaseModel):
 
         if force_reset and collection:
             try:
-                _chroma_client.delete_collection(collection_name)
+                _get_chroma().delete_collection(collection_name)
             except ChromaError as e:
                 log.warning(f"Failed to delete collection for guild {guild_id}: {e}")
             collection = None
@@ -224,7 +457,7 @@ class GuildSettings(AssistantBaseModel):
             collection = None
 
         if not collection:
-            collection = _chroma_client.create_collection(
+            collection = _get_chroma().create_collection(
                 collection_name,
                 configuration={"hnsw": {"space": "cosine"}},
                 metadata={
@@ -236,50 +469,43 @@ class GuildSettings(AssistantBaseModel):
 
         if not valid_embeddings:
             log.info(f"No valid embeddings to sync for guild {guild_id}.")
+            self._store_content_hash(collection, guild_id)
             return
 
-        ids = list(valid_embeddings.keys())
-        collection_data = collection.get()
-        existing_ids = collection_data["ids"] if collection_data["ids"] else []
-
-        new_ids = [i for i in ids if i not in existing_ids]
-        if new_ids:
-            log.info(f"Adding {len(new_ids)} new embeddings to collection for guild {guild_id}")
-            embeddings = [valid_embeddings[i].embedding for i in new_ids]
-            metadatas = [valid_embeddings[i].model_dump(exclude=["embedding"]) for i in new_ids]
-            collection.add(ids=new_ids, embeddings=embeddings, metadatas=metadatas)
+        # Diff against the per-entry content hashes stored in the collection metadata
+        entry_hashes = {name: em.content_hash() for name, em in valid_embeddings.items()}
+        collection_data = collection.get(include=["metadatas"])
+        existing_ids = collection_data["ids"] or []
+        existing_metadatas = collection_data["metadatas"] or [None] * len(existing_ids)
+        existing_hashes = {i: (meta or {}).get("content_hash") for i, meta in zip(existing_ids, existing_metadatas)}
 
         # Remove any stale entries from the collection
-        missing_ids = [i for i in existing_ids if i not in ids]
+        missing_ids = list(set(existing_hashes) - set(entry_hashes))
+        # Add new entries and update existing ones when the vector or metadata has changed
+        changed_ids = [i for i, h in entry_hashes.items() if existing_hashes.get(i) != h]
+
+        batch_size = getattr(_get_chroma(), "get_max_batch_size", lambda: 5000)()
         if missing_ids:
             log.info(f"Removing {len(missing_ids)} old embeddings from collection for guild {guild_id}")
-            collection.delete(ids=list(set(missing_ids)))
-
-        # Update existing entries when the vector or metadata has changed
-        for embed_name, em in valid_embeddings.items():
-            if embed_name not in existing_ids:
-                continue
-            result = collection.get(ids=[embed_name])
-            if not result["ids"] or not result["embeddings"]:
-                log.warning(f"Embedding {embed_name} not found in collection for guild {guild_id}. Adding it.")
-                collection.add(
-                    ids=[embed_name],
-                    embeddings=[em.embedding],
-                    metadatas=[em.model_dump(exclude=["embedding"])],
-                )
-                continue
-
-            existing_embedding = result["embeddings"][0] if result["embeddings"] else []
-            if existing_embedding != em.embedding:
-                log.info(f"Updating embedding {embed_name} in collection for guild {guild_id}.")
-                collection.update(
-                    ids=[embed_name],
-                    embeddings=[em.embedding],
-                    metadatas=[em.model_dump(exclude=["embedding"])],
+            for idx in range(0, len(missing_ids), batch_size):
+                collection.delete(ids=missing_ids[idx : idx + batch_size])
+        if changed_ids:
+            log.info(f"Upserting {len(changed_ids)} new or changed embeddings for guild {guild_id}")
+            for idx in range(0, len(changed_ids), batch_size):
+                chunk = changed_ids[idx : idx + batch_size]
+                collection.upsert(
+                    ids=chunk,
+                    embeddings=[valid_embeddings[i].embedding for i in chunk],
+                    metadatas=[
+                        {**valid_embeddings[i].model_dump(exclude=["embedding"]), "content_hash": entry_hashes[i]}
+                        for i in chunk
+                    ],
                 )
-            else:
-                log.debug(f"Embedding {embed_name} is already up-to-date in collection for guild {guild_id}.")
+        log.debug(
+            f"{len(entry_hashes) - len(changed_ids)} embeddings already up-to-date in collection for guild {guild_id}."
+        )
 
+        self._store_content_hash(collection, guild_id)
         log.info(
             f"Synced embeddings for guild {guild_id} with {len(valid_embeddings)} embeddings "
             f"(skipped {len(self.embeddings) - len(valid_embeddings)})."
@@ -291,20 +517,44 @@ class GuildSettings(AssistantBaseModel):
         query_embedding: t.List[float],
         top_n_override: t.Optional[int] = None,
         relatedness_override: t.Optional[float] = None,
-    ) -> t.List[t.Tuple[str, str, float, int]]:
-        def cosine_similarity(a, b):
-            return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-        if not query_embedding:
+    ) -> t.List[Match]:
+        if not len(query_embedding):
             return []
-        # Name, text, score, dimensions
-        q_length = len(query_embedding)
         top_n = top_n_override or self.top_n
         min_relatedness = relatedness_override or self.min_relatedness
-
-        if not top_n or q_length == 0 or not self.embeddings:
+        if not top_n or not self.embeddings:
             return []
 
+        engine = self.get_retrieval_engine()
+        start = perf_counter()
+        try:
+            related = engine.search(self, guild_id, query_embedding, top_n, min_relatedness)
+        except EngineUnavailable as e:
+            log.warning(f"{engine.name} retrieval unavailable for guild {guild_id}, falling back to numpy: {e}")
+            engine = ENGINES["numpy"]
+            related = engine.search(self, guild_id, query_embedding, top_n, min_relatedness)
+        log.debug(
+            f"Got {len(related)} related embeddings in {perf_counter() - start:.4f} seconds "
+            f"for guild {guild_id} using {engine.name}."
+        )
+        related.sort(key=lambda x: x[2], reverse=True)
+        return related[:top_n]
+
+    def query_chroma(
+        self,
+        guild_id: int,
+        query_embedding: t.List[float],
+        top_n: int,
+        min_relatedness: float,
+    ) -> t.List[Match]:
+        """Search the guild's Chroma collection, resyncing it if it is missing or has the wrong dimensions
+
+        Raises:
+            EngineUnavailable: the collection couldn't be created or queried
+        """
+        q_length = len(query_embedding)
+        self.ensure_synced(guild_id)
+
         valid_embeddings = {k: v for k, v in self.embeddings.items() if len(v.embedding) == q_length}
         skipped = len(self.embeddings) - len(valid_embeddings)
         if not valid_embeddings:
@@ -312,51 +562,48 @@ class GuildSettings(AssistantBaseModel):
                 f"No embeddings match query dimension {q_length} for guild {guild_id}. "
                 "Triggering resync and skipping related search."
             )
-            self.sync_embeddings(guild_id, target_dimension=q_length, force_reset=True)
+            self.sync_chroma(guild_id, target_dimension=q_length, force_reset=True)
             return []
         if skipped:
             log.info(
                 f"Found {skipped} embeddings with mismatched dimensions for guild {guild_id}; "
                 "resetting collection to match the query dimension."
             )
-            self.sync_embeddings(guild_id, target_dimension=q_length, force_reset=True)
+            self.sync_chroma(guild_id, target_dimension=q_length, force_reset=True)
 
         try:
-            collection = _chroma_client.get_collection(f"assistant-{guild_id}")
+            collection = _get_chroma().get_collection(f"assistant-{guild_id}")
         except ChromaError as e:
             log.info(f"Failed to get collection for guild {guild_id}: {e}")
             collection = None
 
         if not collection:
-            self.sync_embeddings(
+            self.sync_chroma(
                 guild_id,
                 target_dimension=q_length,
                 force_reset=True,
                 target_model=next(iter(valid_embeddings.values())).model,
             )
             try:
-                collection = _chroma_client.get_collection(f"assistant-{guild_id}")
+                collection = _get_chroma().get_collection(f"assistant-{guild_id}")
             except ChromaError as e:
-                log.error(f"Failed to create collection for guild {guild_id}: {e}")
-                return []
+                raise EngineUnavailable(f"Failed to create collection for guild {guild_id}: {e}") from e
 
-        start = perf_counter()
         try:
-            results = collection.query(query_embeddings=[query_embedding], n_results=top_n_override or self.top_n)
+            results = collection.query(query_embeddings=[query_embedding], n_results=top_n)
         except (ChromaError, ValueError) as e:
             if "dimension" in str(e).lower():
                 log.warning(f"Dimension mismatch when querying embeddings for guild {guild_id}: {e}. Resetting store.")
-                self.sync_embeddings(guild_id, target_dimension=q_length, force_reset=True)
+                self.sync_chroma(guild_id, target_dimension=q_length, force_reset=True)
                 try:
-                    collection = _chroma_client.get_collection(f"assistant-{guild_id}")
-                    results = collection.query(query_embeddings=[query_embedding], n_results=top_n_override or self.top_n)
+                    collection = _get_chroma().get_collection(f"assistant-{guild_id}")
+                    results = collection.query(query_embeddings=[query_embedding], n_results=top_n)
                 except Exception as inner_e:  # noqa: BLE001
-                    log.error(f"Failed to query embeddings after reset for guild {guild_id}: {inner_e}")
-                    return []
+                    raise EngineUnavailable(
+                        f"Failed to query embeddings after reset for guild {guild_id}: {inner_e}"
+                    ) from inner_e
             else:
-                log.error(f"Failed to query embeddings for guild {guild_id}: {e}")
-                return []
-        # print(results)
+                raise EngineUnavailable(f"Failed to query embeddings for guild {guild_id}: {e}") from e
         strings_and_relatedness = []
         for idx in range(len(results["ids"][0])):
             embed_name = results["ids"][0][idx]
@@ -371,18 +618,7 @@ class GuildSettings(AssistantBaseModel):
             relatedness = 1 - distance
             if relatedness >= min_relatedness:
                 strings_and_relatedness.append((embed_name, metadata["text"], relatedness, len(embedding)))
-
-        end = perf_counter()
-        iter_time = end - start
-        log.debug(
-            f"Got {len(strings_and_relatedness)} related embeddings in {iter_time:.2f} seconds for guild {guild_id}."
-        )
-
-        if not strings_and_relatedness:
-            return []
-
-        strings_and_relatedness.sort(key=lambda x: x[2], reverse=True)
-        return strings_and_relatedness[:top_n]
+        return strings_and_relatedness
 
     def update_usage(
         self,
@@ -390,6 +626,7 @@ class GuildSettings(AssistantBaseModel):
         total_tokens: int,
         input_tokens: int,
         output_tokens: int,
+        cached_tokens: int = 0,
     ) -> None:
         if model not in self.usage:
             self.usage[model] = Usage()
@@ -399,6 +636,8 @@ class GuildSettings(AssistantBaseModel):
             self.usage[model].input_tokens += input_tokens
         if output_tokens:
             self.usage[model].output_tokens += output_tokens
+        if cached_tokens:
+            self.usage[model].cached_tokens += cached_tokens
 
     def get_user_model(self, member: t.Optional[discord.Member] = None) -> str:
         if not member or not self.role_overrides:
@@ -493,6 +732,66 @@ class Conversation(AssistantBaseModel):
     last_updated: float = 0.0
     system_prompt_override: t.Optional[str] = None
 
+    # {encoding_name: {id(message): (message, signature, text_tokens, image_count)}}
+    _token_cache: t.Dict[str, t.Dict[int, tuple]] = PrivateAttr(default_factory=dict)
+
+    @staticmethod
+    def _token_signature(message: dict) -> tuple:
+        """Cheap fingerprint used to detect in-place edits of a cached message"""
+        content = message.get("content")
+        size = len(content) if isinstance(content, (str, list)) else 0
+        return message.get("role"), id(content), size, len(message)
+
+    def message_tokens(self, message: dict, model: str) -> int:
+        """Token count of a single message, cached per encoding until the message is edited"""
+        encoding_name = tokenizer.get_encoding_name(model)
+        cache = self._token_cache.setdefault(encoding_name, {})
+        signature = self._token_signature(message)
+        cached = cache.get(id(message))
+        if cached is None or cached[0] is not message or cached[1] != signature:
+            text_tokens, images = tokenizer.count_message(message, encoding_name)
+            cached = (message, signature, text_tokens, images)
+            cache[id(message)] = cached
+        return cached[2] + cached[3] * tokenizer.image_tokens(model)
+
+    def count_tokens(self, model: str, messages: t.Optional[t.List[dict]] = None) -> int:
+        """Count the prompt tokens of the conversation (or a payload built from it)
+
+        Only messages that were added or edited since the last count get encoded.
+        """
+        messages = self.messages if messages is None else messages
+        if not messages:
+            return 0
+        return sum(self.message_tokens(message, model) for message in messages) + 3
+
+    def uncached_messages(self, model: str, messages: t.Optional[t.List[dict]] = None) -> int:
+        """Number of messages that would need to be encoded by `count_tokens`"""
+        messages = self.messages if messages is None else messages
+        cache = self._token_cache.get(tokenizer.get_encoding_name(model), {})
+        uncached = 0
+        for message in messages:
+            cached = cache.get(id(message))
+            if cached is None or cached[0] is not message or cached[1] != self._token_signature(message):
+                uncached += 1
+        return uncached
+
+    def invalidate_tokens(self, message: t.Optional[dict] = None) -> None:
+        """Drop cached token counts for one message, or all of them"""
+        if message is None:
+            self._token_cache.clear()
+            return
+        for cache in self._token_cache.values():
+            cache.pop(id(message), None)
+
+    def _prune_token_cache(self) -> None:
+        """Forget counts for messages that are no longer part of the conversation"""
+        if not self._token_cache:
+            return
+        live = {id(message) for message in self.messages}
+        for cache in self._token_cache.values():
+            for key in [k for k in cache if k not in live]:
+                del cache[key]
+
     def get_images(self) -> t.List[str]:
         """Get all image b64 strings in the conversation
         Each string looks like "data:image/jpeg;base64,..." so we need to extract the base64 part
@@ -527,10 +826,12 @@ class Conversation(AssistantBaseModel):
             self.messages.clear()
         elif conf.max_retention:
             self.messages = self.messages[-conf.get_user_max_retention(member) :]
+        self._prune_token_cache()
 
     def reset(self):
         self.refresh()
         self.messages.clear()
+        self.invalidate_tokens()
 
     def refresh(self):
         self.last_updated = datetime.now().timestamp()
@@ -538,6 +839,7 @@ class Conversation(AssistantBaseModel):
     def overwrite(self, messages: t.List[dict]):
         self.refresh()
         self.messages = [i for i in messages if i["role"] not in ["system", "developer"]]
+        self._prune_token_cache()
 
     def update_messages(
         self,
@@ -574,8 +876,12 @@ class Conversation(AssistantBaseModel):
         name: str = None,
         images: t.List[str] = None,
         resolution: str = "auto",
+        context: t.Optional[str] = None,
     ) -> t.List[dict]:
-        """Pre-appends the prmompts before the user's messages without motifying them"""
+        """Pre-appends the prmompts before the user's messages without motifying them
+
+        `context` is sent right before the user's message and is not kept in the conversation history.
+        """
         prepared = []
         if system_prompt.strip():
             prepared.append({"role": "developer", "content": system_prompt})
@@ -608,6 +914,8 @@ class Conversation(AssistantBaseModel):
         else:
             content = user_message
 
+        if context and context.strip():
+            prepared.append({"role": "developer", "content": context})
         user_message_payload = {"role": "user", "content": content}
         if name:
             user_message_payload["name"] = name
@@ -618,6 +926,8 @@ class Conversation(AssistantBaseModel):
 
 
 class DB(AssistantBaseModel):
+    _catalog: FunctionCatalog = PrivateAttr(default_factory=FunctionCatalog)
+
     configs: t.Dict[int, GuildSettings] = {}
     conversations: t.Dict[str, Conversation] = {}
     persistent_conversations: bool = False
@@ -629,6 +939,27 @@ class DB(AssistantBaseModel):
     ollama_models: t.List[str] = Field(default_factory=list)
     endpoint_health_check: bool = False
     endpoint_health_interval: int = 60
+    persistent_vector_store: bool = False  # Keep embedding indexes on disk between restarts
+
+    # Pooled LLM client connection limits
+    http_max_connections: int = 100
+    http_max_keepalive: int = 20
+    http_idle_timeout: int = 900  # Seconds before an unused client is closed
+
+    # Config saves are coalesced until no new change has come in for save_delay seconds
+    save_delay: float = 5.0
+    save_max_delay: float = 60.0  # Upper bound on how long a pending change can wait to be written
+
+    # Query embeddings shared between chat, auto-answer and memory search
+    embedding_cache_size: int = 2048
+    persist_embedding_cache: bool = False  # Keep cached query embeddings between restarts
+
+    # Request scheduler, shared by every guild
+    max_concurrent_requests: int = 8  # LLM and embedding calls in flight at once
+    max_queued_requests: int = 50  # Per guild, further requests are rejected
+    rate_limit_rpm: int = 0  # Requests per minute per API key, 0 for no limit
+    rate_limit_tpm: int = 0  # Tokens per minute per API key, 0 for no limit
+    scheduler_weights: t.Dict[int, float] = {}  # {guild_id: share of the slots relative to other guilds}
 
     def get_conf(self, guild: t.Union[discord.Guild, int]) -> GuildSettings:
         gid = guild if isinstance(guild, int) else guild.id
@@ -653,6 +984,9 @@ class DB(AssistantBaseModel):
     ) -> t.Tuple[t.List[dict], t.Dict[str, t.Callable]]:
         """Prep custom and registry functions for use with the API
 
+        Results are cached per guild and permission tier by the function catalog until a function,
+        its enabled status or the registry changes.
+
         Args:
             bot (Red): Red instance
             conf (GuildSettings): current guild settings
@@ -661,27 +995,30 @@ class DB(AssistantBaseModel):
         Returns:
             t.Tuple[t.List[dict], t.Dict[str, t.Callable]]: t.List of json function schemas and a dict mapping to their callables
         """
-
-        async def can_use(perm_level: str) -> bool:
-            if perm_level == "user":
-                return True
-            if member is None:
-                return False
-            if perm_level == "mod":
-                perms = [
-                    member.guild_permissions.manage_messages,
-                    await bot.is_mod(member),
-                ]
-                return any(perms)
-            if perm_level == "admin":
-                perms = [
-                    member.guild_permissions.administrator,
-                    await bot.is_admin(member),
-                ]
-                return any(perms)
-            if perm_level == "owner":
-                return await bot.is_owner(member)
-            return False
+        levels = frozenset() if showall else await self._catalog.permission_levels(bot, member)
+
+        def can_use(perm_level: str) -> bool:
+            return showall or perm_level in levels
+
+        # Anything that changes which functions are available, or what they point to, changes the fingerprint
+        fingerprint = (
+            frozenset(name for name, enabled in conf.function_statuses.items() if enabled),
+            tuple(
+                (name, func.permission_level, hash(func.code), schema_digest(func.jsonschema))
+                for name, func in self.functions.items()
+            ),
+            tuple(
+                (
+                    cog_name,
+                    id(bot.get_cog(cog_name)),
+                    tuple((name, schema_digest(data)) for name, data in schemas.items()),
+                )
+                for cog_name, schemas in registry.items()
+            ),
+        )
+        key = (getattr(getattr(member, "guild", None), "id", None), levels, showall)
+        if (cached := self._catalog.get(key, fingerprint)) is not None:
+            return cached
 
         function_calls = []
         function_map = {}
@@ -691,7 +1028,7 @@ class DB(AssistantBaseModel):
             if not conf.function_statuses.get(function_name, False):
                 # Function is disabled
                 continue
-            if not await can_use(func.permission_level) and not showall:
+            if not can_use(func.permission_level):
                 continue
             function_calls.append(func.jsonschema)
             function_map[function_name] = func.prep()
@@ -711,14 +1048,15 @@ class DB(AssistantBaseModel):
                 if function_obj is None:
                     log.error(f"{cog_name} doesnt have a function called {function_name}!")
                     continue
-                if not await can_use(data["permission_level"]) and not showall:
+                if not can_use(data["permission_level"]):
                     log.debug(
-                        f"{member.name} cannot use {function_name} with {data['permission_level']} permission level."
+                        f"{getattr(member, 'name', None)} cannot use {function_name} with {data['permission_level']} permission level."
                     )
                     continue
                 function_calls.append(data["schema"])
                 function_map[function_name] = function_obj
 
+        self._catalog.put(key, fingerprint, (function_calls, function_map))
         log.debug(f"Prepped: {function_map.keys()}")
         return function_calls, function_map
 
@@ -0,0 +1,236 @@
+import asyncio
+import functools
+import logging
+import multiprocessing as mp
+import re
+import typing as t
+from dataclasses import dataclass, field
+from functools import lru_cache
+from multiprocessing.pool import Pool
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+try:
+    import re2
+
+    RE2_AVAILABLE = True
+except ImportError:
+    RE2_AVAILABLE = False
+
+log = logging.getLogger("red.vrt.assistant.patterns")
+
+# Ops that can only be run by a backtracking engine
+BACKTRACKING_OPS = {"GROUPREF", "GROUPREF_EXISTS", "ASSERT", "ASSERT_NOT"}
+REPEAT_OPS = {"MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"}
+# Sandboxed patterns are abandoned after this many seconds
+SANDBOX_TIMEOUT = 2
+
+
+def _op_name(op) -> str:
+    return getattr(op, "name", str(op))
+
+
+def _variable_repeats(parsed, nested: bool = False) -> int:
+    """Count repeats with a variable count in a parsed pattern, returning -1 if the pattern is not safe to run inline"""
+    total = 0
+    for op, av in parsed:
+        name = _op_name(op)
+        if name in BACKTRACKING_OPS:
+            return -1
+        children = []
+        if name in REPEAT_OPS:
+            if nested:
+                # Any repeat under another, bounded or not, multiplies the ways to split the input,
+                # e.g. (a+)+ or (?:\w{1,40}){1,40}
+                return -1
+            low, high, sub = av
+            total += low != high
+            count = _variable_repeats(sub, nested=True)
+            if count < 0:
+                return -1
+            total += count
+            continue
+        if name == "SUBPATTERN":
+            children = [av[-1]]
+        elif name == "ATOMIC_GROUP":
+            children = [av]
+        elif name == "BRANCH":
+            if nested:
+                # Overlapping alternatives under a quantifier, like (a|aa){1,60}, backtrack exponentially
+                return -1
+            children = av[1]
+        for child in children:
+            count = _variable_repeats(child, nested)
+            if count < 0:
+                return -1
+            total += count
+    return total
+
+
+@lru_cache(maxsize=1024)
+def is_linear(pattern: str) -> bool:
+    """Whether a pattern is cheap enough to run on the event loop with the stdlib engine
+
+    Allows at most one variable-count quantifier (like `+`, `?` or `{1,5}`), and no quantifiers or
+    alternations under a quantifier, backreferences or lookarounds.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return False
+    return 0 <= _variable_repeats(parsed) <= 1
+
+
+# RE2 treats these classes as ASCII only, the stdlib matches any Unicode letter, digit or space
+UNICODE_CLASSES = re.compile(r"(?<!\\)(?:\\\\)*\\[dDwWsSbB]")
+# Flags that have an inline RE2 equivalent
+RE2_FLAGS = {re.IGNORECASE: "i", re.MULTILINE: "m", re.DOTALL: "s"}
+
+
+def _compile_re2(pattern: str, flags: int):
+    """Compile with RE2 if it would match exactly what the stdlib does, None otherwise"""
+    if flags & ~(re.IGNORECASE | re.MULTILINE | re.DOTALL | re.UNICODE):
+        return None
+    if UNICODE_CLASSES.search(pattern):
+        return None
+    inline = "".join(letter for flag, letter in RE2_FLAGS.items() if flags & flag)
+    try:
+        return re2.compile(f"(?{inline}){pattern}" if inline else pattern)
+    except re2.error as e:
+        # RE2 rejects backreferences and lookarounds
+        log.debug(f"RE2 can't compile '{pattern}', checking if it is safe for the stdlib engine: {e}")
+        return None
+
+
+def _compile_inline(pattern: str, flags: int, proven: bool = False):
+    """Compile a pattern for inline use, preferring RE2 (linear time) when installed
+
+    Patterns RE2 can't run the same way as the stdlib (`\\d`, `\\w`, `\\s` and `\\b` are ASCII only in RE2,
+    other flags have no equivalent) need a structural proof that the stdlib engine won't backtrack badly,
+    unless `proven` says the caller already has one. Returns None if the pattern needs the sandbox.
+    """
+    if RE2_AVAILABLE:
+        compiled = _compile_re2(pattern, flags)
+        if compiled is not None:
+            return compiled
+    if proven or is_linear(pattern):
+        return re.compile(pattern, flags)
+    return None
+
+
+@dataclass
+class CompiledPatterns:
+    """A set of patterns split into the ones that run inline and the ones that need the process sandbox"""
+
+    # (pattern, compiled) in the original order, compiled is None for sandboxed patterns
+    entries: t.List[t.Tuple[str, t.Any]] = field(default_factory=list)
+    # All inline patterns joined into a single alternation, used for "match any" checks
+    combined: t.Any = None
+    invalid: t.List[str] = field(default_factory=list)
+
+    @property
+    def inline(self) -> t.List[t.Any]:
+        return [compiled for _pattern, compiled in self.entries if compiled is not None]
+
+    @property
+    def sandboxed(self) -> t.List[str]:
+        return [pattern for pattern, compiled in self.entries if compiled is None]
+
+
+@lru_cache(maxsize=256)
+def compile_patterns(patterns: t.Tuple[str, ...], flags: int = 0) -> CompiledPatterns:
+    """Compile a pattern list once, cached until the list (i.e. the guild config) changes"""
+    compiled = CompiledPatterns()
+    for pattern in patterns:
+        try:
+            re.compile(pattern, flags)
+        except re.error as e:
+            log.error(f"Invalid regex pattern '{pattern}': {e}")
+            compiled.invalid.append(pattern)
+            continue
+        compiled.entries.append((pattern, _compile_inline(pattern, flags)))
+
+    inline = [pattern for pattern, engine in compiled.entries if engine is not None]
+    if len(inline) > 1:
+        try:
+            # Non-capturing groups keep each branch self contained, inline global flags make this fail
+            # An alternation of stdlib-safe patterns is no worse than running them in turn. Patterns only RE2
+            # can run safely must stay on RE2, if the combined pattern doesn't compile there they run one by one.
+            compiled.combined = _compile_inline(
+                "|".join(f"(?:{pattern})" for pattern in inline),
+                flags,
+                proven=all(is_linear(pattern) for pattern in inline),
+            )
+        except re.error:
+            compiled.combined = None
+    elif inline:
+        compiled.combined = compiled.inline[0]
+    log.debug(
+        f"Compiled {len(patterns)} patterns: {len(inline)} inline, "
+        f"{len(compiled.sandboxed)} sandboxed, {len(compiled.invalid)} invalid"
+    )
+    return compiled
+
+
+async def _run_sandboxed(pool: Pool, func: t.Callable, *args):
+    """Run a regex function in the process pool so catastrophic backtracking can be abandoned"""
+    process = pool.apply_async(func, args=args)
+    task = functools.partial(process.get, timeout=SANDBOX_TIMEOUT)
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(None, task), timeout=SANDBOX_TIMEOUT + 3)
+
+
+async def search_any(patterns: t.Sequence[str], content: str, pool: Pool, flags: int = re.IGNORECASE) -> bool:
+    """Check if any of the patterns match the content"""
+    if not patterns:
+        return False
+    compiled = compile_patterns(tuple(patterns), flags)
+    if compiled.combined is not None:
+        if compiled.combined.search(content):
+            return True
+    else:
+        for engine in compiled.inline:
+            if engine.search(content):
+                return True
+    for pattern in compiled.sandboxed:
+        try:
+            # re.findall returns a list (picklable) instead of a Match
+            if await _run_sandboxed(pool, re.findall, re.compile(pattern, flags), content):
+                return True
+        except (asyncio.TimeoutError, mp.TimeoutError):
+            log.warning(f"Regex pattern '{pattern}' took too long to process")
+        except Exception as e:
+            log.error(f"Error checking regex pattern: {e}")
+    return False
+
+
+async def sub_all(
+    patterns: t.Sequence[str],
+    content: str,
+    pool: Pool,
+    repl: str = "",
+    flags: int = 0,
+) -> t.Tuple[str, t.List[str]]:
+    """Apply every pattern's substitution to the content in order
+
+    Returns:
+        Tuple[str, List[str]]: the new content and the patterns that timed out
+    """
+    timed_out = []
+    if not patterns:
+        return content, timed_out
+    compiled = compile_patterns(tuple(patterns), flags)
+    for pattern, engine in compiled.entries:
+        if engine is not None:
+            content = engine.sub(repl, content)
+            continue
+        try:
+            content = await _run_sandboxed(pool, re.sub, re.compile(pattern, flags), repl, content)
+        except (asyncio.TimeoutError, mp.TimeoutError):
+            timed_out.append(pattern)
+        except Exception as e:
+            log.error("Regex sub error", exc_info=e)
+    return content, timed_out
@@ -0,0 +1,270 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import random
+import re
+import typing as t
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic
+
+import httpx
+import ollama
+import openai
+from tenacity import RetryCallState, retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+from tenacity.wait import wait_base
+
+log = logging.getLogger("red.vrt.assistant.ratelimit")
+T = t.TypeVar("T")
+
+# Never wait longer than this on a single rate limit, let the provider decide after that
+MAX_BACKOFF = 60.0
+RETRYABLE_ERRORS = (
+    httpx.TimeoutException,
+    openai.InternalServerError,
+    openai.RateLimitError,
+    ollama.RequestError,
+    ollama.ResponseError,
+)
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: t.Optional[str]) -> t.Optional[float]:
+    """Parse a reset header like `1s`, `6m0s` or `120ms` (or plain seconds) into seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _parse_int(value: t.Optional[str]) -> t.Optional[int]:
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def retry_delay(headers: t.Mapping[str, str]) -> t.Optional[float]:
+    """How long the provider asked us to wait before retrying, None if it didn't say"""
+    if delay := _parse_int(headers.get("retry-after-ms")):
+        return delay / 1000
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            # HTTP date form
+            return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    # Wait for whichever budget ran out, or the sooner reset if the headers don't tell which
+    resets = []
+    for kind in ("requests", "tokens"):
+        reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        if reset is None:
+            continue
+        if _parse_int(headers.get(f"x-ratelimit-remaining-{kind}")) == 0:
+            return reset
+        resets.append(reset)
+    return min(resets) if resets else None
+
+
+@dataclass
+class RateLimitBudget:
+    """What the provider last reported about an API key's rate limits"""
+
+    limit_requests: t.Optional[int] = None
+    limit_tokens: t.Optional[int] = None
+    remaining_requests: t.Optional[int] = None
+    remaining_tokens: t.Optional[int] = None
+    reset_requests: float = 0.0  # Monotonic time the request budget is back to its limit
+    reset_tokens: float = 0.0
+    blocked_until: float = 0.0  # Set by a 429, every request on the key waits until then
+    rate_limited: int = 0  # 429 responses seen
+    updated: float = 0.0
+
+    def refresh(self, now: float) -> None:
+        if self.reset_requests and now >= self.reset_requests:
+            self.remaining_requests = self.limit_requests
+            self.reset_requests = 0.0
+        if self.reset_tokens and now >= self.reset_tokens:
+            self.remaining_tokens = self.limit_tokens
+            self.reset_tokens = 0.0
+
+    def delay(self, tokens: int = 0, now: t.Optional[float] = None) -> float:
+        """Seconds to wait before a request using `tokens` tokens would fit in the budget"""
+        now = monotonic() if now is None else now
+        self.refresh(now)
+        delay = self.blocked_until - now
+        if self.remaining_requests is not None and self.remaining_requests <= 0:
+            delay = max(delay, self.reset_requests - now)
+        if self.remaining_tokens is not None and tokens > self.remaining_tokens:
+            # A request bigger than the whole limit can never fit, don't hold it back for nothing
+            if self.limit_tokens is None or tokens <= self.limit_tokens:
+                delay = max(delay, self.reset_tokens - now)
+        return max(delay, 0.0)
+
+
+class RateLimitRegistry:
+    """Rate limit state per API key, shared by every request made with that key
+
+    Budgets are updated from the `x-ratelimit-*` headers of every response. A 429 blocks the
+    whole key until the provider's reset time, so concurrent requests back off together instead
+    of each burning a retry on their own.
+    """
+
+    def __init__(self):
+        self._budgets: t.Dict[str, RateLimitBudget] = {}
+
+    @staticmethod
+    def key_id(api_key: str) -> str:
+        """Budgets are keyed by a hash so the raw keys aren't held onto"""
+        return hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest()
+
+    def budget(self, api_key: str) -> RateLimitBudget:
+        key = self.key_id(api_key)
+        if key not in self._budgets:
+            self._budgets[key] = RateLimitBudget()
+        return self._budgets[key]
+
+    def budgets(self) -> t.Dict[str, RateLimitBudget]:
+        return dict(self._budgets)
+
+    def observe(self, api_key: str, headers: t.Mapping[str, str], status_code: int) -> None:
+        """Update a key's budget from a provider response"""
+        budget = self.budget(api_key)
+        now = monotonic()
+        for kind in ("requests", "tokens"):
+            limit = _parse_int(headers.get(f"x-ratelimit-limit-{kind}"))
+            remaining = _parse_int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if limit is not None:
+                setattr(budget, f"limit_{kind}", limit)
+            if remaining is not None:
+                setattr(budget, f"remaining_{kind}", remaining)
+            if reset is not None:
+                setattr(budget, f"reset_{kind}", now + reset)
+            budget.updated = now
+        if status_code == 429:
+            budget.rate_limited += 1
+            delay = retry_delay(headers)
+            self.backoff(api_key, 1.0 if delay is None else delay)
+
+    def backoff(self, api_key: str, delay: float) -> None:
+        """Hold every request on the key for `delay` seconds"""
+        budget = self.budget(api_key)
+        delay = min(delay, MAX_BACKOFF)
+        until = monotonic() + delay
+        if until > budget.blocked_until:
+            budget.blocked_until = until
+            log.debug(f"Rate limited on key {self.key_id(api_key)}, backing off for {round(delay, 2)}s")
+
+    def reserve(self, api_key: str, tokens: int) -> None:
+        """Count a request against the reported budget until the next response corrects it"""
+        budget = self._budgets.get(self.key_id(api_key))
+        if budget is None:
+            return
+        if budget.remaining_requests is not None:
+            budget.remaining_requests -= 1
+        if budget.remaining_tokens is not None:
+            budget.remaining_tokens -= tokens
+
+    def delay_for(self, api_key: str, tokens: int = 0) -> float:
+        budget = self._budgets.get(self.key_id(api_key))
+        return budget.delay(tokens) if budget else 0.0
+
+    async def wait(self, api_key: t.Optional[str], tokens: int = 0) -> float:
+        """Wait until the key's budget has room for a request, returning the seconds spent waiting"""
+        if not api_key:
+            return 0.0
+        waited = 0.0
+        while waited < MAX_BACKOFF and (delay := self.delay_for(api_key, tokens)) > 0:
+            # Jitter so everything waiting on the key doesn't fire at the same instant
+            delay = min(delay + random.uniform(0, 0.25), MAX_BACKOFF - waited)
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+    def hook(self, api_key: str) -> t.Callable[[httpx.Response], t.Awaitable[None]]:
+        """httpx response hook that feeds every response made with the key into its budget"""
+
+        async def _observe(response: httpx.Response) -> None:
+            self.observe(api_key, response.headers, response.status_code)
+
+        return _observe
+
+
+rate_limits = RateLimitRegistry()
+
+
+def is_input_too_large(exc: BaseException) -> bool:
+    """The provider rejected the request's input (400/413), a smaller request may succeed"""
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (400, 413)
+    if isinstance(exc, ollama.ResponseError):
+        return getattr(exc, "status_code", None) in (400, 413)
+    return False
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, openai.RateLimitError) and getattr(exc, "code", None) == "insufficient_quota":
+        # Out of credits, retrying won't help
+        return False
+    if is_input_too_large(exc):
+        # Sending the same input again gets the same rejection
+        return False
+    return isinstance(exc, RETRYABLE_ERRORS)
+
+
+class wait_rate_limit(wait_base):
+    """Wait as long as the provider asked to after a 429, falling back to another strategy for other errors"""
+
+    def __init__(self, fallback: wait_base):
+        self.fallback = fallback
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        exc = retry_state.outcome.exception() if retry_state.outcome else None
+        if isinstance(exc, openai.RateLimitError):
+            delay = retry_delay(exc.response.headers)
+            if delay is not None:
+                return min(delay + random.uniform(0, 1), MAX_BACKOFF)
+        return self.fallback(retry_state)
+
+
+def retry_provider(min_wait: float, max_wait: float):
+    """Retry transient provider errors, honoring the provider's rate limit headers on 429s
+
+    The decorated function takes an optional `slot` keyword, a callable returning an async context manager
+    (e.g. a scheduler slot) that is entered around each attempt. The slot is released during the backoff
+    between attempts so a request that keeps failing doesn't hold it while sleeping.
+    """
+
+    def decorator(func: t.Callable[..., t.Awaitable[T]]) -> t.Callable[..., t.Awaitable[T]]:
+        @retry(
+            retry=retry_if_exception(is_retryable),
+            wait=wait_rate_limit(wait_random_exponential(min=min_wait, max=max_wait)),
+            stop=stop_after_attempt(5),
+            reraise=True,
+        )
+        @functools.wraps(func)
+        async def attempt(*args, slot: t.Optional[t.Callable[[], t.AsyncContextManager]] = None, **kwargs) -> T:
+            if slot is None:
+                return await func(*args, **kwargs)
+            async with slot():
+                return await func(*args, **kwargs)
+
+        return attempt
+
+    return decorator
@@ -1,11 +1,14 @@
+import asyncio
 import logging
 import re
+from time import monotonic
 from typing import List, Optional
 
 import discord
 from redbot.core.i18n import Translator
 from redbot.core.utils.chat_formatting import pagify, text_to_file
 
+from .constants import STREAM_EDIT_INTERVAL
 from .models import GuildSettings
 
 log = logging.getLogger("red.vrt.assistant.reply")
@@ -13,6 +16,115 @@ _ = Translator("Assistant", __file__)
 
 CODE_BLOCK = re.compile(r"```(?P<lang>\w+)?\n?(?P<code>.*?)```", re.DOTALL)
 THINK_BLOCK = re.compile(r"<think>(.*?)</think>", re.DOTALL)
+# Also matches a thinking section that is still being streamed
+OPEN_THINK_BLOCK = re.compile(r"<think>(.*?)(</think>|$)", re.DOTALL)
+STREAM_CURSOR = " \N{LEFT HALF BLOCK}"
+
+
+class StreamingReply:
+    """Progressively edit a placeholder reply while a response is being streamed
+
+    Edits are throttled to one every `interval` seconds, each one showing the latest text.
+    Once the full response is ready, `finish` either swaps in the final text or removes the
+    placeholder so the reply can be sent normally (pagination, files, embeds).
+    """
+
+    def __init__(self, message: discord.Message, conf: GuildSettings, interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.conf = conf
+        self.interval = interval
+        self.placeholder: Optional[discord.Message] = None
+        self.text = ""
+        self._shown = ""
+        self._last_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._waiting = False  # Pending edit is still sleeping off the throttle
+        self._failed = False
+
+    async def update(self, text: str):
+        """Called with the full text generated so far"""
+        self.text = text
+        if self._failed or (self._task and not self._task.done()):
+            # The pending edit will pick up the latest text
+            return
+        delay = max(self._last_edit + self.interval - monotonic(), 0)
+        self._task = asyncio.create_task(self._edit(delay))
+
+    @staticmethod
+    def _preview(text: str) -> str:
+        text = OPEN_THINK_BLOCK.sub("", text).strip()
+        if not text:
+            return ""
+        if len(text) > 2000 - len(STREAM_CURSOR):
+            # The rest is shown once the reply is complete
+            text = text[: 1990 - len(STREAM_CURSOR)] + "..."
+        return text + STREAM_CURSOR
+
+    async def _edit(self, delay: float):
+        if delay:
+            self._waiting = True
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._waiting = False
+        preview = self._preview(self.text)
+        if not preview or preview == self._shown:
+            return
+        try:
+            if self.placeholder is None:
+                self.placeholder = await self.message.reply(preview, mention_author=self.conf.mention)
+            else:
+                await self.placeholder.edit(content=preview)
+        except discord.HTTPException as e:
+            log.debug("Failed to update streamed reply, falling back to a normal reply", exc_info=e)
+            self._failed = True
+            return
+        self._shown = preview
+        self._last_edit = monotonic()
+
+    async def _stop(self):
+        if not self._task or self._task.done():
+            return
+        if self._waiting:
+            self._task.cancel()
+        # Let an in-flight request finish so the placeholder is not orphaned
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def finish(self, content: str, files: Optional[List[discord.File]] = None) -> bool:
+        """Show the final reply in the placeholder if it fits
+
+        Returns:
+            bool: True if the reply was delivered, False if it still needs to be sent with `send_reply`
+        """
+        await self._stop()
+        if self.placeholder is None:
+            return False
+        if not files and len(content) <= 2000 and "<think>" not in content:
+            try:
+                await self.placeholder.edit(content=content)
+                return True
+            except discord.HTTPException as e:
+                log.debug("Failed to finalize streamed reply", exc_info=e)
+        await self.discard()
+        return False
+
+    async def discard(self):
+        """Remove the placeholder, used when there is nothing to reply with or before tools run
+
+        The next streamed turn, if any, starts a fresh placeholder.
+        """
+        await self._stop()
+        if self.placeholder is None:
+            return
+        try:
+            await self.placeholder.delete()
+        except discord.HTTPException:
+            pass
+        self.placeholder = None
+        self._shown = ""
 
 
 async def send_reply(
@@ -0,0 +1,465 @@
+import logging
+import typing as t
+import uuid
+from abc import ABC, abstractmethod
+from time import perf_counter
+
+import numpy as np
+
+if t.TYPE_CHECKING:
+    from .models import Embedding, GuildSettings
+
+log = logging.getLogger("red.vrt.assistant.retrieval")
+
+# Guilds with fewer entries than this are searched by brute force when the engine is "auto"
+NUMPY_MAX_ENTRIES = 50_000
+# Same for guilds with a quantized index, scanning compact codes stays fast for much larger collections
+QUANTIZED_MAX_ENTRIES = 500_000
+QUANTIZATION_MODES = ("none", "int8", "binary")
+# Rows scored at once when scanning a quantized index, bounds the temporary arrays
+BLOCK_ROWS = 4096
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Name, text, score, dimensions
+Match = t.Tuple[str, str, float, int]
+
+
+class EngineUnavailable(Exception):
+    """Raised by an engine that can't serve a query, the caller falls back to brute force"""
+
+
+class RetrievalEngine(ABC):
+    """Finds the embeddings most related to a query for a guild
+
+    `sync` is called after a guild's embeddings change (see `GuildSettings.sync_embeddings`),
+    `forget` when the guild switches to another engine or its data is deleted.
+    """
+
+    name: str
+
+    def sync(self, conf: "GuildSettings", guild_id: int, **kwargs) -> None:
+        self.forget(guild_id)
+
+    def forget(self, guild_id: int) -> None:
+        pass
+
+    @abstractmethod
+    def search(
+        self,
+        conf: "GuildSettings",
+        guild_id: int,
+        query_embedding: t.Sequence[float],
+        top_n: int,
+        min_relatedness: float,
+    ) -> t.List[Match]:
+        raise NotImplementedError
+
+
+class NumpyIndex:
+    """Brute force cosine search over a contiguous matrix of normalized float32 vectors"""
+
+    def __init__(self, names: t.List[str], matrix: np.ndarray):
+        self.names = names
+        self.matrix = matrix
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    @classmethod
+    def build(cls, vectors: t.Mapping[str, t.Sequence[float]], dimension: int) -> "NumpyIndex":
+        """Index the vectors of the given dimension, others are left out"""
+        names = [name for name, vector in vectors.items() if len(vector) == dimension]
+        matrix = np.empty((len(names), dimension), dtype=np.float32)
+        for row, name in enumerate(names):
+            matrix[row] = vectors[name]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return cls(names, matrix)
+
+    def search(self, query: t.Sequence[float], top_n: int, min_score: float = -1.0) -> t.List[t.Tuple[str, float]]:
+        """Names and cosine similarities of the `top_n` closest vectors scoring at least `min_score`"""
+        if not len(self.names) or top_n < 1:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self.matrix @ query
+        if top_n < len(scores):
+            rows = np.argpartition(scores, -top_n)[-top_n:]
+        else:
+            rows = np.arange(len(scores))
+        rows = rows[np.argsort(scores[rows])[::-1]]
+        return [(self.names[row], float(scores[row])) for row in rows if scores[row] >= min_score]
+
+
+def _popcount(codes: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return _POPCOUNT[codes]
+
+
+class QuantizedIndex:
+    """Coarse search over int8 or binary codes, with exact float rescoring of the best candidates
+
+    - int8: one byte per dimension plus a scale per row, 4x smaller than float32
+    - binary: one sign bit per dimension, 32x smaller, compared by hamming distance
+
+    The index only holds the codes. Candidates are rescored against the original float vectors
+    (looked up by name), so the returned similarities are exact and `min_score` filtering is unaffected.
+    """
+
+    def __init__(self, names: t.List[str], codes: np.ndarray, scales: t.Optional[np.ndarray], mode: str):
+        self.names = names
+        self.codes = codes
+        self.scales = scales
+        self.mode = mode
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def build(cls, vectors: t.Mapping[str, t.Sequence[float]], dimension: int, mode: str) -> "QuantizedIndex":
+        """Quantize the vectors of the given dimension block by block, others are left out"""
+        names = [name for name, vector in vectors.items() if len(vector) == dimension]
+        if mode == "binary":
+            codes = np.empty((len(names), (dimension + 7) // 8), dtype=np.uint8)
+            scales = None
+        else:
+            codes = np.empty((len(names), dimension), dtype=np.int8)
+            scales = np.empty(len(names), dtype=np.float32)
+        for start in range(0, len(names), BLOCK_ROWS):
+            chunk = names[start : start + BLOCK_ROWS]
+            block = np.stack([np.asarray(vectors[name], dtype=np.float32) for name in chunk])
+            end = start + len(chunk)
+            if mode == "binary":
+                codes[start:end] = np.packbits(block > 0, axis=1)
+                continue
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            np.divide(block, norms, out=block, where=norms > 0)
+            peak = np.abs(block).max(axis=1)
+            peak[peak == 0] = 1.0
+            scales[start:end] = peak / 127
+            codes[start:end] = np.rint(block / scales[start:end, None]).astype(np.int8)
+        return cls(names, codes, scales, mode)
+
+    def coarse_scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate similarity of every row to a normalized query, higher is closer"""
+        if self.mode == "binary":
+            bits = np.packbits(query > 0)
+            scores = np.empty(len(self.names), dtype=np.int32)
+            for start in range(0, len(self.names), BLOCK_ROWS):
+                block = np.bitwise_xor(self.codes[start : start + BLOCK_ROWS], bits)
+                scores[start : start + len(block)] = -_popcount(block).sum(axis=1, dtype=np.int32)
+            return scores
+        scores = np.empty(len(self.names), dtype=np.float32)
+        for start in range(0, len(self.names), BLOCK_ROWS):
+            block = self.codes[start : start + BLOCK_ROWS]
+            scores[start : start + len(block)] = block.astype(np.float32) @ query
+        return scores * self.scales
+
+    def search(
+        self,
+        query: t.Sequence[float],
+        top_n: int,
+        lookup: t.Callable[[str], t.Optional[t.Sequence[float]]],
+        min_score: float = -1.0,
+        oversample: int = 10,
+    ) -> t.List[t.Tuple[str, float]]:
+        """Names and exact cosine similarities of the `top_n` closest vectors scoring at least `min_score`
+
+        Args:
+            query (Sequence[float]): query embedding
+            top_n (int): results to return
+            lookup (Callable): returns the full precision vector for a name, None if it's gone
+            min_score (float): minimum exact similarity
+            oversample (int): `top_n * oversample` coarse candidates are rescored
+        """
+        if not len(self.names) or top_n < 1:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self.coarse_scores(query)
+        count = min(len(scores), top_n * max(oversample, 1))
+        if count < len(scores):
+            rows = np.argpartition(scores, -count)[-count:]
+        else:
+            rows = np.arange(len(scores))
+
+        names, candidates = [], []
+        for row in rows:
+            name = self.names[row]
+            vector = lookup(name)
+            if vector is None or len(vector) != len(query):
+                continue
+            names.append(name)
+            candidates.append(vector)
+        if not candidates:
+            return []
+        matrix = np.asarray(candidates, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        exact = np.divide(matrix @ query, norms, out=np.zeros(len(names), dtype=np.float32), where=norms > 0)
+        order = np.argsort(exact)[::-1][:top_n]
+        return [(names[idx], float(exact[idx])) for idx in order if exact[idx] >= min_score]
+
+
+class NumpyEngine(RetrievalEngine):
+    """Brute force search, the index is rebuilt in memory on the first query after the embeddings change
+
+    A single matrix-vector product beats an HNSW index for collections up to tens of thousands of entries
+    and there is nothing on disk to keep in sync.
+    """
+
+    name = "numpy"
+
+    def __init__(self):
+        # {guild_id: ((id of the embeddings dict, entries, dimension, quantization), index)}
+        self._indexes: t.Dict[int, t.Tuple[tuple, t.Union[NumpyIndex, QuantizedIndex]]] = {}
+
+    def forget(self, guild_id: int) -> None:
+        self._indexes.pop(guild_id, None)
+
+    def cached_index(self, guild_id: int) -> t.Optional[t.Union[NumpyIndex, QuantizedIndex]]:
+        cached = self._indexes.get(guild_id)
+        return cached[1] if cached else None
+
+    def index(
+        self,
+        guild_id: int,
+        embeddings: t.Dict[str, "Embedding"],
+        dimension: int,
+        quantization: str = "none",
+    ) -> t.Union[NumpyIndex, QuantizedIndex]:
+        # Edits are picked up through `sync`, this catches the dict being replaced or resized without one
+        fingerprint = (id(embeddings), len(embeddings), dimension, quantization)
+        cached = self._indexes.get(guild_id)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        start = perf_counter()
+        vectors = {name: em.embedding for name, em in embeddings.items()}
+        if quantization in ("int8", "binary"):
+            index = QuantizedIndex.build(vectors, dimension, quantization)
+        else:
+            index = NumpyIndex.build(vectors, dimension)
+        skipped = len(embeddings) - len(index)
+        if skipped:
+            log.info(f"Skipping {skipped} embeddings that don't match query dimension {dimension} for guild {guild_id}")
+        log.debug(
+            f"Built {quantization} NumPy index of {len(index)} embeddings for guild {guild_id} "
+            f"in {perf_counter() - start:.3f}s "
+            f"({index.nbytes / 1024 / 1024:.1f} MiB)"
+        )
+        self._indexes[guild_id] = (fingerprint, index)
+        return index
+
+    def search(
+        self,
+        conf: "GuildSettings",
+        guild_id: int,
+        query_embedding: t.Sequence[float],
+        top_n: int,
+        min_relatedness: float,
+    ) -> t.List[Match]:
+        embeddings = conf.embeddings
+        index = self.index(guild_id, embeddings, len(query_embedding), conf.retrieval_quantization)
+        if isinstance(index, QuantizedIndex):
+
+            def lookup(name: str) -> t.Optional[t.Sequence[float]]:
+                embedding = embeddings.get(name)
+                return embedding.embedding if embedding is not None else None
+
+            found = index.search(query_embedding, top_n, lookup, min_relatedness, conf.retrieval_oversample)
+        else:
+            found = index.search(query_embedding, top_n, min_relatedness)
+        matches = []
+        for name, score in found:
+            embedding = embeddings.get(name)
+            if embedding is None:
+                # Deleted since the index was built
+                continue
+            matches.append((name, embedding.text, score, len(embedding.embedding)))
+        return matches
+
+
+ENGINES: t.Dict[str, RetrievalEngine] = {}
+
+
+def register_engine(engine: RetrievalEngine) -> None:
+    ENGINES[engine.name] = engine
+
+
+def select_engine(name: str, entries: int, quantized: bool = False) -> RetrievalEngine:
+    """Resolve a guild's configured engine, "auto" picks brute force for small (or quantized) collections"""
+    if name in ENGINES:
+        return ENGINES[name]
+    if entries < (QUANTIZED_MAX_ENTRIES if quantized else NUMPY_MAX_ENTRIES) or "chroma" not in ENGINES:
+        return ENGINES["numpy"]
+    return ENGINES["chroma"]
+
+
+def forget_guild(guild_id: int) -> None:
+    for engine in ENGINES.values():
+        engine.forget(guild_id)
+
+
+register_engine(NumpyEngine())
+
+
+def _percentile(samples: t.List[float], pct: float) -> float:
+    return float(np.percentile(samples, pct) * 1000) if samples else 0.0
+
+
+def _timings(samples: t.List[float]) -> t.Dict[str, float]:
+    return {
+        "avg_ms": sum(samples) / len(samples) * 1000 if samples else 0.0,
+        "p50_ms": _percentile(samples, 50),
+        "p95_ms": _percentile(samples, 95),
+    }
+
+
+def _synthetic(entries: int, dimensions: int, queries: int, seed: int) -> t.Tuple[np.ndarray, np.ndarray]:
+    """Random vectors, and queries that are perturbed copies of them so there are real neighbors to find"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((entries, dimensions), dtype=np.float32)
+    picks = rng.integers(0, entries, size=queries)
+    query_vectors = vectors[picks] + rng.standard_normal((queries, dimensions), dtype=np.float32) * 0.5
+    return vectors, query_vectors
+
+
+def benchmark(
+    entries: int = 10_000,
+    dimensions: int = 1536,
+    queries: int = 50,
+    top_n: int = 3,
+    seed: int = 0,
+) -> t.Dict[str, t.Dict[str, float]]:
+    """Compare brute force NumPy search with a Chroma HNSW collection on random vectors
+
+    Recall is measured against the exact NumPy results. Blocking, run it in a thread.
+
+    Returns:
+        {engine: {"build_ms", "avg_ms", "p50_ms", "p95_ms", "recall"}}
+    """
+    import chromadb
+
+    vectors, query_vectors = _synthetic(entries, dimensions, queries, seed)
+    names = [str(i) for i in range(entries)]
+
+    results: t.Dict[str, t.Dict[str, float]] = {}
+
+    start = perf_counter()
+    index = NumpyIndex.build(dict(zip(names, vectors)), dimensions)
+    build = perf_counter() - start
+    exact: t.List[t.Set[str]] = []
+    timings = []
+    for query in query_vectors:
+        start = perf_counter()
+        found = index.search(query, top_n)
+        timings.append(perf_counter() - start)
+        exact.append({name for name, _score in found})
+    results["numpy"] = {"build_ms": build * 1000, **_timings(timings), "recall": 1.0}
+
+    client = chromadb.EphemeralClient()
+    collection_name = f"assistant-bench-{uuid.uuid4().hex[:8]}"
+    try:
+        start = perf_counter()
+        collection = client.create_collection(collection_name, configuration={"hnsw": {"space": "cosine"}})
+        batch_size = getattr(client, "get_max_batch_size", lambda: 5000)()
+        for idx in range(0, entries, batch_size):
+            collection.add(ids=names[idx : idx + batch_size], embeddings=vectors[idx : idx + batch_size])
+        build = perf_counter() - start
+        timings = []
+        hits = 0
+        for query, expected in zip(query_vectors, exact):
+            start = perf_counter()
+            found = collection.query(query_embeddings=[query], n_results=top_n, include=["distances"])
+            timings.append(perf_counter() - start)
+            hits += len(expected.intersection(found["ids"][0]))
+        results["chroma"] = {
+            "build_ms": build * 1000,
+            **_timings(timings),
+            "recall": hits / max(sum(len(i) for i in exact), 1),
+        }
+    finally:
+        try:
+            client.delete_collection(collection_name)
+        except Exception:  # noqa: BLE001
+            pass
+    return results
+
+
+def benchmark_quantization(
+    entries: int = 100_000,
+    dimensions: int = 1536,
+    queries: int = 50,
+    top_n: int = 3,
+    oversample: t.Sequence[int] = (1, 2, 5, 10, 20),
+    seed: int = 0,
+) -> t.List[t.Dict[str, t.Any]]:
+    """Recall vs latency of the quantized indexes at different oversampling levels
+
+    Recall is measured against the exact float32 results. Blocking, run it in a thread.
+
+    Returns:
+        [{"mode", "oversample", "index_mib", "build_ms", "avg_ms", "p50_ms", "p95_ms", "recall"}]
+    """
+    vectors, query_vectors = _synthetic(entries, dimensions, queries, seed)
+    names = [str(i) for i in range(entries)]
+    by_name = dict(zip(names, vectors))
+    results = []
+
+    start = perf_counter()
+    exact_index = NumpyIndex.build(by_name, dimensions)
+    build = perf_counter() - start
+    exact: t.List[t.Set[str]] = []
+    timings = []
+    for query in query_vectors:
+        start = perf_counter()
+        found = exact_index.search(query, top_n)
+        timings.append(perf_counter() - start)
+        exact.append({name for name, _score in found})
+    results.append(
+        {
+            "mode": "float32",
+            "oversample": 1,
+            "index_mib": exact_index.nbytes / 1024 / 1024,
+            "build_ms": build * 1000,
+            **_timings(timings),
+            "recall": 1.0,
+        }
+    )
+    del exact_index
+
+    for mode in ("int8", "binary"):
+        start = perf_counter()
+        index = QuantizedIndex.build(by_name, dimensions, mode)
+        build = perf_counter() - start
+        for factor in oversample:
+            timings = []
+            hits = 0
+            for query, expected in zip(query_vectors, exact):
+                start = perf_counter()
+                found = index.search(query, top_n, by_name.get, oversample=factor)
+                timings.append(perf_counter() - start)
+                hits += len(expected.intersection(name for name, _score in found))
+            results.append(
+                {
+                    "mode": mode,
+                    "oversample": factor,
+                    "index_mib": index.nbytes / 1024 / 1024,
+                    "build_ms": build * 1000,
+                    **_timings(timings),
+                    "recall": hits / max(sum(len(i) for i in exact), 1),
+                }
+            )
+    return results
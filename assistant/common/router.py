@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import typing as t
+from dataclasses import dataclass
+
+import numpy as np
+
+from .utils import is_core_tool
+
+log = logging.getLogger("red.vrt.assistant.router")
+
+# Functions that are sent every turn no matter how relevant they look
+ALWAYS_ON = {"do_not_respond"}
+# Cached schema embeddings are dropped once this many accumulate (e.g. after switching embed models)
+VECTOR_CACHE_SIZE = 4096
+
+
+def _normalize(vector: t.Sequence[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+def always_on(name: str) -> bool:
+    return name in ALWAYS_ON or is_core_tool(name)
+
+
+def schema_text(schema: dict) -> str:
+    """The text a function schema is embedded by: its name, description and argument descriptions"""
+    parts = [f"{schema.get('name', '')}: {schema.get('description', '')}"]
+    properties = schema.get("parameters", {}).get("properties", {})
+    if isinstance(properties, dict):
+        for name, prop in properties.items():
+            description = prop.get("description", "") if isinstance(prop, dict) else ""
+            parts.append(f"{name}: {description}" if description else name)
+    return "\n".join(parts)
+
+
+@dataclass
+class RouterStats:
+    turns: int = 0  # Turns where functions were dropped
+    dropped: int = 0  # Functions left out across all turns
+    tokens_saved: int = 0
+    last_saved: int = 0
+
+    @property
+    def avg_saved(self) -> float:
+        return self.tokens_saved / self.turns if self.turns else 0.0
+
+
+class ToolRouter:
+    """Send only the function schemas relevant to the current query
+
+    Each schema is embedded once per embed model and kept in memory (a schema that changes gets a new
+    embedding since the text is part of the key). Per turn, the `top_k` schemas most similar to the query
+    embedding are kept along with the always-on core tools, the rest are left out of the request.
+    """
+
+    def __init__(self):
+        # {"model|text digest": normalized embedding}
+        self._vectors: t.Dict[str, np.ndarray] = {}
+        self.stats: t.Dict[int, RouterStats] = {}
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    @staticmethod
+    def _key(model_key: str, text: str) -> str:
+        return f"{model_key}|{hashlib.blake2b(text.encode(), digest_size=16).hexdigest()}"
+
+    async def select(
+        self,
+        functions: t.List[dict],
+        query_embedding: t.Sequence[float],
+        top_k: int,
+        model_key: str,
+        embed: t.Callable[[t.List[str]], t.Awaitable[t.List[t.List[float]]]],
+    ) -> t.List[dict]:
+        """Pick the functions to send for a query
+
+        Args:
+            functions (List[dict]): every function schema available this turn
+            query_embedding (Sequence[float]): embedding of the user's message
+            top_k (int): how many functions to keep on top of the always-on ones
+            model_key (str): identifies the embed model, schema embeddings are only compared within one model
+            embed (Callable): embeds a batch of strings with the same model as the query
+
+        Returns:
+            List[dict]: the selected schemas, in their original order
+        """
+        candidates = [i for i in functions if not always_on(i.get("name", ""))]
+        if len(candidates) <= top_k or not len(query_embedding):
+            return functions
+
+        texts = [schema_text(i) for i in candidates]
+        keys = [self._key(model_key, text) for text in texts]
+        missing = [idx for idx, key in enumerate(keys) if key not in self._vectors]
+        if missing:
+            if len(self._vectors) + len(missing) > VECTOR_CACHE_SIZE:
+                self._vectors.clear()
+            vectors = await embed([texts[idx] for idx in missing])
+            for idx, vector in zip(missing, vectors):
+                if len(vector):
+                    self._vectors[keys[idx]] = _normalize(vector)
+            log.debug(f"Embedded {len(missing)} function schemas for routing")
+
+        query = _normalize(query_embedding)
+        # Anything that couldn't be embedded is kept rather than silently dropped
+        keep = {id(candidates[idx]) for idx, key in enumerate(keys) if key not in self._vectors}
+        rows = [idx for idx, key in enumerate(keys) if key in self._vectors]
+        if rows:
+            matrix = np.stack([self._vectors[keys[idx]] for idx in rows])
+            if matrix.shape[1] != query.shape[0]:
+                log.warning("Query and function embeddings differ in size, sending every function")
+                return functions
+            scores = matrix @ query
+            for pos in np.argsort(-scores)[:top_k]:
+                keep.add(id(candidates[rows[int(pos)]]))
+        return [i for i in functions if always_on(i.get("name", "")) or id(i) in keep]
+
+    def record(self, guild_id: int, dropped: int, tokens_saved: int) -> None:
+        stats = self.stats.setdefault(guild_id, RouterStats())
+        stats.turns += 1
+        stats.dropped += dropped
+        stats.tokens_saved += tokens_saved
+        stats.last_saved = tokens_saved
+
+    def clear(self) -> None:
+        self._vectors.clear()
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import typing as t
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from time import monotonic
+
+from .ratelimit import rate_limits
+
+log = logging.getLogger("red.vrt.assistant.scheduler")
+
+
+class QueueFull(Exception):
+    """Raised when a guild already has too many requests waiting"""
+
+
+class TokenBucket:
+    """Rate limit that refills `limit` units per minute, a limit of 0 disables it"""
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.available = float(limit)
+        self.updated = monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        if self.limit > 0:
+            self.available = min(float(self.limit), self.available + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    def set_limit(self, limit: int) -> None:
+        self._refill()
+        if limit > 0 and self.limit <= 0:
+            # Enabling a limit starts with a full bucket
+            self.available = float(limit)
+        self.limit = limit
+        self.available = min(self.available, float(max(limit, 0)))
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available"""
+        if self.limit <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.limit)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60 / self.limit
+
+    async def acquire(self, amount: float) -> float:
+        """Wait until `amount` units are available and take them, returning the seconds spent waiting"""
+        waited = 0.0
+        # The lock keeps waiters in order so a large request isn't starved by a stream of small ones
+        async with self._lock:
+            while (delay := self.wait_time(amount)) > 0:
+                await asyncio.sleep(delay)
+                waited += delay
+            if self.limit > 0:
+                self.available -= min(amount, self.limit)
+        return waited
+
+    def adjust(self, amount: float) -> None:
+        """Take (or give back) units once the real usage of an estimated request is known"""
+        if self.limit <= 0:
+            return
+        self._refill()
+        self.available = min(float(self.limit), self.available - amount)
+
+
+class KeyLimiter:
+    """Requests per minute and tokens per minute budget for a single API key"""
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def set_limits(self, rpm: int, tpm: int) -> None:
+        self.requests.set_limit(rpm)
+        self.tokens.set_limit(tpm)
+
+    async def acquire(self, tokens: int) -> float:
+        waited = await self.requests.acquire(1)
+        waited += await self.tokens.acquire(tokens)
+        return waited
+
+
+@dataclass
+class QueueStats:
+    waiting: int = 0  # Requests currently waiting on a rate limit or a free slot
+    peak: int = 0
+    admitted: int = 0
+    rejected: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.admitted if self.admitted else 0.0
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    cost: float
+
+
+@dataclass
+class _GuildQueue:
+    """Per-guild waiters, served round-robin between users"""
+
+    guild_id: int
+    users: t.Dict[int, t.Deque[_Waiter]] = field(default_factory=OrderedDict)
+    # Virtual time of the guild's next request, lower goes first
+    virtual: float = 0.0
+    stats: QueueStats = field(default_factory=QueueStats)
+
+    def __bool__(self) -> bool:
+        return bool(self.users)
+
+    def push(self, user_id: int, waiter: _Waiter) -> None:
+        self.users.setdefault(user_id, deque()).append(waiter)
+
+    def pop(self) -> _Waiter:
+        user_id, waiters = next(iter(self.users.items()))
+        waiter = waiters.popleft()
+        if waiters:
+            # Next time around another user in this guild goes first
+            self.users.move_to_end(user_id)
+        else:
+            del self.users[user_id]
+        return waiter
+
+    def remove(self, user_id: int, waiter: _Waiter) -> None:
+        waiters = self.users.get(user_id)
+        if not waiters or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del self.users[user_id]
+
+
+class RequestScheduler:
+    """Admission control for LLM and embedding requests
+
+    - At most `max_concurrent` requests are in flight across all guilds
+    - Waiting requests are served by weighted fair queuing between guilds (round-robin between the users of a guild),
+      so a busy guild only ever gets its share of the slots instead of starving everyone else
+    - Each API key has a requests/tokens per minute token bucket, requests wait for budget instead of hitting a 429
+    - Requests also wait while the provider's reported budget for the key (see `ratelimit`) is exhausted
+    - A guild with `max_queued` requests already waiting has new ones rejected with `QueueFull`
+    """
+
+    def __init__(self, max_concurrent: int = 8, max_queued: int = 50, rpm: int = 0, tpm: int = 0):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.rpm = rpm
+        self.tpm = tpm
+        self.weights: t.Dict[int, float] = {}
+        self.in_flight = 0
+        self.rate_limited = 0  # Requests that had to wait for rate limit budget
+        self.rate_limit_wait = 0.0
+        self._queues: t.Dict[int, _GuildQueue] = {}
+        self._limiters: t.Dict[str, KeyLimiter] = {}
+        # Virtual time of the last admitted request
+        self._clock = 0.0
+
+    def configure(
+        self,
+        max_concurrent: int,
+        max_queued: int,
+        rpm: int,
+        tpm: int,
+        weights: t.Optional[t.Dict[int, float]] = None,
+    ) -> None:
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_queued = max_queued
+        self.rpm = rpm
+        self.tpm = tpm
+        self.weights = dict(weights or {})
+        for limiter in self._limiters.values():
+            limiter.set_limits(rpm, tpm)
+        # A higher cap may let waiting requests through
+        self._dispatch()
+
+    @property
+    def queued(self) -> int:
+        return sum(queue.stats.waiting for queue in self._queues.values())
+
+    def queue_stats(self) -> t.Dict[int, QueueStats]:
+        return {guild_id: queue.stats for guild_id, queue in self._queues.items()}
+
+    def limiter(self, api_key: str) -> KeyLimiter:
+        key = rate_limits.key_id(api_key)
+        if key not in self._limiters:
+            self._limiters[key] = KeyLimiter(self.rpm, self.tpm)
+        return self._limiters[key]
+
+    def reconcile(self, api_key: t.Optional[str], estimated: int, actual: int) -> None:
+        """Correct the token budget once a request reports how many tokens it really used"""
+        if api_key and self.tpm and actual:
+            self.limiter(api_key).tokens.adjust(actual - estimated)
+
+    def _dispatch(self) -> None:
+        while self.in_flight < self.max_concurrent:
+            active = [queue for queue in self._queues.values() if queue]
+            if not active:
+                return
+            queue = min(active, key=lambda q: q.virtual)
+            waiter = queue.pop()
+            if waiter.future.done():
+                # Cancelled while waiting
+                continue
+            self._clock = queue.virtual
+            queue.virtual += waiter.cost / self.weights.get(queue.guild_id, 1.0)
+            self.in_flight += 1
+            waiter.future.set_result(None)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, guild_id: int, user_id: int = 0, api_key: t.Optional[str] = None, tokens: int = 1):
+        """Wait for rate limit budget and a fair turn, then hold one of the global request slots
+
+        Args:
+            guild_id (int): guild the request is made for, fairness is between guilds
+            user_id (int): user the request is made for, fairness within a guild is between users
+            api_key (Optional[str]): key the request is billed to, for rate limiting
+            tokens (int): estimated tokens the request will use
+
+        Raises:
+            QueueFull: the guild already has `max_queued` requests waiting
+        """
+        queue = self._queues.get(guild_id)
+        if queue is None:
+            queue = self._queues[guild_id] = _GuildQueue(guild_id)
+        stats = queue.stats
+        if self.max_queued and stats.waiting >= self.max_queued:
+            stats.rejected += 1
+            raise QueueFull(f"Guild {guild_id} has {stats.waiting} requests queued")
+
+        start = monotonic()
+        stats.waiting += 1
+        stats.peak = max(stats.peak, stats.waiting)
+        try:
+            if api_key:
+                waited = 0.0
+                if self.rpm or self.tpm:
+                    waited += await self.limiter(api_key).acquire(tokens)
+                # Hold off before the provider's reported budget runs out, rather than after a 429
+                waited += await rate_limits.wait(api_key, tokens)
+                if waited:
+                    self.rate_limited += 1
+                    self.rate_limit_wait += waited
+                    log.debug(f"Request for guild {guild_id} waited {round(waited, 2)}s on the rate limit")
+
+            if not queue:
+                # An idle guild doesn't get to bank the time it spent idle
+                queue.virtual = max(queue.virtual, self._clock)
+            waiter = _Waiter(asyncio.get_running_loop().create_future(), cost=max(tokens, 1))
+            queue.push(user_id, waiter)
+            self._dispatch()
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.cancelled():
+                    queue.remove(user_id, waiter)
+                else:
+                    # Admitted right as we were cancelled
+                    self._release()
+                raise
+        finally:
+            stats.waiting -= 1
+
+        if api_key:
+            rate_limits.reserve(api_key, tokens)
+        waited = monotonic() - start
+        stats.admitted += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+        try:
+            yield
+        finally:
+            self._release()
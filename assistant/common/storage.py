@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import typing as t
+from dataclasses import dataclass, field
+
+import orjson
+from redbot.core import Config
+
+from .models import DB, Conversation, Embedding, GuildSettings
+
+log = logging.getLogger("red.vrt.assistant.storage")
+
+GUILD_SHARD = "assistant_guild"
+EMBEDDINGS_SHARD = "assistant_embeddings"
+CONVERSATION_SHARD = "assistant_conversation"
+
+# DB fields that live in their own shards instead of the global blob
+SHARDED_FIELDS = {"configs", "conversations"}
+
+
+def _embedding_key(em: Embedding) -> tuple:
+    """Cheap fingerprint used to tell if an embedding entry needs to be re-serialized"""
+    return (
+        em.modified.timestamp(),
+        em.model,
+        em.ai_created,
+        len(em.text),
+        len(em.embedding),
+        em.embedding[:8].tobytes(),
+    )
+
+
+def _conversation_key(conversation: Conversation) -> tuple:
+    return (
+        conversation.last_updated,
+        len(conversation.messages),
+        conversation.system_prompt_override,
+    )
+
+
+@dataclass
+class SaveStats:
+    shards: int = 0  # Number of shards written (or cleared)
+    size: int = 0  # Approximate serialized size of the written shards in bytes
+    full: bool = False
+
+
+@dataclass
+class SaveMetrics:
+    """Running totals for config saves"""
+
+    requests: int = 0  # Save requests, including the ones coalesced into another write
+    saves: int = 0  # Writes actually performed
+    failures: int = 0
+    total_time: float = 0.0
+    last_time: float = 0.0
+    max_time: float = 0.0
+    last_size: int = 0
+    last_shards: int = 0
+    total_size: int = 0
+
+    def record(self, elapsed: float, stats: SaveStats) -> None:
+        self.saves += 1
+        self.total_time += elapsed
+        self.last_time = elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.last_size = stats.size
+        self.last_shards = stats.shards
+        self.total_size += stats.size
+
+    @property
+    def avg_time(self) -> float:
+        return self.total_time / self.saves if self.saves else 0.0
+
+    @property
+    def coalesced(self) -> int:
+        return max(self.requests - self.saves - self.failures, 0)
+
+
+@dataclass
+class _Pending:
+    """Shard writes computed off the event loop, applied to Config afterwards"""
+
+    globals: t.Optional[dict] = None
+    guilds: t.Dict[int, dict] = field(default_factory=dict)
+    embeddings: t.Dict[int, dict] = field(default_factory=dict)
+    conversations: t.Dict[str, dict] = field(default_factory=dict)
+    removed_guilds: t.Set[int] = field(default_factory=set)
+    removed_conversations: t.Set[str] = field(default_factory=set)
+
+
+class ShardedStorage:
+    """Persist the DB as separate Config shards so a save only rewrites what changed
+
+    - Global settings stay under the `db` key
+    - Each guild's settings (minus embeddings) are stored under `assistant_guild/<guild_id>`
+    - Each guild's embeddings are stored under `assistant_embeddings/<guild_id>`
+    - Each conversation is stored under `assistant_conversation/<member-channel-guild>`
+
+    Shards are marked dirty by comparing cheap fingerprints against what was last written,
+    so state mutated anywhere in the cog is picked up without having to flag it manually.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.config.init_custom(GUILD_SHARD, 1)
+        self.config.init_custom(EMBEDDINGS_SHARD, 1)
+        self.config.init_custom(CONVERSATION_SHARD, 1)
+        self.config.register_custom(GUILD_SHARD, settings={})
+        self.config.register_custom(EMBEDDINGS_SHARD, entries={})
+        self.config.register_custom(CONVERSATION_SHARD, data={})
+
+        # Snapshot of what was last written for each shard
+        self._globals: t.Optional[dict] = None
+        self._guilds: t.Dict[int, dict] = {}
+        # {guild_id: GuildSettings.embeddings_version()}, a changed version marks the embeddings shard dirty
+        self._embedding_versions: t.Dict[int, tuple] = {}
+        # {guild_id: {entry_name: (fingerprint, dump)}}
+        self._embedding_dumps: t.Dict[int, t.Dict[str, t.Tuple[tuple, dict]]] = {}
+        self._conversations: t.Dict[str, tuple] = {}
+        # Set when the shards have never been written (fresh install or legacy monolithic config)
+        self._full_write = False
+        self._lock = asyncio.Lock()
+
+    async def load(self) -> dict:
+        """Assemble the raw DB dict from the stored shards, migrating a legacy single-blob config if needed"""
+        data: dict = await self.config.db()
+        if not await self.config.sharded():
+            # Legacy config stores everything under the db key, write it out as shards on the next save
+            self._full_write = True
+            return data
+
+        configs = {}
+        guilds = await self.config.custom(GUILD_SHARD).all()
+        embeddings = await self.config.custom(EMBEDDINGS_SHARD).all()
+        for guild_id, shard in guilds.items():
+            settings = dict(shard.get("settings", {}))
+            settings["embeddings"] = embeddings.get(guild_id, {}).get("entries", {})
+            configs[int(guild_id)] = settings
+
+        conversations = {}
+        for key, shard in (await self.config.custom(CONVERSATION_SHARD).all()).items():
+            conversations[key] = shard.get("data", {})
+
+        return {**data, "configs": configs, "conversations": conversations}
+
+    def loaded(self, db: DB) -> None:
+        """Record the freshly loaded DB as the written baseline so the first save only writes real changes"""
+        if self._full_write:
+            return
+        self._collect(db)
+
+    def _collect(self, db: DB) -> _Pending:
+        """Diff the DB against the last written snapshot and serialize only the dirty shards
+
+        Runs in a thread, updates the snapshot as if the pending writes succeeded.
+        """
+        pending = _Pending()
+        full = self._full_write
+
+        global_dump = db.model_dump(exclude=SHARDED_FIELDS)
+        if full or global_dump != self._globals:
+            pending.globals = self._globals = global_dump
+
+        for guild_id, conf in db.configs.items():
+            settings = conf.model_dump(exclude={"embeddings"})
+            if full or settings != self._guilds.get(guild_id):
+                pending.guilds[guild_id] = self._guilds[guild_id] = settings
+
+            # Comparing the version is O(1), hashing every guild's embeddings on each save isn't
+            embeddings_version = conf.embeddings_version()
+            if full or embeddings_version != self._embedding_versions.get(guild_id):
+                pending.embeddings[guild_id] = self._dump_embeddings(guild_id, conf)
+                self._embedding_versions[guild_id] = embeddings_version
+
+        for guild_id in set(self._guilds) - set(db.configs):
+            pending.removed_guilds.add(guild_id)
+            self._guilds.pop(guild_id, None)
+            self._embedding_versions.pop(guild_id, None)
+            self._embedding_dumps.pop(guild_id, None)
+
+        for key, conversation in db.conversations.items():
+            fingerprint = _conversation_key(conversation)
+            if full or fingerprint != self._conversations.get(key):
+                pending.conversations[key] = conversation.model_dump()
+                self._conversations[key] = fingerprint
+
+        for key in set(self._conversations) - set(db.conversations):
+            pending.removed_conversations.add(key)
+            del self._conversations[key]
+
+        return pending
+
+    def _dump_embeddings(self, guild_id: int, conf: GuildSettings) -> dict:
+        """Serialize a guild's embeddings, reusing the dumps of entries that did not change"""
+        previous = self._embedding_dumps.get(guild_id, {})
+        current = {}
+        for name, em in conf.embeddings.items():
+            fingerprint = _embedding_key(em)
+            cached = previous.get(name)
+            if cached is None or cached[0] != fingerprint:
+                cached = (fingerprint, em.model_dump())
+            current[name] = cached
+        self._embedding_dumps[guild_id] = current
+        return {name: dump for name, (_, dump) in current.items()}
+
+    async def save(self, db: DB) -> SaveStats:
+        """Write every shard that changed since the last save"""
+        async with self._lock:
+            full = self._full_write
+            pending = await asyncio.to_thread(self._collect, db)
+            stats = SaveStats(full=full)
+
+            def _size(obj: dict) -> int:
+                return len(orjson.dumps(obj))
+
+            async def _write_globals():
+                await self.config.db.set(pending.globals)
+                stats.shards += 1
+                stats.size += _size(pending.globals)
+
+            try:
+                if pending.globals is not None and not full:
+                    await _write_globals()
+                for guild_id, settings in pending.guilds.items():
+                    await self.config.custom(GUILD_SHARD, str(guild_id)).settings.set(settings)
+                    stats.shards += 1
+                    stats.size += _size(settings)
+                for guild_id, entries in pending.embeddings.items():
+                    await self.config.custom(EMBEDDINGS_SHARD, str(guild_id)).entries.set(entries)
+                    stats.shards += 1
+                    stats.size += await asyncio.to_thread(_size, entries)
+                for key, data in pending.conversations.items():
+                    await self.config.custom(CONVERSATION_SHARD, key).data.set(data)
+                    stats.shards += 1
+                    stats.size += _size(data)
+                for guild_id in pending.removed_guilds:
+                    await self.config.custom(GUILD_SHARD, str(guild_id)).clear()
+                    await self.config.custom(EMBEDDINGS_SHARD, str(guild_id)).clear()
+                    stats.shards += 2
+                for key in pending.removed_conversations:
+                    await self.config.custom(CONVERSATION_SHARD, key).clear()
+                    stats.shards += 1
+                if full:
+                    # The legacy blob still holds every guild until the shards are written and marked as the source
+                    # of truth, only then is it replaced with the stripped globals
+                    await self.config.sharded.set(True)
+                    if pending.globals is not None:
+                        await _write_globals()
+            except BaseException:
+                # The snapshot already assumed success (or the write was cancelled), rewrite everything next time
+                self._full_write = True
+                raise
+
+            if full:
+                self._full_write = False
+                log.info("Config migrated to sharded storage")
+            return stats
+
+    def reset(self) -> None:
+        """Forget the written snapshot so the next save rewrites every shard (used after restoring a backup)"""
+        self._full_write = True
@@ -0,0 +1,64 @@
+import typing as t
+from dataclasses import dataclass
+from time import perf_counter
+
+T = t.TypeVar("T")
+
+
+class StageTimer:
+    """Wall-clock durations of the named stages of a single chat request
+
+    Stages may overlap, `elapsed` is the time since the timer was created.
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.durations: t.Dict[str, float] = {}
+
+    async def run(self, name: str, awaitable: t.Awaitable[T]) -> T:
+        start = perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.durations[name] = perf_counter() - start
+
+    def mark(self, name: str) -> float:
+        """Record the time since the timer started under a stage name"""
+        elapsed = self.durations[name] = perf_counter() - self.started
+        return elapsed
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}: {round(duration * 1000, 1)}ms" for name, duration in self.durations.items())
+
+
+@dataclass
+class StageStats:
+    count: int = 0
+    total: float = 0.0
+    last: float = 0.0
+    max: float = 0.0
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class StageMetrics:
+    """Running per-stage timing totals across chat requests"""
+
+    def __init__(self):
+        self.stages: t.Dict[str, StageStats] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.stages)
+
+    def record(self, timer: StageTimer) -> None:
+        for name, duration in timer.durations.items():
+            stats = self.stages.setdefault(name, StageStats())
+            stats.count += 1
+            stats.total += duration
+            stats.last = duration
+            stats.max = max(stats.max, duration)
+
+    def clear(self) -> None:
+        self.stages.clear()
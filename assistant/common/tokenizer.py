@@ -0,0 +1,218 @@
+import asyncio
+import typing as t
+from collections import OrderedDict
+from functools import lru_cache
+
+import tiktoken
+
+from .constants import VISION_COSTS
+
+DEFAULT_ENCODING = "o200k_base"
+# Strings shorter than this are encoded inline instead of hopping to a thread
+SYNC_ENCODE_LIMIT = 4000
+# Max function schemas with a cached token cost
+SCHEMA_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=128)
+def get_encoding_name(model: str) -> str:
+    """Resolve the tiktoken encoding name for a model, falling back to o200k_base for unknown models"""
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return DEFAULT_ENCODING
+
+
+_encodings: t.Dict[str, tiktoken.Encoding] = {}
+
+
+def get_encoding_by_name(name: str) -> tiktoken.Encoding:
+    encoding = _encodings.get(name)
+    if encoding is None:
+        encoding = _encodings[name] = tiktoken.get_encoding(name)
+    return encoding
+
+
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Get the (cached) tiktoken encoder for a model"""
+    return get_encoding_by_name(get_encoding_name(model))
+
+
+def is_loaded(model: str) -> bool:
+    """Whether the encoder for this model has been loaded (first load may read BPE files from disk)"""
+    return get_encoding_name(model) in _encodings
+
+
+def encode(text: str, model: str) -> t.List[int]:
+    return get_encoding(model).encode(text)
+
+
+def count(text: str, model: str) -> int:
+    return len(get_encoding(model).encode(text))
+
+
+def encode_many(texts: t.Sequence[str], model: str) -> t.List[t.List[int]]:
+    """Encode a batch of strings with a single encoder lookup"""
+    if not texts:
+        return []
+    return get_encoding(model).encode_batch(list(texts))
+
+
+def count_many(texts: t.Sequence[str], model: str) -> t.List[int]:
+    """Token count of each string in a batch"""
+    return [len(tokens) for tokens in encode_many(texts, model)]
+
+
+def image_tokens(model: str) -> int:
+    """Rough prompt token cost of one image for a model"""
+    return VISION_COSTS.get(model, [1000])[0]  # Just assume around 1k tokens for images
+
+
+def count_message(message: dict, encoding_name: str) -> t.Tuple[int, int]:
+    """Count the text tokens of a single chat message payload
+
+    Returns:
+        Tuple[int, int]: text tokens (including per-message overhead) and the number of images
+    """
+    encoding = get_encoding_by_name(encoding_name)
+    tokens_per_message = 3
+    tokens_per_name = 1
+    num_tokens = tokens_per_message
+    images = 0
+    for key, value in message.items():
+        if key == "name":
+            num_tokens += tokens_per_name
+
+        if key == "content" and isinstance(value, list):
+            for item in value:
+                if item["type"] == "text":
+                    num_tokens += len(encoding.encode(item["text"]))
+                elif item["type"] == "image_url":
+                    images += 1
+        else:  # String, probably
+            num_tokens += len(encoding.encode(str(value)))
+    return num_tokens, images
+
+
+def count_messages(messages: t.Sequence[dict], model: str) -> int:
+    """Count the prompt tokens of a chat payload"""
+    if not messages:
+        return 0
+    encoding_name = get_encoding_name(model)
+    num_tokens = 0
+    for message in messages:
+        text_tokens, images = count_message(message, encoding_name)
+        num_tokens += text_tokens + images * image_tokens(model)
+    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+    return num_tokens
+
+
+async def aencode(text: str, model: str) -> t.List[int]:
+    """Encode text, only offloading to a thread when the string is long enough to block the loop"""
+    if len(text) <= SYNC_ENCODE_LIMIT and is_loaded(model):
+        return encode(text, model)
+    return await asyncio.to_thread(encode, text, model)
+
+
+async def aencode_many(texts: t.Sequence[str], model: str) -> t.List[t.List[int]]:
+    if sum(len(i) for i in texts) <= SYNC_ENCODE_LIMIT and is_loaded(model):
+        return encode_many(texts, model)
+    return await asyncio.to_thread(encode_many, texts, model)
+
+
+async def adecode(tokens: t.List[int], model: str) -> str:
+    if len(tokens) <= SYNC_ENCODE_LIMIT // 4 and is_loaded(model):
+        return get_encoding(model).decode(tokens)
+    return await asyncio.to_thread(lambda: get_encoding(model).decode(tokens))
+
+
+class SchemaCost:
+    """Token cost of a function schema
+
+    Split into the structure (property and enum counts, priced per model by the overhead table)
+    and the text tokens, which are counted once per encoding.
+    """
+
+    __slots__ = ("schema", "props", "enums", "enum_items", "lines", "text")
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        function = schema["function"] if "function" in schema else schema
+        description = function.get("description", "")
+        if description.endswith("."):
+            description = description[:-1]
+        self.lines = [f"{function['name']}:{description}"]
+        properties = function.get("parameters", {}).get("properties", {})
+        self.props = len(properties)
+        self.enums = 0
+        self.enum_items = 0
+        for name, prop in properties.items():
+            if "enum" in prop:
+                self.enums += 1
+                self.enum_items += len(prop["enum"])
+                self.lines.extend(str(item) for item in prop["enum"])
+            prop_description = prop.get("description", "")
+            if prop_description.endswith("."):
+                prop_description = prop_description[:-1]
+            self.lines.append(f"{name}:{prop.get('type', '')}:{prop_description}")
+        # {encoding_name: text tokens}
+        self.text: t.Dict[str, int] = {}
+
+    def text_tokens(self, encoding_name: str) -> int:
+        tokens = self.text.get(encoding_name)
+        if tokens is None:
+            encoding = get_encoding_by_name(encoding_name)
+            tokens = self.text[encoding_name] = sum(len(encoding.encode(line)) for line in self.lines)
+        return tokens
+
+    def total(self, encoding_name: str, overhead: t.Sequence[int]) -> int:
+        """Cost of the schema itself, the per-request `func_end` is added once by `acount_functions`"""
+        func_init, prop_init, prop_key, enum_init, enum_item, _func_end = overhead
+        tokens = func_init + self.text_tokens(encoding_name)
+        if self.props:
+            tokens += prop_init + prop_key * self.props
+        return tokens + enum_init * self.enums + enum_item * self.enum_items
+
+
+_schema_costs: "OrderedDict[int, SchemaCost]" = OrderedDict()
+
+
+def schema_cost(schema: dict) -> SchemaCost:
+    """Cached cost breakdown of a function schema
+
+    Keyed by the schema object itself, schemas are replaced rather than edited in place when they change.
+    """
+    cost = _schema_costs.get(id(schema))
+    if cost is None or cost.schema is not schema:
+        cost = _schema_costs[id(schema)] = SchemaCost(schema)
+        while len(_schema_costs) > SCHEMA_CACHE_SIZE:
+            _schema_costs.popitem(last=False)
+    else:
+        _schema_costs.move_to_end(id(schema))
+    return cost
+
+
+async def prime_schema(schema: dict, model: str = "gpt-5.1") -> None:
+    """Count a schema's text tokens ahead of time, called when a function is registered"""
+    cost = schema_cost(schema)
+    await asyncio.to_thread(cost.text_tokens, get_encoding_name(model))
+
+
+async def acount_functions(functions: t.Sequence[dict], model: str, overhead: t.Sequence[int]) -> int:
+    """Total token cost of the function schemas sent with a request
+
+    Schemas seen before are a sum of cached integers, only new schemas are encoded.
+    """
+    encoding_name = get_encoding_name(model)
+    costs = [schema_cost(schema) for schema in functions]
+    uncounted = [cost for cost in costs if encoding_name not in cost.text]
+    if uncounted:
+        if is_loaded(model) and sum(len(line) for cost in uncounted for line in cost.lines) <= SYNC_ENCODE_LIMIT:
+            for cost in uncounted:
+                cost.text_tokens(encoding_name)
+        else:
+            await asyncio.to_thread(lambda: [cost.text_tokens(encoding_name) for cost in uncounted])
+    if not costs:
+        return 0
+    func_end = overhead[5]
+    return sum(cost.total(encoding_name, overhead) for cost in costs) + func_end
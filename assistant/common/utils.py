@@ -522,6 +522,49 @@ async def ensure_tool_consistency(messages: list[dict]) -> bool:
     return purged
 
 
+def plan_degradation(roles: t.Sequence[str], weights: t.Sequence[int], excess: int) -> t.Set[int]:
+    """
+    Plan which messages to drop so a payload sheds at least `excess` tokens.
+
+    Mirrors the sweep order of the old iterative degrader: each round removes the oldest tool,
+    function, assistant and user message (in that order), stopping as soon as enough tokens are
+    freed. Rounds only start while more than one user and one assistant message remain, so the
+    latest user/assistant messages survive. System/developer messages are never dropped.
+
+    Args:
+        roles (Sequence[str]): role of each message in payload order
+        weights (Sequence[int]): token weight of each message in payload order
+        excess (int): number of tokens that need to be freed
+
+    Returns:
+        Set[int]: indexes of the messages to drop
+    """
+    sweep_order = ("tool", "function", "assistant", "user")
+    queues: t.Dict[str, t.List[int]] = {role: [] for role in sweep_order}
+    for idx, role in enumerate(roles):
+        if role in queues:
+            queues[role].append(idx)
+
+    heads = {role: 0 for role in sweep_order}
+    drop: t.Set[int] = set()
+    freed = 0
+
+    def remaining(role: str) -> int:
+        return len(queues[role]) - heads[role]
+
+    while excess > freed and remaining("user") > 1 and remaining("assistant") > 1:
+        for role in sweep_order:
+            if not remaining(role):
+                continue
+            idx = queues[role][heads[role]]
+            heads[role] += 1
+            drop.add(idx)
+            freed += weights[idx]
+            if freed >= excess:
+                break
+    return drop
+
+
 def convert_openai_to_ollama_tool(openai_schema: dict) -> dict:
     """Convert single OpenAI function schema to Ollama tool format."""
     required_fields = ("name", "description", "parameters")
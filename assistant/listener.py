@@ -1,9 +1,7 @@
 import asyncio
-import functools
 import logging
-import multiprocessing as mp
-import re
 import typing as t
+from collections import Counter
 from io import StringIO
 
 import discord
@@ -13,6 +11,8 @@ from redbot.core.i18n import Translator
 from .abc import MixinMeta
 from .common.calls import create_memory_call
 from .common.constants import REACT_SUMMARY_MESSAGE
+from .common.models import delete_vector_store
+from .common.patterns import search_any
 from .common.utils import can_use, embed_to_content, is_question
 
 log = logging.getLogger("red.vrt.assistant.listener")
@@ -23,76 +23,112 @@ class AssistantListener(MixinMeta):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.responding_to = set()
-
-    async def safe_regex_search(self, pattern: str, content: str) -> bool:
-        """Safely check if a regex pattern matches content using multiprocessing pool for timeout."""
-        try:
-            # Use re.findall which returns a list (picklable) instead of re.search which returns a Match (not picklable)
-            process = self.mp_pool.apply_async(
-                re.findall,
-                args=(pattern, content, re.IGNORECASE),
-            )
-            task = functools.partial(process.get, timeout=2)
-            loop = asyncio.get_running_loop()
-            new_task = loop.run_in_executor(None, task)
-            result = await asyncio.wait_for(new_task, timeout=5)
-            return len(result) > 0
-        except (asyncio.TimeoutError, mp.TimeoutError):
-            log.warning(f"Regex pattern '{pattern}' took too long to process")
-            return False
-        except Exception as e:
-            log.error(f"Error checking regex pattern: {e}")
-            return False
+        # {stage: count} of messages seen by the auto-reply handler
+        self.listener_stats: t.Counter[str] = Counter()
 
     async def matches_trigger(self, content: str, trigger_phrases: t.List[str]) -> bool:
         """Check if the message content matches any trigger phrase (regex patterns)."""
-        for pattern in trigger_phrases:
-            if await self.safe_regex_search(pattern, content):
-                return True
-        return False
+        return await search_any(trigger_phrases, content, self.mp_pool)
 
     @commands.Cog.listener("on_message_without_command")
     async def handler(self, message: discord.Message):
-        # If message object is None for some reason
-        if not message:
+        """Auto-reply pipeline
+
+        Cheap synchronous checks run first so most messages are dropped in microseconds,
+        the regex trigger and embedding (network) stages only run for messages still in scope.
+        Every early return is counted in `listener_stats` under the stage that dropped it.
+        """
+        stats = self.listener_stats
+        stats["received"] += 1
+        # If message object is None for some reason, or it wasn't sent in a guild
+        if not message or not message.guild or not message.channel:
+            stats["dropped_no_guild"] += 1
             return
         if message.author.id in self.responding_to:
-            return
-        # If message wasn't sent in a guild
-        if not message.guild:
+            stats["dropped_busy"] += 1
             return
         # If message was from a bot
         if message.author.bot and not self.db.listen_to_bots:
+            stats["dropped_bot"] += 1
             return
         # Ignore messages without content
         if not message.content:
             if not message.embeds:
+                stats["dropped_empty"] += 1
                 return
             # Replace message content with embed content
             embed_to_content(message)
-        # Ignore if channel doesn't exist
-        if not message.channel:
-            return
-        # Check if cog is disabled
-        if await self.bot.cog_disabled_in_guild(self, message.guild):
-            return
-        # Check permissions
-        if not message.channel.permissions_for(message.guild.me).send_messages:
-            return
-        if not message.channel.permissions_for(message.guild.me).embed_links:
+        # Ignore common prefixes from other bots
+        if message.content.startswith((",", ".", "+", "!", "-", "><", "?", "$", "%", "^", "&", "*", "_")):
+            stats["dropped_prefix"] += 1
             return
 
         conf = self.db.get_conf(message.guild)
         if not conf.enabled or (not conf.api_key and not self.db.endpoint_override):
+            stats["dropped_disabled"] += 1
+            return
+        if len(message.content.strip()) < conf.min_length:
+            stats["dropped_too_short"] += 1
             return
 
         channel = message.channel
+        filters = conf.listener_filter()
+        if not await can_use(message, filters.blacklist, respond=False):
+            stats["dropped_blacklist"] += 1
+            return
+
         mention_ids = [m.id for m in message.mentions]
         bot_mentioned = self.bot.user.id in mention_ids
+        if mention_ids and not bot_mentioned:
+            # Do not respond to messages that mention someone else
+            stats["dropped_reply_to_other"] += 1
+            return
+
+        # Figure out which paths could still lead to a reply before doing any slow work
+        category_id = getattr(channel, "category_id", 0)
+        in_channel = channel.id == conf.channel_id or channel.id in filters.listen_channels
+        check_trigger = all(
+            [
+                conf.trigger_enabled,
+                conf.trigger_phrases,
+                channel.id not in filters.trigger_ignore_channels,
+                category_id not in filters.trigger_ignore_channels,
+            ]
+        )
+        check_auto_answer = all(
+            [
+                conf.auto_answer,
+                channel.id not in filters.auto_answer_ignored_channels,
+                category_id not in filters.auto_answer_ignored_channels,
+                message.author.id not in filters.tutors,
+                not any(role.id in filters.tutors for role in getattr(message.author, "roles", [])),
+            ]
+        ) and is_question(message.content)
+        has_reference = bool(getattr(message, "reference", None))
+        could_reply = [
+            in_channel,
+            check_trigger,
+            check_auto_answer,
+            # Mentioned directly, or possibly replying to the bot
+            (bot_mentioned or has_reference) and conf.mention_respond,
+        ]
+        if not any(could_reply):
+            stats["dropped_out_of_scope"] += 1
+            return
+
+        # Check permissions
+        perms = channel.permissions_for(message.guild.me)
+        if not perms.send_messages or not perms.embed_links:
+            stats["dropped_permissions"] += 1
+            return
+        # Check if cog is disabled
+        if await self.bot.cog_disabled_in_guild(self, message.guild):
+            stats["dropped_disabled"] += 1
+            return
 
         ref: discord.Message = None
         # If bot wasnt mentioned in the message, see if someone replied to it
-        if not bot_mentioned and hasattr(message, "reference") and message.reference:
+        if not bot_mentioned and has_reference:
             ref = message.reference.resolved
             if not isinstance(ref, discord.Message):
                 try:
@@ -103,12 +139,9 @@ class AssistantListener(MixinMeta):
         if ref and ref.author.id == self.bot.user.id:
             bot_mentioned = True
 
-        # Ignore common prefixes from other bots
-        if message.content.startswith((",", ".", "+", "!", "-", "><", "?", "$", "%", "^", "&", "*", "_")):
-            return
-        if not await can_use(message, conf.blacklist, respond=False):
-            return
-        if len(message.content.strip()) < conf.min_length:
+        if ref is not None and ref.author.id != self.bot.user.id:
+            # Do not respond to messages that are replies to other messages
+            stats["dropped_reply_to_other"] += 1
             return
 
         handle_message_kwargs = {
@@ -118,69 +151,52 @@ class AssistantListener(MixinMeta):
             "listener": True,
         }
 
-        # Return under the following conditions
-        if (ref is not None and ref.author.id != self.bot.user.id) or (
-            mention_ids and self.bot.user.id not in mention_ids
-        ):
-            # Do not respond to messages that are replies to other messages or mention someone else
-            return
-
         # Check for trigger word matches (this can override other conditions)
         trigger_matched = False
-        check_trigger = [
-            conf.trigger_enabled,
-            conf.trigger_phrases,
-            channel.id not in conf.trigger_ignore_channels,
-            getattr(channel, "category_id", 0) not in conf.trigger_ignore_channels,
-        ]
-        if all(check_trigger):
+        if check_trigger:
             if await self.matches_trigger(message.content, conf.trigger_phrases):
                 trigger_matched = True
                 if conf.trigger_prompt:
                     handle_message_kwargs["trigger_prompt"] = conf.trigger_prompt
 
         conditions = [
-            (channel.id != conf.channel_id and channel.id not in conf.listen_channels),
-            (not bot_mentioned or not conf.mention_respond),
+            in_channel,
+            not message.content.endswith("?"),
+            conf.endswith_questionmark,
+            not bot_mentioned,
             not trigger_matched,  # If trigger matched, don't skip
         ]
-        check_auto_answer = [
-            conf.auto_answer,
-            channel.id not in conf.auto_answer_ignored_channels,
-            getattr(channel, "category_id", 0) not in conf.auto_answer_ignored_channels,
-            message.author.id not in conf.tutors,
-            not any([role.id in conf.tutors for role in getattr(message.author, "roles", [])]),
-        ]
-        if all(check_auto_answer):
-            if is_question(message.content):
-                # Check if any embeddings match above the threshold
-                embedding = await self.request_embedding(message.content, conf)
-                related = await asyncio.to_thread(
-                    conf.get_related_embeddings,
-                    guild_id=message.guild.id,
-                    query_embedding=embedding,
-                    top_n_override=1,
-                    relatedness_override=conf.auto_answer_threshold,
-                )
-                conditions.append(len(related) == 0)
-                if len(related) > 0:
-                    handle_message_kwargs["model_override"] = conf.auto_answer_model
-                    handle_message_kwargs["auto_answer"] = True
         if all(conditions):
-            # Message was not in the assistant channel and bot was not mentioned and auto answer is enabled and no related embeddings
+            # Message was in the assistant channel and didn't end with a question mark while the config requires it
+            stats["dropped_question_mark"] += 1
             return
 
         conditions = [
-            (channel.id == conf.channel_id or channel.id in conf.listen_channels),
-            not message.content.endswith("?"),
-            conf.endswith_questionmark,
-            self.bot.user.id not in mention_ids,
+            not in_channel,
+            (not bot_mentioned or not conf.mention_respond),
             not trigger_matched,  # If trigger matched, don't skip
         ]
+        if check_auto_answer:
+            # Check if any embeddings match above the threshold
+            stats["auto_answer_checked"] += 1
+            embedding = await self.request_embedding(message.content, conf)
+            related = await asyncio.to_thread(
+                conf.get_related_embeddings,
+                guild_id=message.guild.id,
+                query_embedding=embedding,
+                top_n_override=1,
+                relatedness_override=conf.auto_answer_threshold,
+            )
+            conditions.append(len(related) == 0)
+            if len(related) > 0:
+                handle_message_kwargs["model_override"] = conf.auto_answer_model
+                handle_message_kwargs["auto_answer"] = True
         if all(conditions):
-            # Message was in the assistant channel and didn't end with a question mark while the config requires it
+            # Message was not in the assistant channel and bot was not mentioned and auto answer is enabled and no related embeddings
+            stats["dropped_no_match"] += 1
             return
 
+        stats["responded"] += 1
         self.responding_to.add(message.author.id)
         try:
             async with channel.typing():
@@ -193,6 +209,8 @@ class AssistantListener(MixinMeta):
         if guild.id in self.db.configs:
             log.info(f"Bot removed from {guild.name}, cleaning up...")
             del self.db.configs[guild.id]
+            await asyncio.to_thread(delete_vector_store, guild.id)
+            self.answer_cache.clear(guild.id)
             await self.save_conf()
 
     @commands.Cog.listener("on_raw_reaction_add")